@@ -0,0 +1,118 @@
+"""
+benchmarks/reversible_memory.py
+
+Peak memory (RSS) of one forward + backward pass through the (pytorch)
+`Dynamics`, with and without `reversible_backprop`, vs. trajectory length.
+
+Each configuration is run in a fresh subprocess, since the peak RSS of a
+process (`ru_maxrss`) never decreases.
+
+Usage:
+    python3 benchmarks/reversible_memory.py --nleapfrog 10 25 50
+"""
+from __future__ import absolute_import, division, print_function, annotations
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import time
+
+
+def peak_rss_mib() -> float:
+    # NOTE: `ru_maxrss` is in KiB on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+
+
+def build(args: argparse.Namespace, nleapfrog: int, reversible: bool):
+    from l2hmc.configs import DynamicsConfig, InputSpec, NetworkConfig
+    from l2hmc.dynamics.pytorch.dynamics import Dynamics
+    from l2hmc.lattice.u1.pytorch.lattice import LatticeU1
+    from l2hmc.network.pytorch.network import NetworkFactory
+    config = DynamicsConfig(
+        nchains=args.nchains,
+        group='U1',
+        latvolume=list(args.latvolume),
+        nleapfrog=nleapfrog,
+        eps=0.1,
+        use_ncp=True,
+        merge_directions=True,
+        reversible_backprop=reversible,
+    )
+    xdim = config.xdim
+    input_spec = InputSpec(
+        xshape=tuple(config.xshape),
+        vnet={'v': [xdim], 'x': [xdim]},
+        xnet={'v': [xdim], 'x': [xdim, 2]},
+    )
+    network_config = NetworkConfig(
+        units=list(args.units),
+        activation_fn='relu',
+        dropout_prob=0.,
+        use_batch_norm=False,
+    )
+    lattice = LatticeU1(args.nchains, list(args.latvolume))
+    dynamics = Dynamics(
+        config=config,
+        potential_fn=lattice.action,
+        force_fn=lattice.force,
+        network_factory=NetworkFactory(
+            input_spec=input_spec, network_config=network_config
+        ),
+    )
+    return dynamics, lattice
+
+
+def run_one(args: argparse.Namespace) -> dict:
+    import torch
+    torch.manual_seed(0)
+    dynamics, lattice = build(args, args.run[0], bool(args.run[1]))
+    x = lattice.draw_uniform_batch().reshape(args.nchains, -1).detach()
+    beta = torch.tensor(1.)
+    setup = peak_rss_mib()
+    t0 = time.perf_counter()
+    xout, metrics = dynamics((x, beta))
+    loss = (metrics['acc'] * (1. - torch.cos(xout - x)).sum(-1)).mean()
+    loss.backward()
+    return {
+        'setup': setup,
+        'peak': peak_rss_mib(),
+        'time': time.perf_counter() - t0,
+    }
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--nleapfrog', type=int, nargs='+',
+                        default=[10, 25, 50])
+    parser.add_argument('--nchains', type=int, default=128)
+    parser.add_argument('--latvolume', type=int, nargs=2, default=[16, 16])
+    parser.add_argument('--units', type=int, nargs='+', default=[32, 32])
+    # NOTE: Internal, runs a single `(nleapfrog, reversible)` configuration
+    parser.add_argument('--run', type=int, nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.run is not None:
+        print(json.dumps(run_one(args)))
+        return
+
+    common = [
+        '--nchains', str(args.nchains),
+        '--latvolume', *map(str, args.latvolume),
+        '--units', *map(str, args.units),
+    ]
+    print(f'{"nleapfrog":>9} {"reversible":>10} {"peak [MiB]":>11} '
+          f'{"+activations [MiB]":>19} {"time [s]":>9}')
+    for nlf in args.nleapfrog:
+        for reversible in (0, 1):
+            out = subprocess.run(
+                [sys.executable, __file__, *common,
+                 '--run', str(nlf), str(reversible)],
+                check=True, capture_output=True, text=True,
+            )
+            res = json.loads(out.stdout.strip().splitlines()[-1])
+            print(f'{nlf:>9} {bool(reversible)!s:>10} {res["peak"]:>11.1f} '
+                  f'{res["peak"] - res["setup"]:>19.1f} {res["time"]:>9.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+"""
+benchmarks/su3_group.py
+
+Throughput (links / s) of the closed-form SU(3) `expTAH3` and `logSU3`,
+vs. the generic `torch.linalg.matrix_exp`, on a batch of random links.
+
+Usage:
+    python3 benchmarks/su3_group.py --nlinks 1000000 --device cpu
+"""
+from __future__ import absolute_import, division, print_function, annotations
+import argparse
+import time
+from typing import Callable
+
+import torch
+
+from l2hmc.group.pytorch import group as g
+
+
+def timeit(fn: Callable, x: torch.Tensor, nrepeat: int) -> float:
+    fn(x)
+    if x.device.type == 'cuda':
+        torch.cuda.synchronize()
+    t0 = time.perf_counter()
+    for _ in range(nrepeat):
+        fn(x)
+    if x.device.type == 'cuda':
+        torch.cuda.synchronize()
+    return (time.perf_counter() - t0) / nrepeat
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--nlinks', type=int, default=10 ** 6)
+    parser.add_argument('--scale', type=float, default=1.,
+                        help='Scale of the (random) su(3) generators')
+    parser.add_argument('--nrepeat', type=int, default=3)
+    parser.add_argument('--device', type=str, default='cpu')
+    args = parser.parse_args(argv)
+    torch.manual_seed(0)
+    print(f'{"dtype":>10} {"function":>12} {"time [s]":>9} '
+          f'{"links / s":>11}')
+    for dtype in (torch.complex64, torch.complex128):
+        x = args.scale * g.randTAH3([args.nlinks]).to(args.device, dtype)
+        u = g.expTAH3(x)
+        fns = {
+            'matrix_exp': torch.linalg.matrix_exp,
+            'expTAH3': g.expTAH3,
+            'logSU3': g.logSU3,
+        }
+        for name, fn in fns.items():
+            inputs = u if name == 'logSU3' else x
+            dt = timeit(fn, inputs, args.nrepeat)
+            print(f'{str(dtype).split(".")[-1]:>10} {name:>12} '
+                  f'{dt:>9.3f} {args.nlinks / dt:>11.3g}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+"""
+benchmarks/torch_compile.py
+
+Training throughput (steps / s) of the (pytorch) `Trainer` on U(1), for a
+full `train_step` (forward + backward + optimizer step), eager vs. compiled
+with `torch.compile` (i.e. `Trainer(compile=True)`).
+
+The first (few) `--warmup` steps, which include the (lazy) compilation, are
+timed separately and excluded from the throughput.
+
+Usage:
+    python3 benchmarks/torch_compile.py --latvolume 16 16 --nchains 64
+"""
+from __future__ import absolute_import, division, print_function, annotations
+import argparse
+import time
+
+import torch
+from accelerate import Accelerator
+
+from l2hmc.configs import (
+    AnnealingSchedule,
+    DynamicsConfig,
+    InputSpec,
+    LearningRateConfig,
+    LossConfig,
+    NetworkConfig,
+    Steps,
+)
+from l2hmc.dynamics.pytorch.dynamics import Dynamics
+from l2hmc.lattice.u1.pytorch.lattice import LatticeU1
+from l2hmc.loss.pytorch.loss import LatticeLoss
+from l2hmc.network.pytorch.network import NetworkFactory
+from l2hmc.trainers.pytorch.trainer import Trainer
+
+
+def build(args: argparse.Namespace, compile: bool) -> Trainer:
+    config = DynamicsConfig(
+        nchains=args.nchains,
+        group='U1',
+        latvolume=list(args.latvolume),
+        nleapfrog=args.nleapfrog,
+        eps=0.1,
+        merge_directions=True,
+    )
+    xdim = config.xdim
+    input_spec = InputSpec(
+        xshape=tuple(config.xshape),
+        vnet={'v': [xdim], 'x': [xdim]},
+        xnet={'v': [xdim], 'x': [xdim, 2]},
+    )
+    network_config = NetworkConfig(
+        units=list(args.units),
+        activation_fn='relu',
+        dropout_prob=0.,
+        use_batch_norm=False,
+    )
+    lattice = LatticeU1(args.nchains, list(args.latvolume))
+    dynamics = Dynamics(
+        config=config,
+        potential_fn=lattice.action,
+        force_fn=lattice.force,
+        network_factory=NetworkFactory(
+            input_spec=input_spec, network_config=network_config
+        ),
+    )
+    accelerator = Accelerator(cpu=True)
+    optimizer = torch.optim.Adam(dynamics.parameters(), lr=1e-3)
+    dynamics, optimizer = accelerator.prepare(dynamics, optimizer)
+    nsteps = args.warmup + args.nsteps
+    steps = Steps(nera=1, nepoch=nsteps, test=1)
+    schedule = AnnealingSchedule(beta_init=args.beta, beta_final=args.beta)
+    schedule.setup(steps)
+    return Trainer(
+        steps=steps,
+        dynamics=dynamics,
+        accelerator=accelerator,
+        optimizer=optimizer,
+        schedule=schedule,
+        lr_config=LearningRateConfig(lr_init=1e-3, warmup=0),
+        loss_fn=LatticeLoss(lattice=lattice, loss_config=LossConfig()),
+        dynamics_config=config,
+        compile=compile,
+    )
+
+
+def steps_per_sec(
+        args: argparse.Namespace,
+        compile: bool,
+) -> tuple[float, float]:
+    """Returns (time of the warmup steps, steps / s after warmup)."""
+    torch.manual_seed(0)
+    trainer = build(args, compile=compile)
+    x = trainer.draw_x()
+    beta = torch.tensor(args.beta)
+    t0 = time.perf_counter()
+    for _ in range(args.warmup):
+        x, _ = trainer.train_step((x, beta))
+    twarmup = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    for _ in range(args.nsteps):
+        x, _ = trainer.train_step((x, beta))
+    return twarmup, args.nsteps / (time.perf_counter() - t0)
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--latvolume', type=int, nargs=2, default=[16, 16])
+    parser.add_argument('--nchains', type=int, default=64)
+    parser.add_argument('--nleapfrog', type=int, default=10)
+    parser.add_argument('--units', type=int, nargs='+', default=[32, 32])
+    parser.add_argument('--beta', type=float, default=1.)
+    parser.add_argument('--nsteps', type=int, default=20)
+    parser.add_argument('--warmup', type=int, default=2)
+    args = parser.parse_args(argv)
+    twarm_eager, eager = steps_per_sec(args, compile=False)
+    twarm_compiled, compiled = steps_per_sec(args, compile=True)
+    print(f'eager:    {eager:8.2f} steps / s  '
+          f'(warmup: {twarm_eager:.1f} s)')
+    print(f'compiled: {compiled:8.2f} steps / s  '
+          f'(warmup: {twarm_compiled:.1f} s, {compiled / eager:.2f}x)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""
+benchmarks/u1_force.py
+
+Sampling throughput (steps / s) of the (pytorch) U(1) `Dynamics`, computing
+the force with the analytic `LatticeU1.force` vs. with autograd.
+
+Usage:
+    python3 benchmarks/u1_force.py --latvolume 16 16 --nchains 64
+"""
+from __future__ import absolute_import, division, print_function, annotations
+import argparse
+import time
+
+import torch
+
+from l2hmc.configs import DynamicsConfig, InputSpec, NetworkConfig
+from l2hmc.dynamics.pytorch.dynamics import Dynamics
+from l2hmc.lattice.u1.pytorch.lattice import LatticeU1
+from l2hmc.network.pytorch.network import NetworkFactory
+
+
+def build(args: argparse.Namespace, analytic: bool):
+    config = DynamicsConfig(
+        nchains=args.nchains,
+        group='U1',
+        latvolume=list(args.latvolume),
+        nleapfrog=args.nleapfrog,
+        eps=0.1,
+        merge_directions=True,
+    )
+    xdim = config.xdim
+    input_spec = InputSpec(
+        xshape=tuple(config.xshape),
+        vnet={'v': [xdim], 'x': [xdim]},
+        xnet={'v': [xdim], 'x': [xdim, 2]},
+    )
+    network_config = NetworkConfig(
+        units=list(args.units),
+        activation_fn='relu',
+        dropout_prob=0.,
+        use_batch_norm=False,
+    )
+    lattice = LatticeU1(args.nchains, list(args.latvolume))
+    dynamics = Dynamics(
+        config=config,
+        potential_fn=lattice.action,
+        force_fn=(lattice.force if analytic else None),
+        network_factory=NetworkFactory(
+            input_spec=input_spec, network_config=network_config
+        ),
+    )
+    return dynamics, lattice
+
+
+def steps_per_sec(args: argparse.Namespace, analytic: bool) -> float:
+    torch.manual_seed(0)
+    dynamics, lattice = build(args, analytic=analytic)
+    x = lattice.draw_uniform_batch(requires_grad=False)
+    x = x.reshape(args.nchains, -1)
+    beta = torch.tensor(args.beta)
+    for _ in range(args.warmup):
+        x, _ = dynamics((x, beta))
+        x = x.detach()
+    t0 = time.perf_counter()
+    for _ in range(args.nsteps):
+        x, _ = dynamics((x, beta))
+        x = x.detach()
+    return args.nsteps / (time.perf_counter() - t0)
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--latvolume', type=int, nargs=2, default=[16, 16])
+    parser.add_argument('--nchains', type=int, default=64)
+    parser.add_argument('--nleapfrog', type=int, default=10)
+    parser.add_argument('--units', type=int, nargs='+', default=[32, 32])
+    parser.add_argument('--beta', type=float, default=2.)
+    parser.add_argument('--nsteps', type=int, default=20)
+    parser.add_argument('--warmup', type=int, default=2)
+    args = parser.parse_args(argv)
+    autograd = steps_per_sec(args, analytic=False)
+    analytic = steps_per_sec(args, analytic=True)
+    print(f'autograd: {autograd:8.2f} steps / s')
+    print(f'analytic: {analytic:8.2f} steps / s  ({analytic / autograd:.2f}x)')
+
+
+if __name__ == '__main__':
+    main()
@@ -5,22 +5,26 @@ Contains methods intended to be shared across frameworks.
 """
 from __future__ import absolute_import, annotations, division, print_function
 import datetime
+import json
 import logging
 import os
 from pathlib import Path
-from typing import Any, Optional
+from typing import Any, Optional, Sequence
 
 import h5py
 import joblib
+import numpy as np
 from omegaconf import DictConfig
 import pandas as pd
 from rich.console import Console
 from rich.table import Table
-import wandb
 import xarray as xr
 
 from l2hmc.configs import AnnealingSchedule, Steps
-from l2hmc.utils.plot_helpers import make_ridgeplots, plot_dataArray
+import l2hmc.utils.autocorr as ac
+from l2hmc.utils.jackknife import error_analysis, save_summary
+from l2hmc.utils.reader import open_dataset, open_h5pyfile  # noqa:F401
+from l2hmc.utils.render import render_dataset
 from l2hmc.utils.rich import is_interactive
 
 os.environ['AUTOGRAPH_VERBOSITY'] = '0'
@@ -95,15 +99,18 @@ def dataset_to_h5pyfile(hfile: os.PathLike, dataset: xr.Dataset, **kwargs):
             if len(arr.shape) > 1:
                 maxshape = (None, *arr.shape[1:])
             f.create_dataset(key, data=arr, maxshape=maxshape, **kwargs)
+            f[key].attrs['dims'] = list(val.dims)
 
     f.close()
 
 
-def dataset_from_h5pyfile(hfile: os.PathLike) -> dict:
-    f = h5py.File(hfile, 'r')
-    data = {key: f[key] for key in list(f.keys())}
-    f.close()
-    return data
+def dataset_from_h5pyfile(hfile: os.PathLike) -> xr.Dataset:
+    """Returns a lazy `xr.Dataset` view of the data saved in `hfile`.
+
+    Arrays are only read from disk when (sliced and) accessed, see
+    `l2hmc.utils.reader.open_dataset`.
+    """
+    return open_dataset(hfile)
 
 
 def table_to_dict(table: Table, data: Optional[dict] = None) -> dict:
@@ -177,6 +184,7 @@ def save_logs(
     df.to_csv(dfile.as_posix())
 
     if run is not None:
+        import wandb
         with open(hfile.as_posix(), 'r') as f:
             html = f.read()
 
@@ -207,45 +215,29 @@ def plot_dataset(
         outdir: Optional[os.PathLike] = None,
         title: Optional[str] = None,
         job_type: Optional[str] = None,
+        formats: Optional[Sequence[str]] = None,
+        dpi: Optional[int] = 500,
+        num_workers: Optional[int] = None,
         # run: Any = None,
-) -> None:
+) -> list[Path]:
+    """Plot all variables in `dataset` (and ridgeplots) in parallel.
+
+    See `l2hmc.utils.render.render_dataset` for details. Figures are saved
+    as `outdir/{key}.svg` and `outdir/pngs/{key}.png` (by default), and are
+    skipped if the underlying data hasn't changed since the last call.
+    """
     outdir = Path(outdir) if outdir is not None else Path(os.getcwd())
     outdir.mkdir(exist_ok=True, parents=True)
     # outdir = outdir.joinpath('plots')
     job_type = job_type if job_type is not None else f'job-{get_timestamp()}'
-    for key, val in dataset.data_vars.items():
-        if key == 'x':
-            continue
-
-        try:
-            fig, _, _ = plot_dataArray(val,
-                                       key=key,
-                                       title=title,
-                                       line_labels=False,
-                                       num_chains=nchains)
-        except TypeError:
-            log.error(f'Unable to `plot_dataArray` for {key}')
-            continue
-
-        pngdir = outdir.joinpath('pngs')
-        outdir.mkdir(exist_ok=True, parents=True)
-        pngdir.mkdir(exist_ok=True, parents=True)
-
-        fsvg = outdir.joinpath(f'{key}.svg')
-        fpng = pngdir.joinpath(f'{key}.png')
-        if fsvg.is_file():
-            fsvg = outdir.joinpath(f'xarray-{key}.svg')
-        if fpng.is_file():
-            fpng = pngdir.joinpath(f'xarray-{key}.svg')
-
-        fig.savefig(fsvg.as_posix(), dpi=500, bbox_inches='tight')
-        fig.savefig(fpng.as_posix(), dpi=500, bbox_inches='tight')
-
-    _ = make_ridgeplots(dataset,
-                        outdir=outdir,
-                        drop_nans=True,
-                        drop_zeros=False,
-                        num_chains=nchains)
+    formats = ['svg', 'png'] if formats is None else list(formats)
+    return render_dataset(dataset,
+                          outdir=outdir,
+                          title=title,
+                          nchains=nchains,
+                          formats=formats,
+                          dpi=(500 if dpi is None else dpi),
+                          num_workers=num_workers)
 
 
 def analyze_dataset(
@@ -257,14 +249,28 @@ def analyze_dataset(
         save: Optional[bool] = True,
         run: Optional[Any] = None,
         use_hdf5: Optional[bool] = True,
+        beta: Optional[float] = None,
+        volume: Optional[float] = None,
+        plot_kwargs: Optional[dict] = None,
 ):
+    """Plot (and save) `dataset`, along with a summary of its errors.
+
+    Any `plot_kwargs` (e.g. `formats`, `dpi`, `num_workers`) are passed to
+    `plot_dataset`.
+
+    The summary (see `l2hmc.utils.jackknife.error_analysis`) is saved to
+    `{job_type}_summary.csv`, next to the saved data. If `beta` (U(1)) or
+    `volume` are given, it includes `dplaq` and `chi_Q`, respectively.
+    """
     job_type = job_type if job_type is not None else f'job-{get_timestamp()}'
     dirs = make_subdirs(outdir)
+    plot_kwargs = {} if plot_kwargs is None else plot_kwargs
     plot_dataset(dataset,
                  nchains=nchains,
                  title=title,
                  job_type=job_type,
-                 outdir=dirs['plots'])
+                 outdir=dirs['plots'],
+                 **plot_kwargs)
     if save:
         try:
             datafile = save_dataset(dataset,
@@ -280,8 +286,16 @@ def analyze_dataset(
                 except Exception:
                     log.error(f'Unable to `joblib.dump` {key}, skipping!')
 
+        try:
+            summary = error_analysis(dataset, beta=beta, volume=volume)
+            _ = save_summary(summary, outdir=dirs['data'], job_type=job_type)
+            log.info(f'[{job_type}] Error analysis:\n{summary.to_string()}')
+        except Exception:
+            log.exception('Unable to run error analysis, skipping!')
+
         artifact = None
         if job_type is not None and run is not None:
+            import wandb
             name = f'{job_type}-{run.id}'
             artifact = wandb.Artifact(name=name, type='result')
             pngdir = Path(dirs['plots']).joinpath('pngs').as_posix()
@@ -295,6 +309,151 @@ def analyze_dataset(
     return dataset
 
 
+def analyze_autocorr(
+        dataset: xr.Dataset,
+        outdir: os.PathLike,
+        job_type: str,
+        timer: Optional[Any] = None,
+        therm_frac: float = 0.0,
+        run: Optional[Any] = None,
+        keys: Optional[list[str]] = None,
+) -> dict:
+    """Compute integrated autocorrelation times / ESS of (charge) metrics.
+
+    If `timer` (`StepTimer`) is provided, also compute the ESS per second /
+    trajectory / evaluation, accounting for the `therm_frac` of draws that
+    were dropped from `dataset`. Results are saved (as json) to
+    `outdir/data/{job_type}_autocorr.json`.
+    """
+    rate = None
+    nsteps = None
+    if timer is not None and len(timer.data) > 0:
+        rate = timer.get_eval_rate()
+        nsteps = (1. - therm_frac) * rate['num_steps']
+
+    summary = ac.summarize(dataset, keys=keys, rate=rate, nsteps=nsteps)
+    for key, val in summary.items():
+        log.info(f'[{job_type}] {key}: ' + ', '.join([
+            f'{k}={v:.4g}' for k, v in val.items()
+        ]))
+        if run is not None:
+            for k, v in val.items():
+                run.summary[f'{key}_{job_type}.{k}'] = v
+
+    outfile = Path(outdir).joinpath('data', f'{job_type}_autocorr.json')
+    outfile.parent.mkdir(exist_ok=True, parents=True)
+    with open(outfile, 'w') as f:
+        json.dump(summary, f, indent=4)
+
+    return summary
+
+
+def analyze_beta_scan(
+        dataset: xr.Dataset,
+        outdir: os.PathLike,
+        job_type: str,
+        volume: Optional[float] = None,
+        run: Optional[Any] = None,
+        charge: str = 'intQ',
+) -> pd.DataFrame:
+    """Summarize a (batched) beta scan, i.e. `dataset` w/ per-chain `beta`.
+
+    Each variable is averaged over draws (and any other dims) per chain,
+    and the chain means are then grouped by beta, with errors from their
+    spread (chains are independent). If `volume` is given, this includes
+    the topological susceptibility `chi_Q = <Q^2> / volume`.
+
+    Results are saved to `outdir/data/{job_type}_beta_scan.csv`.
+    """
+    # NOTE: beta is constant along `draw` for each chain
+    betas = dataset['beta'].isel(draw=0).values.reshape(-1)
+    chain_means = {}
+    for key, val in dataset.data_vars.items():
+        if key == 'beta' or 'chain' not in val.dims or 'draw' not in val.dims:
+            continue
+        chain_means[str(key)] = val.mean(
+            [d for d in val.dims if d != 'chain']
+        ).values
+    if volume is not None and charge in dataset.data_vars:
+        q = dataset[charge]
+        chain_means['chi_Q'] = (q ** 2).mean(
+            [d for d in q.dims if d != 'chain']
+        ).values / volume
+
+    df = pd.DataFrame(chain_means)
+    df.insert(0, 'beta', betas)
+    grouped = df.groupby('beta')
+    summary = pd.concat([
+        grouped.mean().add_suffix('/mean'),
+        grouped.sem().add_suffix('/err'),
+    ], axis=1).sort_index(axis=1)
+    summary.insert(0, 'nchains', grouped.size())
+    log.info(f'[{job_type}] Beta scan:\n{summary.to_string()}')
+    if run is not None:
+        for beta, row in summary.iterrows():
+            for key, val in row.items():
+                run.summary[f'{key}_{job_type}.beta{beta:g}'] = val
+
+    outfile = Path(outdir).joinpath('data', f'{job_type}_beta_scan.csv')
+    outfile.parent.mkdir(exist_ok=True, parents=True)
+    summary.to_csv(outfile, float_format='%.8g')
+
+    return summary
+
+
+def compare_autocorr(
+        autocorr: dict,
+        baseline: dict,
+        run: Optional[Any] = None,
+        job_type: str = 'eval',
+        baseline_type: str = 'hmc',
+) -> dict:
+    """Returns ratio of `ess_*` metrics in `autocorr` to those in `baseline`.
+
+    E.g. `compare_autocorr(outputs['eval']['autocorr'],
+    outputs['hmc']['autocorr'])['intQ']['ess_per_sec']` is the speedup (in
+    wall time) of the trained sampler over generic HMC.
+    """
+    ratios = {}
+    for key, val in autocorr.items():
+        base = baseline.get(key, {})
+        ratios[key] = {
+            k: v / base[k] for k, v in val.items()
+            if k.startswith('ess') and base.get(k, 0) > 0
+        }
+        if len(ratios[key]) == 0:
+            continue
+        log.info(f'[{job_type} / {baseline_type}] {key}: ' + ', '.join([
+            f'{k}={v:.4g}' for k, v in ratios[key].items()
+        ]))
+        if run is not None:
+            for k, v in ratios[key].items():
+                run.summary[f'{key}_{job_type}_vs_{baseline_type}.{k}'] = v
+
+    return ratios
+
+
+def get_error_kwargs(cfg: DictConfig) -> dict:
+    """Returns `beta`, `volume` (from `cfg`) for the error analysis of eval.
+
+    NOTE: The exact plaquette is only known for U(1), so `beta` is omitted
+    otherwise.
+    """
+    group = str(cfg.dynamics.group).upper()
+    beta = cfg.annealing_schedule.beta_final if group == 'U1' else None
+    volume = float(np.prod(cfg.dynamics.latvolume))
+    return {'beta': beta, 'volume': volume}
+
+
+def get_plot_kwargs(cfg: DictConfig) -> dict:
+    """Returns kwargs for `plot_dataset` from `cfg`."""
+    return {
+        'formats': cfg.get('plot_formats', None),
+        'dpi': cfg.get('plot_dpi', 500),
+        'num_workers': cfg.get('plot_workers', None),
+    }
+
+
 def save_and_analyze_data(
         dataset: xr.Dataset,
         outdir: os.PathLike,
@@ -303,6 +462,9 @@ def save_and_analyze_data(
         nchains: Optional[int] = -1,
         job_type: Optional[str] = None,
         framework: Optional[str] = None,
+        beta: Optional[float] = None,
+        volume: Optional[float] = None,
+        plot_kwargs: Optional[dict] = None,
 ) -> xr.Dataset:
     jstr = f'{job_type}'
     output = {} if output is None else output
@@ -317,6 +479,9 @@ def save_and_analyze_data(
                               outdir=outdir,
                               nchains=nchains,
                               job_type=job_type,
+                              beta=beta,
+                              volume=volume,
+                              plot_kwargs=plot_kwargs,
                               title=title)
     if not is_interactive():
         edir = Path(outdir).joinpath('logs')
@@ -31,9 +31,6 @@ CONF_DIR = HERE.joinpath('conf')
 LOGS_DIR = PROJECT_DIR.joinpath('logs')
 OUTPUTS_DIR = HERE.joinpath('outputs')
 
-CONF_DIR.mkdir(exist_ok=True, parents=True)
-LOGS_DIR.mkdir(exist_ok=True, parents=True)
-OUTPUTS_DIR.mkdir(exist_ok=True, parents=True)
 OUTDIRS_FILE = OUTPUTS_DIR.joinpath('outdirs.log')
 
 
@@ -43,8 +40,9 @@ MonteCarloStates = namedtuple('MonteCarloStates', ['init', 'proposed', 'out'])
 
 
 def add_to_outdirs_file(outdir: os.PathLike):
+    OUTDIRS_FILE.parent.mkdir(exist_ok=True, parents=True)
     with open(OUTDIRS_FILE, 'a') as f:
-        f.write(Path(outdir).resolve().as_posix())
+        f.write(f'{Path(outdir).resolve().as_posix()}\n')
 
 
 def get_jobdir(cfg: DictConfig, job_type: str) -> Path:
@@ -190,8 +188,8 @@ class LearningRateConfig(BaseConfig):
     factor: float = 0.98
     min_delta: float = 1e-4
     clip_norm: float = 2.0
-    # decay_steps: int = -1
-    # decay_rate: float = 1.0
+    decay_steps: int = -1
+    decay_rate: float = 1.0
     # warmup_steps: int = 100
     # min_lr: float = 1e-5
     # patience: int = 5
@@ -280,7 +278,15 @@ class DynamicsConfig(BaseConfig):
     eps_fixed: bool = False
     use_split_xnets: bool = True
     use_separate_networks: bool = True
+    # NOTE: (pytorch only) Store the per-step networks as stacked weights
+    use_stacked_networks: bool = False
     merge_directions: bool = False
+    partition_directions: bool = False
+    # NOTE: (pytorch only) Recompute intermediate leapfrog states in the
+    # backward pass instead of storing them, see `Dynamics.transition_kernel`.
+    # With `use_ncp`, this also keeps the 2π branch of x in the x updates, so
+    # that they are exactly invertible, see `Dynamics._update_x_bwd`
+    reversible_backprop: bool = False
 
     def __post_init__(self):
         assert self.group.upper() in ['U1', 'SU3']
@@ -398,6 +404,33 @@ class ExperimentConfig:
     precision: Optional[str] = 'float32'
     ignore_warnings: Optional[bool] = True
     compile: Optional[bool] = True
+    torch_compile: Optional[bool] = False
+    micro_batches: Optional[int] = 1
+    async_metrics: Optional[bool] = False
+    async_ckpt: Optional[bool] = False
+    keep_ckpts: Optional[int] = None
+    resume: Optional[str] = None
+    warm_start: Optional[bool] = False
+    chain_dir: Optional[str] = None
+    chain_branches: Optional[int] = 1
+    stream_every: Optional[int] = 0
+    stream_compression: Optional[str] = 'lzf'
+    online_stats: Optional[bool] = False
+    online_max_lag: Optional[int] = 64
+    online_bin_size: Optional[int] = 1
+    pt_replicas: Optional[int] = 0
+    pt_beta_min: Optional[float] = None
+    pt_swap_every: Optional[int] = 10
+    beta_scan: Optional[List[float]] = None
+    shard_eval: Optional[bool] = False
+    hmc_adapt_steps: Optional[int] = 0
+    hmc_target_accept: Optional[float] = 0.8
+    hmc_per_chain_eps: Optional[bool] = False
+    plot_formats: Optional[List[str]] = field(
+        default_factory=lambda: ['svg', 'png']
+    )
+    plot_dpi: Optional[int] = 500
+    plot_workers: Optional[int] = None
     name: Optional[str] = None
 
     def __post_init__(self):
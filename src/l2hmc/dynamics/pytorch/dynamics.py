@@ -15,6 +15,7 @@ from typing import Tuple
 from l2hmc.configs import DynamicsConfig
 from l2hmc.network.pytorch.network import (
     NetworkFactory,
+    to_stacked_state_dict,
 )
 import numpy as np
 import torch
@@ -31,6 +32,7 @@ Tensor = torch.Tensor
 Array = np.ndarray
 
 
+# NOTE: `beta` is either a scalar, or a (per-chain) `[nchains]` tensor
 DynamicsInput = Tuple[Tensor, Tensor]  # (xinit, beta)
 DynamicsOutput = Tuple[Tensor, dict]  # (xout, metrics)
 
@@ -85,24 +87,109 @@ def grab(x: Tensor) -> Array:
     return x.detach().cpu().numpy()
 
 
+# NOTE: A leapfrog move is `(forward, step)`, or `None` for a momentum flip
+LeapfrogMove = Optional[Tuple[bool, int]]
+
+
+class ReversibleLeapfrog(torch.autograd.Function):
+    """Runs a sequence of leapfrog moves without storing the activations.
+
+    Only the final state is kept. In the backward pass, the state before
+    each move is reconstructed by running its (exact) inverse, and the move
+    is then recomputed with autograd enabled to backpropagate through it,
+    so activation memory is constant in the trajectory length.
+
+    NOTE: This assumes the networks are deterministic (no dropout), since
+    the inverse and recomputed moves must see the same network outputs.
+    Batch norm running statistics are also updated by the recomputed moves.
+
+    NOTE: With `use_ncp`, the x updates are only exactly invertible when
+    they keep the 2π branch of x, which they do (only) when
+    `config.reversible_backprop` is set, see `Dynamics._update_x_bwd`.
+    """
+    @staticmethod
+    def forward(ctx, dynamics, moves, history, beta, x, v, *params):
+        ctx.dynamics = dynamics
+        ctx.moves = moves
+        ctx.beta = beta
+        ctx.params = params
+        state = State(x=x.detach(), v=v.detach(), beta=beta)
+        sumlogdet = torch.zeros(x.shape[0], device=x.device)
+        for move in moves:
+            if move is None:
+                state = State(state.x, -1. * state.v, state.beta)
+                continue
+            # NOTE: `grad_potential` needs autograd, even in the forward pass
+            with torch.enable_grad():
+                state, logdet = dynamics._leapfrog(*move, state)
+            state = State(state.x.detach(), state.v.detach(), beta)
+            sumlogdet = sumlogdet + logdet.detach()
+            if history is not None:
+                metrics = dynamics.get_metrics(state, sumlogdet, step=move[1])
+                dynamics.update_history(metrics, history=history)
+
+        ctx.save_for_backward(state.x, state.v)
+        return state.x, state.v, sumlogdet
+
+    @staticmethod
+    def backward(ctx, dx, dv, dlogdet):
+        dynamics = ctx.dynamics
+        x, v = ctx.saved_tensors
+        dparams = [torch.zeros_like(p) for p in ctx.params]
+        for move in reversed(ctx.moves):
+            if move is None:
+                v = -1. * v
+                dv = -1. * dv
+                continue
+            with torch.enable_grad():
+                prev, _ = dynamics._leapfrog_inverse(
+                    *move, State(x, v, ctx.beta)
+                )
+                x_ = prev.x.detach().requires_grad_(True)
+                v_ = prev.v.detach().requires_grad_(True)
+                out, logdet = dynamics._leapfrog(
+                    *move, State(x_, v_, ctx.beta)
+                )
+                grads = torch.autograd.grad(
+                    (out.x, out.v, logdet),
+                    (x_, v_, *ctx.params),
+                    grad_outputs=(dx, dv, dlogdet),
+                    allow_unused=True,
+                )
+            dx, dv = grads[0], grads[1]
+            for dp, grad in zip(dparams, grads[2:]):
+                if grad is not None:
+                    dp.add_(grad)
+            x, v = prev.x.detach(), prev.v.detach()
+
+        return (None, None, None, None, dx, dv, *dparams)
+
+
 class Dynamics(nn.Module):
     def __init__(
             self,
             potential_fn: Callable,
             config: DynamicsConfig,
             network_factory: NetworkFactory,
+            force_fn: Optional[Callable] = None,
     ):
-        """Initialization method."""
+        """Initialization method.
+
+        If `force_fn` is specified, it is used (in place of autograd) for
+        computing the gradient of the potential, dU/dx.
+        """
         super(Dynamics, self).__init__()
         self.config = config
         self.xdim = self.config.xdim
         self.xshape = tuple(network_factory.input_spec.xshape)
         self.potential_fn = potential_fn
+        self.force_fn = force_fn
         self.network_factory = network_factory
         self.nlf = self.config.nleapfrog
         self.networks = network_factory.build_networks(
             n=(self.nlf if self.config.use_separate_networks else 1),
-            split_xnets=self.config.use_split_xnets
+            split_xnets=self.config.use_split_xnets,
+            stacked=self.config.use_stacked_networks,
         )
         self.masks = self._build_masks()
         xeps = {}
@@ -160,7 +247,11 @@ class Dynamics(nn.Module):
     def load(self, outdir: os.PathLike) -> None:
         netdir = Path(outdir).joinpath('networks')
         netfile = netdir.joinpath('dynamics.pt')
-        self.load_state_dict(torch.load(netfile))
+        state_dict = torch.load(netfile)
+        if self.config.use_stacked_networks:
+            # NOTE: Allow loading from the per-step `Network` layout
+            state_dict = to_stacked_state_dict(state_dict)
+        self.load_state_dict(state_dict)
         eps = self.load_eps(outdir)
         self.assign_eps(eps)
 
@@ -216,6 +307,9 @@ class Dynamics(nn.Module):
         if self.config.merge_directions:
             return self.apply_transition_fb(inputs)
 
+        if self.config.partition_directions:
+            return self.apply_transition_partitioned(inputs)
+
         return self.apply_transition(inputs)
 
     def apply_transition_hmc(
@@ -321,6 +415,14 @@ class Dynamics(nn.Module):
                                      out=state_out)
         metrics = {}
         for (key, vf), (_, vb) in zip(mfwd.items(), mbwd.items()):
+            if isinstance(vf, list):
+                # NOTE: Per-step metrics are lists unless `verbose`
+                vf, vb = torch.stack(vf), torch.stack(vb)
+            if key in ['xeps', 'veps']:
+                # NOTE: Step sizes are shared by all chains (and both
+                # directions), so they have no chain axis to mask
+                metrics[key] = vf
+                continue
             try:
                 vprop = ma_ * (mf_ * vf + mb_ * vb)
             except RuntimeError:
@@ -340,10 +442,90 @@ class Dynamics(nn.Module):
 
         return x_out, metrics
 
+    def apply_transition_partitioned(
+            self,
+            inputs: tuple[Tensor, Tensor]
+    ) -> tuple[Tensor, dict]:
+        """Same as `apply_transition`, but each chain runs one direction only.
+
+        Instead of running the full batch through both the forward and
+        backward kernels and masking out the unused half, the batch is split
+        by direction once, each sub-batch is run through its own kernel and
+        the results are scattered back into the original chain order.
+        """
+        x, beta = inputs
+        mf_, mb_ = self._get_direction_masks(batch_size=x.shape[0])
+        mf_ = mf_.to(x.device)
+        mb_ = mb_.to(x.device)
+        fidx = torch.nonzero(mf_, as_tuple=True)[0]
+        bidx = torch.nonzero(mb_, as_tuple=True)[0]
+        # NOTE: `perm` maps [*fwd_chains, *bwd_chains] -> original ordering
+        perm = torch.argsort(torch.cat([fidx, bidx]))
+
+        v = torch.randn_like(x).to(x.device)
+        # NOTE: A (per-chain) `[nchains]` beta is split along with the chains
+        per_chain = isinstance(beta, Tensor) and beta.ndim > 0
+        props = []
+        for idx, forward in ((fidx, True), (bidx, False)):
+            if idx.numel() == 0:
+                continue
+            beta_ = beta[idx] if per_chain else beta
+            state = State(x=x[idx], v=v[idx], beta=beta_)
+            props.append(self.transition_kernel(state, forward=forward))
+
+        xp = torch.cat([p.x for p, _ in props])[perm]
+        vp = torch.cat([p.v for p, _ in props])[perm]
+        mprop = {}
+        for key in props[0][1].keys():
+            vals = [
+                torch.stack(m[key]) if isinstance(m[key], list) else m[key]
+                for _, m in props
+            ]
+            if key in ['xeps', 'veps']:
+                # NOTE: step sizes are shared by all chains
+                mprop[key] = vals[0]
+            else:
+                mprop[key] = torch.cat(vals, dim=-1)[..., perm]
+
+        acc = mprop['acc']
+        ma_, mr_ = self._get_accept_masks(acc)
+        ma = ma_.unsqueeze(-1)
+        mr = mr_.unsqueeze(-1)
+
+        v_out = ma * vp + mr * v
+        x_out = ma * xp + mr * x
+        logdet = ma_ * mprop['sumlogdet']  # NOTE: + mr_ * logdet_init = 0
+
+        state_init = State(x=x, v=v, beta=beta)
+        state_prop = State(x=xp, v=vp, beta=beta)
+        state_out = State(x=x_out, v=v_out, beta=beta)
+        mc_states = MonteCarloStates(init=state_init,
+                                     proposed=state_prop,
+                                     out=state_out)
+        metrics = {}
+        for key, val in mprop.items():
+            if key in ['xeps', 'veps']:
+                # NOTE: Step sizes are shared by all chains (no chain axis)
+                metrics[key] = val
+                continue
+            try:
+                metrics[key] = ma_ * val
+            except RuntimeError:
+                metrics[key] = ma * val
+
+        metrics.update({
+            'acc': acc,
+            'acc_mask': ma_,
+            'sumlogdet': logdet,
+            'mc_states': mc_states,
+        })
+
+        return x_out, metrics
+
     def random_state(self, beta: float) -> State:
         x = torch.rand(tuple(self.xshape)).reshape(self.xshape[0], -1)
         v = torch.randn_like(x).to(x.device)
-        return State(x=x, v=v, beta=torch.tensor(beta))
+        return State(x=x, v=v, beta=torch.as_tensor(beta))
 
     def test_reversibility(self) -> dict[str, Tensor]:
         state = self.random_state(beta=1.)
@@ -427,6 +609,9 @@ class Dynamics(nn.Module):
             state: State,
             eps: Tensor,
     ) -> State:
+        if eps.ndim > 0:
+            # NOTE: Per-chain step size, `[nchains]`, broadcast over links
+            eps = eps.reshape(-1, *([1] * (state.x.ndim - 1)))
         force1 = self.grad_potential(state.x, state.beta)  # f = dU / dx
         v1 = state.v - 0.5 * eps * force1                  # v -= ½ veps * f
         xp = state.x + eps * v1                            # x += xeps * v
@@ -466,6 +651,14 @@ class Dynamics(nn.Module):
         sumlogdet = torch.zeros(state.x.shape[0], device=state.x.device)
         metrics = self.get_metrics(state_, sumlogdet)
         history = self.update_history(metrics, history={})
+        if self._use_reversible():
+            nlf = self.config.nleapfrog
+            moves = [(True, step) for step in range(nlf)]
+            moves += [None] + [(False, step) for step in range(nlf)]
+            state_, sumlogdet = self._apply_reversible(state_, moves, history)
+            acc = self.compute_accept_prob(state, state_, sumlogdet)
+            history.update({'acc': acc, 'sumlogdet': sumlogdet})
+            return state_, self._stack_history(history)
 
         # Forward
         for step in range(self.config.nleapfrog):
@@ -508,6 +701,12 @@ class Dynamics(nn.Module):
         sumlogdet = torch.zeros(state.x.shape[0], device=state.x.device)
         metrics = self.get_metrics(state_, sumlogdet, step=0)
         history = self.update_history(metrics, history={})
+        if self._use_reversible():
+            moves = [(forward, step) for step in range(self.config.nleapfrog)]
+            state_, sumlogdet = self._apply_reversible(state_, moves, history)
+            acc = self.compute_accept_prob(state, state_, sumlogdet)
+            history.update({'acc': acc, 'sumlogdet': sumlogdet})
+            return state_, self._stack_history(history)
 
         for step in range(self.config.nleapfrog):
             state_, logdet = lf_fn(step, state_)
@@ -525,6 +724,51 @@ class Dynamics(nn.Module):
 
         return state_, history
 
+    def _use_reversible(self) -> bool:
+        return self.config.reversible_backprop and torch.is_grad_enabled()
+
+    def _apply_reversible(
+            self,
+            state: State,
+            moves: list[LeapfrogMove],
+            history: dict,
+    ) -> tuple[State, Tensor]:
+        """Run `moves` through `ReversibleLeapfrog`, see its docstring."""
+        params = [p for p in self.parameters() if p.requires_grad]
+        hist = history if self.config.verbose else None
+        x, v, sumlogdet = ReversibleLeapfrog.apply(
+            self, moves, hist, state.beta, state.x, state.v, *params
+        )
+        return State(x=x, v=v, beta=state.beta), sumlogdet
+
+    def _stack_history(self, history: dict) -> dict:
+        if self.config.verbose:
+            for key, val in history.items():
+                if isinstance(val, list) and isinstance(val[0], Tensor):
+                    history[key] = torch.stack(val).detach()
+
+        return history
+
+    def _leapfrog(
+            self,
+            forward: bool,
+            step: int,
+            state: State
+    ) -> tuple[State, Tensor]:
+        lf_fn = self._forward_lf if forward else self._backward_lf
+        return lf_fn(step, state)
+
+    def _leapfrog_inverse(
+            self,
+            forward: bool,
+            step: int,
+            state: State,
+    ) -> tuple[State, Tensor]:
+        """Exact inverse of `self._leapfrog(forward, step, state)`."""
+        # NOTE: `_backward_lf(nlf - step - 1)` undoes `_forward_lf(step)`
+        step_r = self.config.nleapfrog - step - 1
+        return self._leapfrog(not forward, step_r, state)
+
     def compute_accept_prob(
         self,
         state_init: State,
@@ -571,6 +815,34 @@ class Dynamics(nn.Module):
 
         return masks
 
+    def _get_net_idx(self, step: int, first: Optional[bool] = None) -> int:
+        """Index of the network for `step` in a `StackedNetwork`.
+
+        `first` is None for the vnet and True / False for the xnet.
+        """
+        if not self.config.use_separate_networks:
+            return 0
+        if first is not None and self.config.use_split_xnets and self.nlf > 1:
+            return 2 * step + int(not first)
+        return step
+
+    def _project_xnet_v(
+            self,
+            step: int,
+            v: Tensor,
+    ) -> tuple[Optional[Tensor], Optional[Tensor]]:
+        """Returns v_layer(v) for the (first, second) xnet of `step`.
+
+        Both x updates of a leapfrog step see the same v, so for stacked
+        networks we compute both projections with a single matmul.
+        """
+        if not self.config.use_stacked_networks:
+            return None, None
+        idxs = [self._get_net_idx(step, first=f) for f in (True, False)]
+        xnet = self.networks.get_submodule('xnet')
+        vproj = xnet.project_v(v, idxs)
+        return vproj[0], vproj[1]
+
     def _get_vnet(self, step: int) -> nn.Module:
         """Returns momentum network to be used for updating v."""
         vnet = self.networks.get_submodule('vnet')
@@ -604,6 +876,10 @@ class Dynamics(nn.Module):
             inputs: tuple[Tensor, Tensor],
     ) -> tuple[Tensor, Tensor, Tensor]:
         """Call the momentum update network for a step along the trajectory"""
+        if self.config.use_stacked_networks:
+            vnet = self.networks.get_submodule('vnet')
+            return vnet(inputs, self._get_net_idx(step))
+
         vnet = self._get_vnet(step)
         assert callable(vnet)
         return vnet(inputs)
@@ -613,10 +889,16 @@ class Dynamics(nn.Module):
             step: int,
             inputs: tuple[Tensor, Tensor],
             first: bool = False,
+            vproj: Optional[Tensor] = None,
     ) -> tuple[Tensor, Tensor, Tensor]:
         """Call the position update network for a step along the trajectory."""
         x, v = inputs
         x = self._stack_as_xy(x)
+        if self.config.use_stacked_networks:
+            xnet = self.networks.get_submodule('xnet')
+            idx = self._get_net_idx(step, first=first)
+            return xnet((x, v), idx, vproj=vproj)
+
         xnet = self._get_xnet(step, first)
         assert callable(xnet)
         return xnet((x, v))
@@ -629,10 +911,13 @@ class Dynamics(nn.Module):
         state, logdet = self._update_v_fwd(step, state)
         sumlogdet = sumlogdet + logdet
 
-        state, logdet = self._update_x_fwd(step, state, m, first=True)
+        vp1, vp2 = self._project_xnet_v(step, state.v)
+        state, logdet = self._update_x_fwd(step, state, m, first=True,
+                                           vproj=vp1)
         sumlogdet = sumlogdet + logdet
 
-        state, logdet = self._update_x_fwd(step, state, mb, first=False)
+        state, logdet = self._update_x_fwd(step, state, mb, first=False,
+                                           vproj=vp2)
         sumlogdet = sumlogdet + logdet
 
         state, logdet = self._update_v_fwd(step, state)
@@ -651,10 +936,13 @@ class Dynamics(nn.Module):
         state, logdet = self._update_v_bwd(step_r, state)
         sumlogdet = sumlogdet + logdet
 
-        state, logdet = self._update_x_bwd(step_r, state, mb, first=False)
+        vp1, vp2 = self._project_xnet_v(step_r, state.v)
+        state, logdet = self._update_x_bwd(step_r, state, mb, first=False,
+                                           vproj=vp2)
         sumlogdet = sumlogdet + logdet
 
-        state, logdet = self._update_x_bwd(step_r, state, m, first=True)
+        state, logdet = self._update_x_bwd(step_r, state, m, first=True,
+                                           vproj=vp1)
         sumlogdet = sumlogdet + logdet
 
         state, logdet = self._update_v_bwd(step_r, state)
@@ -696,13 +984,14 @@ class Dynamics(nn.Module):
             state: State,
             m: Tensor,
             first: bool,
+            vproj: Optional[Tensor] = None,
     ) -> tuple[State, Tensor]:
         """Single x update in the forward direction"""
         eps = self.xeps[str(step)]
         mb = torch.ones_like(m) - m
         xm_init = m * state.x
         inputs = (xm_init, state.v)
-        s, t, q = self._call_xnet(step, inputs, first=first)
+        s, t, q = self._call_xnet(step, inputs, first=first, vproj=vproj)
         s = eps * s
         q = eps * q
         exp_s = torch.exp(s)
@@ -710,6 +999,10 @@ class Dynamics(nn.Module):
         if self.config.use_ncp:
             halfx = state.x / 2.
             _x = 2. * torch.atan(torch.tan(halfx) * exp_s)
+            if self.config.reversible_backprop:
+                # NOTE: Keep the 2π branch of x, so that `_update_x_bwd` is
+                # its exact inverse (as needed by `ReversibleLeapfrog`)
+                _x = _x + TWO_PI * torch.round(state.x / TWO_PI)
             xp = _x + eps * (state.v * exp_q + t)
             xf = xm_init + (mb * xp)
             cterm = torch.cos(halfx) ** 2
@@ -729,23 +1022,32 @@ class Dynamics(nn.Module):
             state: State,
             m: Tensor,
             first: bool,
+            vproj: Optional[Tensor] = None,
     ) -> tuple[State, Tensor]:
         """Update the position in the backward direction."""
         eps = self.xeps[str(step)]
         mb = torch.ones_like(m) - m
         xm_init = m * state.x
         inputs = (xm_init, state.v)
-        s, t, q = self._call_xnet(step, inputs, first=first)
+        s, t, q = self._call_xnet(step, inputs, first=first, vproj=vproj)
         s = (-eps) * s
         q = eps * q
         exp_s = torch.exp(s)
         exp_q = torch.exp(q)
         if self.config.use_ncp:
-            halfx = state.x / 2.
-            halfx_scale = exp_s * torch.tan(halfx)
-            x1 = 2. * torch.atan(halfx_scale)
-            x2 = exp_s * eps * (state.v * exp_q + t)
-            xnew = x1 - x2
+            if self.config.reversible_backprop:
+                # NOTE: Exact inverse of the `use_ncp` update in
+                # `_update_x_fwd` (as needed by `ReversibleLeapfrog`)
+                y = state.x - eps * (state.v * exp_q + t)
+                halfx = y / 2.
+                branch = TWO_PI * torch.round(y / TWO_PI)
+                xnew = 2. * torch.atan(exp_s * torch.tan(halfx)) + branch
+            else:
+                halfx = state.x / 2.
+                halfx_scale = exp_s * torch.tan(halfx)
+                x1 = 2. * torch.atan(halfx_scale)
+                x2 = exp_s * eps * (state.v * exp_q + t)
+                xnew = x1 - x2
             xb = xm_init + (mb * xnew)
 
             cterm = torch.cos(halfx) ** 2
@@ -760,7 +1062,11 @@ class Dynamics(nn.Module):
         return State(x=xb, v=state.v, beta=state.beta), logdet
 
     def hamiltonian(self, state: State) -> Tensor:
-        """Returns the total energy H = KE + PE."""
+        """Returns the (per-chain) total energy H = KE + PE.
+
+        NOTE: `state.beta` can be a scalar, or a `[nchains]` tensor, in
+        which case each chain is evaluated at its own beta.
+        """
         kinetic = self.kinetic_energy(state.v)
         potential = self.potential_energy(state.x, state.beta)
         return kinetic + potential
@@ -781,6 +1087,10 @@ class Dynamics(nn.Module):
             # create_graph: bool = True,
     ) -> Tensor:
         """Compute the gradient of the potential function."""
+        if self.force_fn is not None:
+            # NOTE: Detached to match `autograd.grad` w/o `create_graph`
+            return self.force_fn(x, beta).detach()
+
         x.requires_grad_(True)
         s = self.potential_energy(x, beta)
         id = torch.ones(x.shape[0], device=x.device)
@@ -7,11 +7,12 @@ import logging
 from omegaconf import DictConfig, OmegaConf
 from hydra.utils import instantiate
 import os
-import wandb
 
 from pathlib import Path
 from typing import Optional, Any, Callable
-from l2hmc.configs import InputSpec, HERE, OUTDIRS_FILE, ExperimentConfig
+from l2hmc.configs import (
+    InputSpec, HERE, ExperimentConfig, add_to_outdirs_file
+)
 
 
 log = logging.getLogger(__name__)
@@ -144,6 +145,7 @@ class Experiment:
                                          net_weights=self.config.net_weights)
             return Dynamics(config=self.config.dynamics,
                             potential_fn=self.lattice.action,
+                            force_fn=getattr(self.lattice, 'force', None),
                             network_factory=net_factory)
 
         if self.config.framework == 'tensorflow':
@@ -209,7 +211,12 @@ class Experiment:
                            schedule=self.config.annealing_schedule,
                            lr_config=self.config.learning_rate,
                            dynamics_config=self.config.dynamics,
-                           aux_weight=self.config.loss.aux_weight)
+                           aux_weight=self.config.loss.aux_weight,
+                           compile=bool(self.config.torch_compile),
+                           async_metrics=bool(self.config.async_metrics),
+                           async_ckpt=bool(self.config.async_ckpt),
+                           keep_ckpts=self.config.keep_ckpts,
+                           micro_batches=self.config.micro_batches or 1)
 
         if self.config.framework == 'tensorflow':
             import horovod.tensorflow as hvd
@@ -232,6 +239,7 @@ class Experiment:
             dynamics: Optional[Any] = None,
             loss_fn: Optional[Callable] = None
     ):
+        import wandb
         from wandb.util import generate_id
         from l2hmc.utils.rich import print_config
 
@@ -267,8 +275,7 @@ class Experiment:
         jobdir = here.joinpath(job_type)
         jobdir.mkdir(exist_ok=True, parents=True)
         assert jobdir is not None
-        with open(OUTDIRS_FILE, 'a') as f:
-            f.write(Path(jobdir).resolve().as_posix())
+        add_to_outdirs_file(jobdir)
 
         return jobdir
 
@@ -19,18 +19,29 @@ Tensor = torch.Tensor
 
 ONE_HALF = 1. / 2.
 ONE_THIRD = 1. / 3.
-TWO_PI = torch.from_numpy(2. * PI)
+TWO_PI = 2. * PI
 
-SQRT1by2 = torch.from_numpy(np.sqrt(1. / 2.))
-SQRT1by3 = torch.from_numpy(np.sqrt(1. / 3.))
+SQRT1by2 = np.sqrt(1. / 2.)
+SQRT1by3 = np.sqrt(1. / 3.)
 
 
-def eyeOf(m):
+def trace(x: Tensor) -> Tensor:
+    """Batched trace over the last two dimensions."""
+    return x.diagonal(dim1=-2, dim2=-1).sum(-1)
+
+
+def eyeOf(m: Tensor) -> Tensor:
+    """Identity matrix, broadcastable against `m`."""
     batch_shape = [1] * (len(m.shape) - 2)
-    return torch.tensor([torch.eye(*m.shape[-2:]) for _ in batch_shape])
+    eye = torch.eye(*m.shape[-2:], dtype=m.dtype, device=m.device)
+    return eye.reshape(*batch_shape, *m.shape[-2:])
 
 
 def expm(m: Tensor, order: int = 12) -> Tensor:
+    """Truncated Taylor series of exp(m), valid for generic square matrices.
+
+    For 3x3 anti-Hermitian matrices prefer the exact `expTAH3`.
+    """
     eye = eyeOf(m)
     x = eye + m / torch.tensor(order)
     for i in range(order - 1, 0, -1):
@@ -98,7 +109,7 @@ def eigs3x3(
     st = torch.sin(t)
     ct = torch.cos(t)
     sqc = sq * ct
-    sqs = torch.from_numpy(np.sqrt(3)) * sq * st
+    sqs = np.sqrt(3.) * sq * st
     ll = tr3 + sqc
     e0 = tr3 - 2 * sqc
     e1 = ll + sqs
@@ -107,6 +118,220 @@ def eigs3x3(
     return e0, e1, e2
 
 
+def expCoeffs3(u: Tensor, w: Tensor) -> tuple[Tensor, Tensor, Tensor]:
+    """Returns (f0, f1, f2), such that exp(iQ) = f0 + f1 Q + f2 Q²
+
+    for a traceless Hermitian 3x3 Q, with eigenvalues 2u, -u + w, -u - w,
+    where 2u is the eigenvalue furthest from the other two.
+    (Morningstar & Peardon, hep-lat/0311018)
+
+    Near Q = 0 the closed form loses precision, so we switch to the
+    Cayley-Hamilton reduced Taylor series there.
+    """
+    u2 = u * u
+    w2 = w * w
+    c0 = 2. * u * (u2 - w2)                     # det(Q)
+    c1 = 3. * u2 + w2                           # tr(Q²) / 2
+    small = c1 < 1e-3
+    xi0 = torch.sinc(w / PI)                    # sin(w) / w
+    cw = torch.cos(w)
+    e2iu = torch.polar(torch.ones_like(u), 2. * u)
+    emiu = torch.polar(torch.ones_like(u), -u)
+    h0 = (u2 - w2) * e2iu + emiu * torch.complex(
+        8. * u2 * cw, 2. * u * (3. * u2 + w2) * xi0
+    )
+    h1 = 2. * u * e2iu - emiu * torch.complex(
+        2. * u * cw, -(3. * u2 - w2) * xi0
+    )
+    h2 = e2iu - emiu * torch.complex(cw, 3. * u * xi0)
+    denom = torch.where(small, torch.ones_like(c1), 9. * u2 - w2)
+    # exp(iQ) = Σ (iQ)ⁿ / n!,  using Q³ = c1 Q + c0
+    c12 = c1 * c1
+    t0 = torch.complex(1. - c0 * c0 / 720., c1 * c0 / 120. - c0 / 6.)
+    t1 = torch.complex(c0 / 24. - c1 * c0 / 360.,
+                       1. - c1 / 6. + c12 / 120.)
+    t2 = torch.complex(-0.5 + c1 / 24. - c12 / 720., c0 / 120.)
+
+    return (
+        torch.where(small, t0, h0 / denom),
+        torch.where(small, t1, h1 / denom),
+        torch.where(small, t2, h2 / denom),
+    )
+
+
+def _isolated_eig(q: Tensor) -> tuple[Tensor, Tensor]:
+    """Returns (u, w) from the (traceless) eigenvalues q[..., 3]."""
+    qs, _ = q.sort(-1)
+    lo, mid, hi = qs[..., 0], qs[..., 1], qs[..., 2]
+    lo_isolated = (mid - lo) >= (hi - mid)
+    u = 0.5 * torch.where(lo_isolated, lo, hi)
+    w = 0.5 * torch.where(lo_isolated, hi - mid, mid - lo)
+    return u, w
+
+
+def expTAH3(x: Tensor) -> Tensor:
+    """Exact exp(X) for (batched) 3x3 anti-Hermitian X.
+
+    Writes X = i Q + (tr X / 3), with Q traceless Hermitian, whose
+    eigenvalues are computed in closed form with `eigs3x3`.
+    """
+    tr3 = ONE_THIRD * trace(x)
+    q = -1j * (x - tr3[..., None, None] * eyeOf(x))
+    q2 = torch.matmul(q, q)
+    e0, e1, e2 = eigs3x3(
+        torch.zeros_like(tr3.real), trace(q2).real, q.det().real
+    )
+    u, w = _isolated_eig(torch.stack([e0, e1, e2], dim=-1))
+    f0, f1, f2 = expCoeffs3(u, w)
+    y = (
+        f0[..., None, None] * eyeOf(x)
+        + f1[..., None, None] * q
+        + f2[..., None, None] * q2
+    )
+    return torch.exp(tr3)[..., None, None] * y
+
+
+# NOTE: The six ways of pairing 3 eigenvalues, used in `eigPhasesU3`
+_PERMS3 = [[0, 1, 2], [0, 2, 1], [1, 0, 2], [1, 2, 0], [2, 0, 1], [2, 1, 0]]
+
+
+def eigPhasesU3(x: Tensor) -> Tensor:
+    """Returns the eigenphases φ[..., 3] of a (batched) 3x3 unitary X.
+
+    sin(φ) and cos(φ) are the (real) eigenvalues of the Hermitian
+    (X - X†) / 2i and (X + X†) / 2, which we compute with `eigs3x3` and
+    pair up using the residual of the characteristic polynomial of X.
+    """
+    xa = x.adjoint()
+    a = -0.5j * (x - xa)
+    b = 0.5 * (x + xa)
+    s = torch.stack(eigs3x3(
+        trace(a).real, trace(torch.matmul(a, a)).real, a.det().real
+    ), dim=-1)
+    c = torch.stack(eigs3x3(
+        trace(b).real, trace(torch.matmul(b, b)).real, b.det().real
+    ), dim=-1)
+    # det(λ - X) = λ³ - t1 λ² + t2 λ - t3
+    t1 = trace(x)
+    t2 = 0.5 * (t1 * t1 - trace(torch.matmul(x, x)))
+    t3 = x.det()
+    perms = torch.tensor(_PERMS3, device=x.device)
+    cp = c[..., perms]                                  # [..., 6, 3]
+    lam = torch.complex(cp, s[..., None, :].expand_as(cp))
+    res = ((lam - t1[..., None, None]) * lam + t2[..., None, None]) * lam
+    res = (res - t3[..., None, None]).abs().sum(-1)     # [..., 6]
+    best = res.argmin(-1)[..., None, None].expand(*s.shape[:-1], 1, 3)
+    cos = cp.gather(-2, best).squeeze(-2)
+
+    return torch.atan2(s, cos)
+
+
+# NOTE: Candidate branches φ + 2π k of the eigenphases, used in `logSU3`,
+# and the minimum separation (mod 2π) of eigenphases on different branches
+BRANCH_TOL = 1.0
+_BRANCHES3 = [[i, j, k] for i in (-1, 0, 1) for j in (-1, 0, 1)
+              for k in (-1, 0, 1)]
+
+
+def _branch_sep(phi: Tensor, tol: float = BRANCH_TOL) -> Tensor:
+    """Returns the min. distance of the differences of the phases φ[..., 3]
+    to a non-zero multiple of 2π, clipped to `tol`.
+    """
+    dphi = (phi[..., [0, 0, 1]] - phi[..., [1, 2, 2]]).abs()
+    nwrap = torch.round(dphi / TWO_PI).clamp(min=1.)
+    return (dphi - TWO_PI * nwrap).abs().amin(-1).clamp(max=tol)
+
+
+def _su3_branch(
+        phi: Tensor,
+        tol: float = BRANCH_TOL,
+) -> tuple[Tensor, Tensor]:
+    """Returns the branch φ + 2π k of the eigenphases φ[..., 3] with Σ = 0.
+
+    Of these, we take the smallest, unless two of its phases differ by
+    (within `tol` of) a non-zero multiple of 2π. Their eigenvalues are
+    then (nearly) degenerate, but not their logarithms, which makes the
+    solve for Q in `logSU3` ill-conditioned, so we move one of them to the
+    other's branch instead (e.g. φ = (2.66, 0.96, 2.66) -> (2.66, -5.33,
+    2.66), rather than (-3.62, 0.96, 2.66)).
+
+    Also returns the separation (clipped to `tol`) of the chosen branch,
+    which is < `tol` if no branch separates them, e.g. if all three
+    eigenvalues are (nearly) degenerate.
+    """
+    n = torch.round(phi.sum(-1, keepdim=True) / TWO_PI)
+    hi = torch.zeros_like(phi).scatter(-1, phi.argmax(-1, keepdim=True), 1.)
+    lo = torch.zeros_like(phi).scatter(-1, phi.argmin(-1, keepdim=True), 1.)
+    phi = phi - TWO_PI * (n.clamp(min=0) * hi + n.clamp(max=0) * lo)
+    sep = _branch_sep(phi, tol=tol)
+    close = sep < tol
+    if bool(close.any()):
+        # NOTE: Search all branches, but only where the smallest is too close
+        ks = torch.tensor(_BRANCHES3, dtype=phi.dtype, device=phi.device)
+        cands = phi[close][..., None, :] + TWO_PI * ks      # [m, 27, 3]
+        csep = _branch_sep(cands, tol=tol)
+        score = 1e3 * csep - cands.square().sum(-1)
+        valid = cands.sum(-1).abs() < PI
+        score = torch.where(valid, score, torch.full_like(score, -torch.inf))
+        best = score.argmax(-1)
+        idx = torch.arange(best.shape[0], device=phi.device)
+        phi, sep = phi.clone(), sep.clone()
+        phi[close] = cands[idx, best]
+        sep[close] = csep[idx, best]
+
+    return phi - phi.mean(-1, keepdim=True), sep
+
+
+def _logSU3_eigh(x: Tensor) -> Tensor:
+    """log(X) for (batched) X in SU(3), from the eigenvectors of X.
+
+    X is first rotated by the phase of tr(X), so that (if its eigenvalues
+    are close to each other, e.g. near the center) its eigenphases are
+    close to zero, and the Hermitian (V - V†) / 2i resolves them.
+    """
+    tr = trace(x)
+    rot = (tr.conj() / tr.abs().clamp(min=1e-12))[..., None, None]
+    v = rot * x
+    _, w = torch.linalg.eigh(-0.5j * (v - v.adjoint()))
+    d = torch.diagonal(torch.matmul(w.adjoint(), torch.matmul(x, w)),
+                       dim1=-2, dim2=-1)
+    phi, _ = _su3_branch(d.angle())
+    return torch.matmul(w * (1j * phi)[..., None, :].type_as(w), w.adjoint())
+
+
+def logSU3(x: Tensor) -> Tensor:
+    """Exact (traceless, anti-Hermitian) log(X) for (batched) X in SU(3).
+
+    From the eigenphases φ of X (with the branch chosen so that Σφ = 0,
+    see `_su3_branch`), we know f0, f1, f2 with X = f0 + f1 Q + f2 Q² and
+    X† = f0* + f1* Q + f2* Q², which we solve for Q = -i log(X).
+    The result is then polished with one correction step.
+
+    NOTE: The solve is ill-conditioned if no branch separates the phases,
+    e.g. if all three eigenvalues of X are (nearly) degenerate, as near the
+    (non-trivial) center elements. There, we use the eigenvectors of X
+    instead, see `_logSU3_eigh`.
+    """
+    phi, sep = _su3_branch(eigPhasesU3(x))
+    f0, f1, f2 = expCoeffs3(*_isolated_eig(phi))
+    f0_ = f0[..., None, None]
+    f2_ = f2[..., None, None]
+    denom = (f1 * f2.conj() - f2 * f1.conj())[..., None, None]
+    eye = eyeOf(x)
+    q = (
+        f2_.conj() * (x - f0_ * eye)
+        - f2_ * (x.adjoint() - f0_.conj() * eye)
+    ) / denom
+    y = projectTAH(1j * q)
+    degenerate = sep < BRANCH_TOL
+    if bool(degenerate.any()):
+        y = y.clone()
+        y[degenerate] = _logSU3_eigh(x[degenerate])
+    # NOTE: `eigs3x3` loses precision for nearly degenerate eigenvalues,
+    # so we polish with a single correction step: X ≈ Y + TAH[X exp(-Y)]
+    return y + projectTAH(torch.matmul(x, expTAH3(-y)))
+
+
 def rsqrtPHM3f(tr, p2, det):
     e0, e1, e2 = eigs3x3(tr, p2, det)
     se0 = e0.abs().sqrt()
@@ -129,18 +354,17 @@ def rsqrtPHM3f(tr, p2, det):
 
 
 def rsqrtPHM3(x: Tensor) -> Tensor:
-    tr = x.trace().real
+    tr = trace(x).real
     x2 = torch.matmul(x, x)
-    p2 = x2.trace().real
+    p2 = trace(x2).real
     det = x.det().real
     c0, c1, c2 = rsqrtPHM3f(tr, p2, det)
     c0_ = c0.reshape(c0.shape + (1, 1))
     c1_ = c1.reshape(c1.shape + (1, 1))
     c2_ = c2.reshape(c2.shape + (1, 1))
-    eyes = torch.tensor([torch.eye(3) for _ in range((1) * len(c0.shape))])
-    term0 = (c0_ * eyes).type_as(x)
+    term0 = (c0_ * eyeOf(x).real).type_as(x)
     term1 = x * c1_.type_as(x)
-    term2 = x * c2_.type_as(x)
+    term2 = x2 * c2_.type_as(x)
 
     return term0 + term1 + term2
 
@@ -153,7 +377,7 @@ def projectU(x: Tensor) -> Tensor:
 
 
 def projectSU(x: Tensor) -> Tensor:
-    nc = torch.tensor(x.shape[-1]).to(x.dtype)
+    nc = x.shape[-1]
     m = projectU(x)
     d = m.det()
     tmp = torch.atan2(d.imag, d.real)
@@ -170,7 +394,7 @@ def projectTAH(x: Tensor) -> Tensor:
     """
     nc = torch.tensor(x.shape[-1]).to(x.dtype)
     r = 0.5 * (x - x.adjoint())
-    d = r.trace() / nc
+    d = trace(r) / nc
     r = r - d.reshape(d.shape + (1, 1)) * eyeOf(x)
 
     return r
@@ -364,18 +588,40 @@ class SU3(Group):
         return x.adjoint()
 
     def trace(self, x: Tensor) -> Tensor:
-        return torch.trace(x)
+        return trace(x)
 
     def exp(self, x: Tensor) -> Tensor:
-        return expm(x)
+        return expTAH3(x)
+
+    def log(self, x: Tensor) -> Tensor:
+        return logSU3(x)
 
     def projectTAH(self, x: Tensor) -> Tensor:
         return projectTAH(x)
 
     def random(self, shape: list[int]) -> Tensor:
-        r = torch.randn(shape)
-        i = torch.randn(shape)
-        return projectSU(torch.complex(r, i))
+        """Haar random SU(3) matrices, from the QR decomposition of a
+        complex Gaussian matrix (see arXiv:math-ph/0609050).
+
+        NOTE: Drawn in complex128 and cast to the complex type of the
+        default dtype, since the closed-form `projectSU` is only unitary to
+        ~1e-3 in complex64.
+        """
+        z = torch.complex(
+            torch.randn(shape, dtype=torch.float64),
+            torch.randn(shape, dtype=torch.float64),
+        )
+        q, r = torch.linalg.qr(z)
+        d = torch.diagonal(r, dim1=-2, dim2=-1)
+        q = q * (d / d.abs()).unsqueeze(-2)
+        # NOTE: det(q) = exp(iθ), so q exp(-iθ / 3) has unit determinant
+        phase = torch.angle(torch.linalg.det(q)) / -3.
+        q = q * torch.polar(torch.ones_like(phase), phase)[..., None, None]
+        dtype = (
+            torch.complex128 if torch.get_default_dtype() == torch.float64
+            else torch.complex64
+        )
+        return q.to(dtype)
 
     def random_momentum(self, shape: list[int]) -> Tensor:
         return randTAH3(shape[:-2])
@@ -9,6 +9,8 @@ from __future__ import absolute_import, print_function, division, annotations
 import torch
 import numpy as np
 
+from l2hmc.group.pytorch.group import logSU3
+
 Tensor = torch.Tensor
 
 
@@ -60,18 +62,6 @@ def su3_to_eigs(x: Tensor) -> Tensor:
     return torch.cat([x.unsqueeze(-1) for x in zs], dim=-1)
 
 
-def log3x3(x: Tensor):
-    eigs = su3_to_eigs(x)
-    q, _ = torch.solve(
-        torch.log(eigs).unsqueeze(-1), (
-            1e-6 * torch.eye(3).unsqueeze(0)
-            + eigs.unsqueeze(-1) ** (
-                torch.tensor([0, 1, 2]).unsqueeze(0).unsqueeze(0)
-            )
-        )
-    )
-    q = q.unsqueeze(-1)
-    eye = torch.eye(x.shape[-1]).reshape(1, x.shape[-1], x.shape[-1])
-    eye = eye.repeat(x.shape[0], 1, 1)
-
-    return q[:, 0] * eye + q[:, 1] * x + q[:, 2] * x @ x
+def log3x3(x: Tensor) -> Tensor:
+    """Returns log(x) for (batched) x in SU(3), see `group.logSU3`."""
+    return logSU3(x)
@@ -8,7 +8,6 @@ from __future__ import absolute_import, print_function, division, annotations
 # import jax.numpy as jnp
 import numpy as np
 
-from l2hmc.group.tensorflow import group as g
 # from lgt.group import group as g
 # from typing import Generator
 # from l2hmc.lattice.generators import generate_SU3
@@ -26,15 +25,55 @@ def mat_adj(mat: Array) -> Array:
     return mat.conj().T
 
 
+def adjoint(x: Array) -> Array:
+    """Batched conjugate transpose over the last two dimensions."""
+    return np.swapaxes(x.conj(), -1, -2)
+
+
+def mul(
+        a: Array,
+        b: Array,
+        adjoint_a: bool = False,
+        adjoint_b: bool = False,
+) -> Array:
+    a = adjoint(a) if adjoint_a else a
+    b = adjoint(b) if adjoint_b else b
+    return np.matmul(a, b)
+
+
+def trace(x: Array) -> Array:
+    return np.trace(x, axis1=-2, axis2=-1)
+
+
+def shift_indices(shape: tuple[int, ...]) -> Array:
+    """Returns idxs, with idxs[mu][n] = (flat) index of the site n + mu."""
+    sites = np.arange(np.prod(shape)).reshape(shape)
+    return np.stack([
+        np.roll(sites, shift=-1, axis=mu).ravel() for mu in range(len(shape))
+    ])
+
+
 Site = tuple[int, int, int, int]                # t, x, y, z
 Link = tuple[int, int, int, int, int]           # t, x, y, z, dim
 Buffer = tuple[int, int, int, int, int, int]    # b, t, x, y, z, dim
 
+# NOTE: Plaquette orientations (u, v), for u in [1, 2, 3], v in [0, ..., u)
+PLAQ_DIRS = [(u, v) for u in range(1, 4) for v in range(0, u)]
+
 
 class BaseLatticeSU3:
     """4D Lattice with SU(3) links."""
     dim = 4
 
+    def _group(self):
+        """Returns the (SU(3)) group used for link operations.
+
+        NOTE: Imported lazily, so that framework-specific subclasses (which
+        override this) don't pull in tensorflow.
+        """
+        from l2hmc.group.tensorflow import group as g
+        return g.SU3()
+
     def __init__(
             self,
             nb: int,
@@ -53,7 +92,7 @@ class BaseLatticeSU3:
          - dim (int): Number of dimensions, 4 by default (t, x, y, z)
         """
         self.dim = 4
-        self.g = g.SU3()
+        self.g = self._group()
         assert len(shape) == 4  # (nb, nt, nx, dim)
         self.c1 = c1
         self.link_shape = self.g.shape
@@ -79,6 +118,24 @@ class BaseLatticeSU3:
         self.nsites = np.cumprod(shape)[-1]
         self.nlinks = self.nsites * self.dim
         self.link_idxs = tuple(list(self.site_idxs) + [self.dim])
+        # ----------------------------------------------------------------
+        # NOTE: Precomputed (flat) indices for gathering all 6 plaquette
+        # orientations (u, v) at once, where links are reshaped to
+        # [nb, d * V, 3, 3] and stacked loops to [nb, 6 * V, 3, 3]:
+        #   - self._xv_u[p]:     U[v](n + u)
+        #   - self._xu_v[p]:     U[u](n + v)
+        #   - self._shift_u[p]:  W[p](n + u)
+        #   - self._shift_v[p]:  W[p](n + v)
+        # ----------------------------------------------------------------
+        shifts = shift_indices(shape)
+        pidxs = np.arange(len(PLAQ_DIRS))[:, None]
+        self._udirs = np.array([u for u, _ in PLAQ_DIRS])
+        self._vdirs = np.array([v for _, v in PLAQ_DIRS])
+        vol = self.volume
+        self._xv_u = self._vdirs[:, None] * vol + shifts[self._udirs]
+        self._xu_v = self._udirs[:, None] * vol + shifts[self._vdirs]
+        self._shift_u = pidxs * vol + shifts[self._udirs]
+        self._shift_v = pidxs * vol + shifts[self._vdirs]
 
     def coeffs(self, beta: Array) -> dict[str, Array]:
         """Coefficients for the plaquette and rectangle terms."""
@@ -95,71 +152,74 @@ class BaseLatticeSU3:
         xvu = self.g.mul(x[:, v], np.roll(x[:, u], shift=-1, axis=v + 1))
         return self.g.trace(self.g.mul(xuv, xvu, adjoint_b=True))
 
+    def _stack_loops(self, w: Array) -> Array:
+        """Reshape loops from [nb, n, V] to [n, nb, nt, nx, ny, nz]."""
+        return np.swapaxes(w, 0, 1).reshape(
+            w.shape[1], w.shape[0], *self._lattice_shape
+        )
+
     def _wilson_loops(
             self,
             x: Array,
             needs_rect: bool = False
-    ) -> tuple[list[Array], list[Array]]:
-        # x.shape = [nb, nt, nx, nx, nx, d, 3, 3]
-        # y.shape = [nb, d, nt, nx, nx, nx, 3, 3]
-        assert len(x.shape) == 8
-        plaqs = []
-        rects = []
-        for u in range(1, 4):
-            for v in range(0, u):
-                yuv = self.g.mul(x[:, u], np.roll(x[:, v], shift=-1, axis=u+1))
-                yvu = self.g.mul(x[:, v], np.roll(x[:, u], shift=-1, axis=v+1))
-                plaq = self.g.trace(self.g.mul(yuv, yvu, adjoint_b=True))
-                plaqs.append(plaq)
-                if needs_rect:
-                    yu = np.roll(x[:, u], shift=-1, axis=v+1)
-                    yv = np.roll(x[:, v], shift=-1, axis=u+1)
-                    uu = self.g.mul(x[:, v], yuv, adjoint_a=True)
-                    ur = self.g.mul(x[:, u], yvu, adjoint_a=True)
-                    ul = self.g.mul(yuv, yu, adjoint_b=True)
-                    ud = self.g.mul(yvu, yv, adjoint_b=True)
-                    ul_ = np.roll(ul, shift=-1, axis=u+1)
-                    ud_ = np.roll(ud, shift=-1, axis=v+1)
-                    rects.append(
-                        self.g.trace(self.g.mul(ur, ul_, adjoint_b=True))
-                    )
-                    rects.append(
-                        self.g.trace(self.g.mul(uu, ud_, adjoint_b=True))
-                    )
-
-        return plaqs, rects
+    ) -> tuple[Array, Array]:
+        """Returns traces of the plaquettes (and rectangles).
+
+        All six orientations are gathered with precomputed shift indices and
+        computed with a single batched matmul for each term.
+
+        Output shapes:
+         - plaqs.shape = [6, nb, nt, nx, ny, nz]
+         - rects.shape = [12, nb, nt, nx, ny, nz]  (empty if not needs_rect)
+        """
+        # x.shape = [nb, d, nt, nx, ny, nz, 3, 3]
+        # y.shape = [nb, d, V, 3, 3]
+        nb = x.shape[0]
+        y = x.reshape(nb, self.dim, self.volume, *self.link_shape)
+        yflat = y.reshape(nb, self.dim * self.volume, *self.link_shape)
+        xu = y[:, self._udirs]                      # U[u](n)
+        xv = y[:, self._vdirs]                      # U[v](n)
+        xv_u = np.take(yflat, self._xv_u, axis=1)   # U[v](n + u)
+        xu_v = np.take(yflat, self._xu_v, axis=1)   # U[u](n + v)
+        yuv = mul(xu, xv_u)
+        yvu = mul(xv, xu_v)
+        plaqs = self._stack_loops(trace(mul(yuv, yvu, adjoint_b=True)))
+        if not needs_rect:
+            return plaqs, np.zeros((0, *plaqs.shape[1:]), dtype=plaqs.dtype)
+
+        uu = mul(xv, yuv, adjoint_a=True)
+        ur = mul(xu, yvu, adjoint_a=True)
+        ul = mul(yuv, xu_v, adjoint_b=True)
+        ud = mul(yvu, xv_u, adjoint_b=True)
+        ul_ = np.take(ul.reshape(nb, -1, *self.link_shape),
+                      self._shift_u, axis=1)  # ul[p](n + u)
+        ud_ = np.take(ud.reshape(nb, -1, *self.link_shape),
+                      self._shift_v, axis=1)  # ud[p](n + v)
+        # NOTE: [nb, 6, 2, V] -> [nb, 12, V], ordered as (ur, uu) per plaq
+        rects = np.stack([
+            trace(mul(ur, ul_, adjoint_b=True)),
+            trace(mul(uu, ud_, adjoint_b=True)),
+        ], axis=2).reshape(nb, 2 * len(PLAQ_DIRS), self.volume)
+
+        return plaqs, self._stack_loops(rects)
+
+    @staticmethod
+    def _sum_loops(wloops: Array) -> Array:
+        """Sum over all orientations and sites, keeping the batch dim."""
+        return np.sum(wloops, axis=(0, *range(2, len(wloops.shape))))
 
     def _plaquettes(self, x: Array) -> Array:
         ps, _ = self._wilson_loops(x)
-        psum = 0.0
-        for p in ps:  # NOTE: len(ps) == 6
-            psum += np.sum(p.real, axis=range(1, len(p.shape)))
-
         # NOTE: return psum / (len(ps) * dim(link) * volume)
-        return psum / (6 * 3 * self.volume)
+        return self._sum_loops(ps.real) / (6 * 3 * self.volume)
 
     def action(self, x: Array, beta: Array):
         """Returns the action"""
         coeffs = self.coeffs(beta)
         ps, rs = self._wilson_loops(x, needs_rect=self.c1 != 0)
-        psum = 0.0
-        for p in ps:
-            psum += np.sum(
-                p.real,
-                axis=range(1, len(p.shape))
-            )
-
-        action = coeffs['plaq'] * psum
-
+        action = coeffs['plaq'] * self._sum_loops(ps.real)
         if self.c1 != 0:
-            rsum = 0.0
-            for r in rs:
-                rsum += np.sum(
-                    r.real,
-                    axis=range(1, len(r.shape))
-                )
-            action += coeffs['rect'] * rsum
-            # action += tf.math.multiply(coeffs['rect'], rsum)
+            action += coeffs['rect'] * self._sum_loops(rs.real)
 
         return action * (-1.0 / 3.0)
 
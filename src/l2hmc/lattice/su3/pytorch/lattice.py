@@ -1,16 +1,16 @@
 """
 lattice.py
 
-Contains implementation of generic GaugeLattice object.
+Contains pytorch implementation of LatticeSU3 object.
 """
 from __future__ import absolute_import, print_function, division, annotations
+from typing import Optional
 
 import numpy as np
 import torch
 
-# from l2hmc.group.pytorch import group as g
-# from l2hmc.group import group as g
-from l2hmc.lattice.su3.numpy.lattice import BaseLatticeSU3
+from l2hmc.group.pytorch import group as g
+from l2hmc.lattice.su3.numpy.lattice import BaseLatticeSU3, PLAQ_DIRS
 
 
 Array = np.ndarray
@@ -20,12 +20,207 @@ PI = np.pi
 
 
 class LatticeSU3(BaseLatticeSU3):
-    """4D Lattice with SU(3) Links"""
+    """4D Lattice with SU(3) Links
+
+    All six plaquette orientations are computed together as a single stacked
+    tensor, using the (flat) shift indices precomputed in `BaseLatticeSU3`.
+    """
     dim = 4
+
+    def _group(self):
+        return g.SU3()
+
     def __init__(
         self,
         nb: int,
         shape: tuple[int, int, int, int],
         c1: float = 0.0,
     ) -> None:
-        pass
+        super().__init__(nb, shape=shape, c1=c1)
+        self.nb = nb
+        self._udirs = torch.from_numpy(self._udirs)
+        self._vdirs = torch.from_numpy(self._vdirs)
+        self._xv_u = torch.from_numpy(self._xv_u)
+        self._xu_v = torch.from_numpy(self._xu_v)
+        self._shift_u = torch.from_numpy(self._shift_u)
+        self._shift_v = torch.from_numpy(self._shift_v)
+
+    def _stack_loops(self, w: Tensor) -> Tensor:
+        """Reshape loops from [nb, n, V] to [n, nb, nt, nx, ny, nz]."""
+        return w.transpose(0, 1).reshape(
+            w.shape[1], w.shape[0], *self._lattice_shape
+        )
+
+    def _wilson_loops(
+            self,
+            x: Tensor,
+            needs_rect: bool = False
+    ) -> tuple[Tensor, Tensor]:
+        """Returns traces of the plaquettes (and rectangles).
+
+        Output shapes:
+         - plaqs.shape = [6, nb, nt, nx, ny, nz]
+         - rects.shape = [12, nb, nt, nx, ny, nz]  (empty if not needs_rect)
+        """
+        # y.shape = [nb, d, V, 3, 3]
+        y = x.reshape(-1, self.dim, self.volume, *self.link_shape)
+        nb = y.shape[0]
+        yflat = y.flatten(1, 2)
+        dev = y.device
+        xu = y[:, self._udirs.to(dev)]              # U[u](n)
+        xv = y[:, self._vdirs.to(dev)]              # U[v](n)
+        xv_u = yflat[:, self._xv_u.to(dev)]         # U[v](n + u)
+        xu_v = yflat[:, self._xu_v.to(dev)]         # U[u](n + v)
+        yuv = self.g.mul(xu, xv_u)
+        yvu = self.g.mul(xv, xu_v)
+        plaqs = self.g.trace(self.g.mul(yuv, yvu, adjoint_b=True))
+        plaqs = self._stack_loops(plaqs)
+        if not needs_rect:
+            return plaqs, torch.zeros(0, *plaqs.shape[1:], device=dev)
+
+        uu = self.g.mul(xv, yuv, adjoint_a=True)
+        ur = self.g.mul(xu, yvu, adjoint_a=True)
+        ul = self.g.mul(yuv, xu_v, adjoint_b=True)
+        ud = self.g.mul(yvu, xv_u, adjoint_b=True)
+        ul_ = ul.flatten(1, 2)[:, self._shift_u.to(dev)]  # ul[p](n + u)
+        ud_ = ud.flatten(1, 2)[:, self._shift_v.to(dev)]  # ud[p](n + v)
+        # NOTE: [nb, 6, 2, V] -> [nb, 12, V], ordered as (ur, uu) per plaq
+        rects = torch.stack([
+            self.g.trace(self.g.mul(ur, ul_, adjoint_b=True)),
+            self.g.trace(self.g.mul(uu, ud_, adjoint_b=True)),
+        ], dim=2).reshape(nb, 2 * len(PLAQ_DIRS), self.volume)
+
+        return plaqs, self._stack_loops(rects)
+
+    def wilson_loops(self, x: Tensor) -> Tensor:
+        ps, _ = self._wilson_loops(x=x, needs_rect=False)
+        return ps
+
+    @staticmethod
+    def _sum_loops(wloops: Tensor) -> Tensor:
+        """Sum over all orientations and sites, keeping the batch dim."""
+        return wloops.sum(dim=(0, *range(2, len(wloops.shape))))
+
+    def _plaquettes(self, x: Tensor) -> Tensor:
+        return self.plaqs(self.wilson_loops(x))
+
+    def plaqs(self, wloops: Tensor) -> Tensor:
+        # NOTE: return psum / (len(ps) * dim(link) * volume)
+        return self._sum_loops(wloops.real) / (6 * 3 * self.volume)
+
+    def _clover(self, y: Tensor, u: int, v: int) -> Tensor:
+        """Returns the (traceless, anti-hermitian) clover field F[u, v].
+
+        The four plaquettes in the (u, v) plane with a corner at n, each
+        starting from n, are summed (C), and F = TAH(C) / 4, where
+        `y.shape = [nb, 4, nt, nx, ny, nz, 3, 3]`.
+        """
+        def shift(w: Tensor, *steps: tuple[int, int]) -> Tensor:
+            # w(n + s0 * d0 + s1 * d1 + ...) for steps [(d0, s0), ...]
+            dims = tuple(1 + d for d, _ in steps)
+            return w.roll(tuple(-s for _, s in steps), dims=dims)
+
+        mul = self.g.mul
+        xu, xv = y[:, u], y[:, v]
+        xu_mu = shift(xu, (u, -1))                  # U[u](n - u)
+        xv_mv = shift(xv, (v, -1))                  # U[v](n - v)
+        c = mul(
+            mul(xu, shift(xv, (u, 1))),             # U[u](n) U[v](n + u)
+            mul(xv, shift(xu, (v, 1))),             # U[v](n) U[u](n + v)
+            adjoint_b=True,
+        )
+        c = c + mul(
+            mul(xv, shift(xu, (u, -1), (v, 1)), adjoint_b=True),
+            mul(xu_mu, shift(xv, (u, -1)), adjoint_a=True),
+            adjoint_b=True,
+        )
+        c = c + mul(
+            mul(shift(xv, (u, -1), (v, -1)), xu_mu),
+            mul(shift(xu, (u, -1), (v, -1)), xv_mv),
+            adjoint_a=True,
+        )
+        c = c + mul(
+            mul(xv_mv, shift(xu, (v, -1)), adjoint_a=True),
+            mul(xu, shift(xv, (u, 1), (v, -1)), adjoint_b=True),
+            adjoint_b=True,
+        )
+        return self.g.projectTAH(c) / 4.
+
+    def _int_charges(self, x: Tensor) -> Tensor:
+        """Returns the (clover) field-theoretic topological charge.
+
+            Q = 1 / (32 pi^2) sum_n eps[u, v, r, s] tr(F[u, v] F[r, s])
+              = -1 / (4 pi^2) sum_n tr(F01 F23 - F02 F13 + F03 F12)
+
+        with F[u, v] the (anti-hermitian) clover field, see `_clover`.
+        NOTE: Only integer valued (up to O(a^2) corrections) on smooth
+        configurations, e.g. after smearing or gradient flow.
+        """
+        y = x.reshape(-1, *self._shape[1:])
+        q = torch.zeros(y.shape[0], dtype=y.real.dtype, device=y.device)
+        for sign, (u, v), (r, s) in [
+                (1., (0, 1), (2, 3)),
+                (-1., (0, 2), (1, 3)),
+                (1., (0, 3), (1, 2)),
+        ]:
+            fuv = self._clover(y, u, v)
+            frs = self._clover(y, r, s)
+            tr = self.g.trace(self.g.mul(fuv, frs)).real
+            q = q + sign * tr.flatten(1).sum(-1)
+
+        return q * (-1.0 / (4 * (PI ** 2)))
+
+    def int_charges(
+            self,
+            x: Tensor,
+            wloops: Optional[Tensor] = None,
+    ) -> Tensor:
+        """Calculate the integer valued topological charge, int(Q).
+
+        NOTE: `wloops` is accepted (and ignored) for compatibility with
+        `LatticeU1.int_charges`, since the clover needs the links `x`.
+        """
+        return self._int_charges(x)
+
+    def _sin_charges(self, wloops: Tensor) -> Tensor:
+        return self._sum_loops(wloops.imag) / (6 * 3 * self.volume)
+
+    def action(self, x: Tensor, beta: Tensor) -> Tensor:
+        """Returns the action"""
+        coeffs = self.coeffs(beta)
+        ps, rs = self._wilson_loops(x, needs_rect=self.c1 != 0)
+        action = coeffs['plaq'] * self._sum_loops(ps.real)
+        if self.c1 != 0:
+            action = action + coeffs['rect'] * self._sum_loops(rs.real)
+
+        return action * (-1.0 / 3.0)
+
+    def random(self) -> Tensor:
+        return self.g.random(list(self._shape))
+
+    def random_momentum(self) -> Tensor:
+        return self.g.random_momentum(list(self._shape))
+
+    def grad_action(
+            self,
+            x: Tensor,
+            beta: Tensor,
+            create_graph: bool = True,
+    ) -> Tensor:
+        """Returns the derivative of the action, projected onto su(3)."""
+        x = x.reshape(-1, *self._shape[1:])
+        _, dsdx = g.SU3Gradient(lambda y: self.action(y, beta), x,
+                                create_graph=create_graph)
+
+        return self.g.projectTAH(self.g.mul(dsdx, x, adjoint_b=True))
+
+    def calc_metrics(
+            self,
+            x: Tensor,
+            beta: Optional[Tensor] = None,
+    ) -> dict[str, Tensor]:
+        wloops = self.wilson_loops(x)
+        plaqs = self.plaqs(wloops)
+        qsin = self._sin_charges(wloops)
+        qint = self._int_charges(x)
+        return {'plaqs': plaqs, 'sinQ': qsin, 'intQ': qint}
@@ -11,6 +11,7 @@ import tensorflow as tf
 import logging
 
 from l2hmc.group.tensorflow import group as g
+from l2hmc.lattice.su3.numpy.lattice import PLAQ_DIRS, shift_indices
 
 log = logging.getLogger(__name__)
 # from l2hmc.lattice.su3.lattice.
@@ -70,6 +71,7 @@ class LatticeSU3:
         self.g = g.SU3()
         assert len(shape) == 4  # (nb, nt, nx, dim)
         self.c1 = tf.constant(c1)
+        self._needs_rect = (c1 != 0)
         self.link_shape = self.g.shape
         self.nt, self.nx, self.ny, self.nz = shape
         self._shape = (nb, 4, *shape, *self.g.shape)
@@ -82,6 +84,22 @@ class LatticeSU3:
         self.nsites = np.cumprod(shape)[-1]
         self.nlinks = self.nsites * self.dim
         self.link_idxs = tuple(list(self.site_idxs) + [self.dim])
+        # NOTE: Precomputed (flat) shift indices, see `BaseLatticeSU3`
+        shifts = shift_indices(shape)
+        pidxs = np.arange(len(PLAQ_DIRS))[:, None]
+        udirs = np.array([u for u, _ in PLAQ_DIRS])
+        vdirs = np.array([v for _, v in PLAQ_DIRS])
+        vol = self.volume
+        self._udirs = tf.constant(udirs, dtype=tf.int32)
+        self._vdirs = tf.constant(vdirs, dtype=tf.int32)
+        self._xv_u = tf.constant(vdirs[:, None] * vol + shifts[udirs],
+                                 dtype=tf.int32)
+        self._xu_v = tf.constant(udirs[:, None] * vol + shifts[vdirs],
+                                 dtype=tf.int32)
+        self._shift_u = tf.constant(pidxs * vol + shifts[udirs],
+                                    dtype=tf.int32)
+        self._shift_v = tf.constant(pidxs * vol + shifts[vdirs],
+                                    dtype=tf.int32)
 
     def coeffs(self, beta: Tensor) -> dict[str, Tensor]:
         """Coefficients for the plaquette and rectangle terms."""
@@ -100,79 +118,82 @@ class LatticeSU3:
         xvu = self.g.mul(x[:, v], tf.roll(x[:, u], shift=-1, axis=v + 1))
         return self.g.trace(self.g.mul(xuv, xvu, adjoint_b=True))
 
+    def _stack_loops(self, w: Tensor) -> Tensor:
+        """Reshape loops from [nb, n, V] to [n, nb, nt, nx, ny, nz]."""
+        return tf.reshape(
+            tf.transpose(w, perm=[1, 0, 2]),
+            [w.shape[1], -1, *self._lattice_shape]
+        )
+
     def _wilson_loops(
             self,
             x: Tensor,
             needs_rect: bool = False
     ) -> tuple[Tensor, Tensor]:
-        # y.shape = [nb, d, nt, nx, nx, nx, 3, 3]
-        x = tf.reshape(x, self._shape)
-        assert isinstance(x, Tensor)
-        assert len(x.shape) == 8
-        # assert isinstance(x, Tensor)
-        pcount = 0
-        rcount = 0
-        plaqs = tf.TensorArray(x.dtype, size=0, dynamic_size=True)
-        rects = tf.TensorArray(x.dtype, size=0, dynamic_size=True)
-        for u in range(1, 4):
-            for v in range(0, u):
-                yuv = self.g.mul(x[:, u], tf.roll(x[:, v], shift=-1, axis=u+1))
-                yvu = self.g.mul(x[:, v], tf.roll(x[:, u], shift=-1, axis=v+1))
-                plaq = self.g.trace(self.g.mul(yuv, yvu, adjoint_b=True))
-                plaqs = plaqs.write(pcount, plaq)
-                pcount += 1
-
-                # plaqs.append(plaq)
-                if needs_rect:
-                    yu = tf.roll(x[:, u], shift=-1, axis=v+1)
-                    yv = tf.roll(x[:, v], shift=-1, axis=u+1)
-                    uu = self.g.mul(x[:, v], yuv, adjoint_a=True)
-                    ur = self.g.mul(x[:, u], yvu, adjoint_a=True)
-                    ul = self.g.mul(yuv, yu, adjoint_b=True)
-                    ud = self.g.mul(yvu, yv, adjoint_b=True)
-                    ul_ = tf.roll(ul, shift=-1, axis=u+1)
-                    ud_ = tf.roll(ud, shift=-1, axis=v+1)
-                    tr_urul_ = (
-                        self.g.trace(self.g.mul(ur, ul_, adjoint_b=True))
-                    )
-                    tr_uuud_ = (
-                        self.g.trace(self.g.mul(uu, ud_, adjoint_b=True))
-                    )
-                    rects.write(rcount, tr_urul_)
-                    rects.write(rcount + 1, tr_uuud_)
-                    rcount += 1
-
-        return plaqs.stack(), rects.stack()
+        """Returns traces of the plaquettes (and rectangles).
+
+        All six orientations are gathered with precomputed shift indices and
+        computed with a single batched matmul for each term, so the graph
+        size does not depend on the number of (u, v) pairs.
+
+        Output shapes:
+         - plaqs.shape = [6, nb, nt, nx, ny, nz]
+         - rects.shape = [12, nb, nt, nx, ny, nz]  (empty if not needs_rect)
+        """
+        # y.shape = [nb, d, V, 3, 3]
+        lshape = [*self.link_shape]
+        y = tf.reshape(x, [-1, self.dim, self.volume, *lshape])
+        yflat = tf.reshape(y, [-1, self.dim * self.volume, *lshape])
+        xu = tf.gather(y, self._udirs, axis=1)          # U[u](n)
+        xv = tf.gather(y, self._vdirs, axis=1)          # U[v](n)
+        xv_u = tf.gather(yflat, self._xv_u, axis=1)     # U[v](n + u)
+        xu_v = tf.gather(yflat, self._xu_v, axis=1)     # U[u](n + v)
+        yuv = self.g.mul(xu, xv_u)
+        yvu = self.g.mul(xv, xu_v)
+        plaqs = self._stack_loops(
+            self.g.trace(self.g.mul(yuv, yvu, adjoint_b=True))
+        )
+        if not needs_rect:
+            return plaqs, plaqs[:0]
+
+        nloops = len(PLAQ_DIRS)
+        uu = self.g.mul(xv, yuv, adjoint_a=True)
+        ur = self.g.mul(xu, yvu, adjoint_a=True)
+        ul = self.g.mul(yuv, xu_v, adjoint_b=True)
+        ud = self.g.mul(yvu, xv_u, adjoint_b=True)
+        ul_ = tf.gather(tf.reshape(ul, [-1, nloops * self.volume, *lshape]),
+                        self._shift_u, axis=1)          # ul[p](n + u)
+        ud_ = tf.gather(tf.reshape(ud, [-1, nloops * self.volume, *lshape]),
+                        self._shift_v, axis=1)          # ud[p](n + v)
+        # NOTE: [nb, 6, 2, V] -> [nb, 12, V], ordered as (ur, uu) per plaq
+        rects = tf.reshape(tf.stack([
+            self.g.trace(self.g.mul(ur, ul_, adjoint_b=True)),
+            self.g.trace(self.g.mul(uu, ud_, adjoint_b=True)),
+        ], axis=2), [-1, 2 * nloops, self.volume])
+
+        return plaqs, self._stack_loops(rects)
+
+    @staticmethod
+    def _sum_loops(wloops: Tensor) -> Tensor:
+        """Sum over all orientations and sites, keeping the batch dim."""
+        return tf.reduce_sum(wloops, axis=[0, *range(2, len(wloops.shape))])
 
     def _plaquettes(self, x: Tensor) -> Tensor:
         ps, _ = self._wilson_loops(x)
-        psum = tf.zeros_like(tf.math.real(ps[0]))  # type: ignore
-        for p in ps:  # NOTE: len(ps) == 6
-            psum += tf.reduce_sum(tf.math.real(p), axis=range(1, len(p.shape)))
-
-        # NOTE: return psum / (len(ps) * dim(link) * volume)
-        return psum / (6 * 3 * self.volume)
+        return self.plaqs(ps)
 
     def plaqs(self, wloops: Tensor) -> Tensor:
-        psum = tf.zeros_like(tf.math.real(wloops[0]))  # type:ignore
-        for p in wloops:
-            psum += tf.reduce_sum(tf.math.real(p), axis=range(1, len(p.shape)))
-
+        # NOTE: return psum / (len(ps) * dim(link) * volume)
+        psum = self._sum_loops(tf.math.real(wloops))
         return psum / (6 * 3 * self.volume)
 
     def _int_charges(self, wloops: Tensor) -> Tensor:
         # TODO: IMPLEMENT
-        qsum = tf.zeros_like(tf.math.imag(wloops[0]))  # type:ignore
-        for p in wloops:
-            qsum += tf.reduce_sum(tf.math.imag(p), axis=range(1, len(p.shape)))
-
+        qsum = self._sum_loops(tf.math.imag(wloops))
         return qsum / (32 * (np.pi ** 2))
 
     def _sin_charges(self, wloops: Tensor) -> Tensor:
-        qsum = tf.zeros_like(tf.math.imag(wloops[0]))  # type:ignore
-        for p in wloops:
-            qsum += tf.reduce_sum(tf.math.imag(p), axis=range(1, len(p.shape)))
-
+        qsum = self._sum_loops(tf.math.imag(wloops))
         return qsum / (6 * 3 * self.volume)
 
     def wilson_loops(self, x: Tensor) -> Tensor:
@@ -186,25 +207,11 @@ class LatticeSU3:
     ):
         """Returns the action"""
         coeffs = self.coeffs(beta)
-        ps, rs = self._wilson_loops(x, needs_rect=self.c1 != 0)
-        assert isinstance(x, Tensor)
-        psum = tf.zeros(x.shape[0])
-        for p in ps:
-            psum += tf.reduce_sum(
-                tf.math.real(p),
-                axis=range(1, len(p.shape))
-            )
-
+        ps, rs = self._wilson_loops(x, needs_rect=self._needs_rect)
+        psum = self._sum_loops(tf.math.real(ps))
         action = tf.math.multiply(coeffs['plaq'], psum)
-
-        if self.c1 != 0:
-            # rsum = tf.constant(0.0)
-            rsum = tf.zeros(x.shape[0])
-            for r in rs:
-                rsum += tf.reduce_sum(
-                    tf.math.real(r),
-                    axis=range(1, len(r.shape))
-                )
+        if self._needs_rect:
+            rsum = self._sum_loops(tf.math.real(rs))
             action += tf.math.multiply(coeffs['rect'], rsum)
 
         return action * tf.constant(-1.0 / 3.0)
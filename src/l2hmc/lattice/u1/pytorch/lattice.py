@@ -38,6 +38,13 @@ def area_law(beta: float, nplaqs: int):
 
 
 def plaq_exact(beta: float | Tensor):
+    """Exact (infinite volume) average plaquette at `beta`.
+
+    NOTE: For a `Tensor` (e.g. a per-chain `[nb]` beta), this is computed
+    with `torch.special`, so it stays on the same device.
+    """
+    if isinstance(beta, Tensor):
+        return torch.special.i1(beta) / torch.special.i0(beta)
     return i1(beta) / i0(beta)
 
 
@@ -79,31 +86,56 @@ class LatticeU1(BaseLatticeU1):
                                     grad_outputs=identity)
         return dsdx
 
+    def force(self, x: Tensor, beta: Tensor) -> Tensor:
+        """Analytic gradient of the Wilson action, dS/dx.
+
+        Each link enters exactly two plaquettes with opposite orientation,
+        so dS/dx is built from sin(wloops) and its neighbor along the
+        orthogonal direction, without going through autograd.
+        """
+        # NOTE: wloops.shape = [nb, Lt, Lx], with
+        #   wloop[t, x] = x0[t, x] + x1[t, x+1] - x0[t+1, x] - x1[t, x]
+        dsdw = torch.sin(self.wilson_loops(x))
+        f0 = dsdw - dsdw.roll(1, dims=1)    # dS / dx0
+        f1 = dsdw.roll(1, dims=2) - dsdw    # dS / dx1
+        force = torch.stack([f0, f1], dim=1).reshape(x.shape)
+        if isinstance(beta, Tensor) and beta.ndim > 0:
+            # NOTE: Per-chain beta, `[nb]`, broadcast over all links
+            beta = beta.reshape(-1, *([1] * (force.ndim - 1)))
+        return beta * force
+
     def plaqs_diff(
             self,
-            beta: float,
+            beta: float | Tensor,
             x: Optional[Tensor] = None,
             wloops: Optional[Tensor] = None,
     ) -> Tensor:
-        """Calculate the difference between plaquettes and expected value"""
+        """Calculate the difference between plaquettes and expected value.
+
+        `beta` can be a scalar, or a (per-chain) `[nb]` tensor.
+        """
         wloops = self._get_wloops(x) if wloops is None else wloops
         plaqs = self.plaqs(wloops=wloops)
-        pexact = plaq_exact(beta) * torch.ones_like(plaqs)
-        return pexact - self.plaqs(wloops=wloops)
+        beta = torch.as_tensor(beta, dtype=plaqs.dtype, device=plaqs.device)
+        return plaq_exact(beta) * torch.ones_like(plaqs) - plaqs
 
     def calc_metrics(
             self,
             x: Tensor,
-            beta: Optional[float] = None
+            beta: Optional[float | Tensor] = None
     ) -> dict[str, Tensor]:
-        """Calculate various metrics and return as dict"""
+        """Calculate various metrics and return as dict.
+
+        If `beta` (a scalar, or a per-chain `[nb]` tensor) is specified,
+        includes `plaqs_err`, the difference from the exact plaquette.
+        """
         wloops = self.wilson_loops(x)
         plaqs = self.plaqs(wloops=wloops)
         charges = self.charges(wloops=wloops)
         metrics = {'plaqs': plaqs}
         if beta is not None:
             metrics.update({
-               'plaqs_err': plaq_exact(torch.from_numpy(beta)) - plaqs
+               'plaqs_err': self.plaqs_diff(beta, wloops=wloops)
             })
         metrics.update({
             'intQ': charges.intQ, 'sinQ': charges.sinQ
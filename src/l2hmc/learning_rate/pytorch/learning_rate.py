@@ -0,0 +1,177 @@
+"""
+learning_rate.py
+
+Implements `LearningRateScheduler`, the pytorch counterpart of the
+(tensorflow) `ReduceLROnPlateau`, driven by the same `LearningRateConfig`.
+
+The learning rate at (global) step `t` is
+
+    lr(t) = max(min_lr, lr_init * w(t) * decay_rate ** (t // decay_steps)
+                        * factor ** nreductions)
+
+where `w(t) = min(1, (t + 1) / warmup)` linearly warms up the learning rate
+over the first `warmup` steps, and `nreductions` is the number of times the
+monitored metric has plateaued (after warmup). Exponential decay is only
+used if `decay_steps > 0`.
+"""
+from __future__ import absolute_import, division, print_function, annotations
+import logging
+import math
+from typing import Optional
+
+import torch
+
+from l2hmc.configs import LearningRateConfig
+
+
+log = logging.getLogger(__name__)
+
+Tensor = torch.Tensor
+
+
+class LearningRateScheduler:
+    """Warmup, exponential decay and plateau reduction of the learning rate.
+
+    The monitored metric (`lr_config.monitor`) is averaged over windows of
+    `window` steps, and the learning rate is reduced by `factor` once the
+    windowed average hasn't improved (by `min_delta`) for `patience`
+    windows (with `cooldown` windows of grace after each reduction).
+
+    Example:
+        >>> scheduler = LearningRateScheduler(lr_config, optimizer, window)
+        >>> for step in range(nsteps):
+        ...     x, metrics = train_step((x, beta))
+        ...     lr = scheduler.step(metrics)  # lr for the next step
+    """
+    def __init__(
+            self,
+            lr_config: LearningRateConfig,
+            optimizer: torch.optim.Optimizer,
+            window: int = 1,
+            staircase: bool = True,
+    ) -> None:
+        self.cfg = lr_config
+        self.optimizer = optimizer
+        self.window = max(1, int(window))
+        self.staircase = staircase
+        self.monitor = self.cfg.monitor
+        self.mode = self.cfg.mode
+        if self.cfg.factor >= 1.0:
+            raise ValueError('ReduceLROnPlateau '
+                             'does not support a factor >= 1.0.')
+        if self.mode not in ['auto', 'min', 'max']:
+            log.warning('Learning Rate Plateau Reducing mode '
+                        f'{self.mode} is unknown, fallback to auto mode.')
+            self.mode = 'auto'
+        self.minimize = (
+            self.mode == 'min'
+            or (self.mode == 'auto' and 'acc' not in self.monitor)
+        )
+        self.gstep = 0
+        self.scale = 1.0
+        self.best = math.inf if self.minimize else -math.inf
+        self.wait = 0
+        self.cooldown_counter = 0
+        self.nreductions = 0
+        # NOTE: Accumulated as a (detached) tensor, so that we only sync
+        # with the device once per window
+        self._total: Optional[Tensor] = None
+        self._count = 0
+        self._set_lr(self.lr_at(self.gstep))
+
+    @property
+    def lr(self) -> float:
+        return self.optimizer.param_groups[0]['lr']
+
+    def lr_at(self, gstep: int) -> float:
+        """Returns the learning rate at (global) step `gstep`."""
+        lr = self.cfg.lr_init * self.scale
+        warmup = self.cfg.warmup
+        if warmup is not None and warmup > 0 and gstep < warmup:
+            return lr * (gstep + 1) / warmup
+        decay_steps = self.cfg.decay_steps
+        if decay_steps is not None and decay_steps > 0:
+            p = gstep / decay_steps
+            p = math.floor(p) if self.staircase else p
+            lr *= self.cfg.decay_rate ** p
+        return max(lr, self.cfg.min_lr)
+
+    def _set_lr(self, lr: float) -> None:
+        for group in self.optimizer.param_groups:
+            group['lr'] = lr
+
+    def in_cooldown(self) -> bool:
+        return self.cooldown_counter > 0
+
+    def improved(self, current: float) -> bool:
+        if self.minimize:
+            return current < self.best - self.cfg.min_delta
+        return current > self.best + self.cfg.min_delta
+
+    def step(self, metrics: Optional[dict] = None) -> float:
+        """Advance one (training) step, returning the new learning rate."""
+        val = None if metrics is None else metrics.get(self.monitor, None)
+        if val is not None and self.gstep >= (self.cfg.warmup or 0):
+            val = torch.as_tensor(val).detach().float().mean()
+            self._total = val if self._total is None else self._total + val
+            self._count += 1
+            if self._count >= self.window:
+                self.on_window_end(float(self._total) / self._count)
+                self._total, self._count = None, 0
+
+        self.gstep += 1
+        lr = self.lr_at(self.gstep)
+        self._set_lr(lr)
+        return lr
+
+    def on_window_end(self, current: float) -> None:
+        """Update the plateau state with the windowed average `current`."""
+        if not math.isfinite(current):
+            return
+        if self.in_cooldown():
+            self.cooldown_counter -= 1
+            self.wait = 0
+        if self.improved(current):
+            self.best = current
+            self.wait = 0
+        elif not self.in_cooldown():
+            self.wait += 1
+            if self.wait >= self.cfg.patience:
+                old_lr = self.lr_at(self.gstep)
+                if old_lr > self.cfg.min_lr:
+                    self.scale *= self.cfg.factor
+                    self.nreductions += 1
+                    if self.cfg.verbose:
+                        log.warning(
+                            f'ReduceLROnPlateau (step {self.gstep}):'
+                            ' Reducing learning rate from:'
+                            f' {old_lr:.4g} to {self.lr_at(self.gstep):.4g}'
+                            f' ({self.monitor}: {current:.4g},'
+                            f' best: {self.best:.4g})'
+                        )
+                self.cooldown_counter = self.cfg.cooldown
+                self.wait = 0
+
+    def state_dict(self) -> dict:
+        return {
+            'gstep': self.gstep,
+            'scale': self.scale,
+            'best': self.best,
+            'wait': self.wait,
+            'cooldown_counter': self.cooldown_counter,
+            'nreductions': self.nreductions,
+            'total': None if self._total is None else float(self._total),
+            'count': self._count,
+        }
+
+    def load_state_dict(self, state: dict) -> None:
+        self.gstep = state['gstep']
+        self.scale = state['scale']
+        self.best = state['best']
+        self.wait = state['wait']
+        self.cooldown_counter = state['cooldown_counter']
+        self.nreductions = state['nreductions']
+        total = state.get('total', None)
+        self._total = None if total is None else torch.tensor(total)
+        self._count = state.get('count', 0)
+        self._set_lr(self.lr_at(self.gstep))
@@ -50,14 +50,18 @@ class LatticeLoss:
             self,
             xinit: Tensor,
             xout: Optional[Tensor] = None,
-            beta: Optional[float] = None,
+            beta: Optional[float | Tensor] = None,
     ) -> dict[str, Tensor]:
+        """Lattice observables of `xinit` (and changes in charge to `xout`).
+
+        `beta` can be a scalar, or a (per-chain) `[nchains]` tensor.
+        """
         metrics = self.lattice.calc_metrics(x=xinit, beta=beta)
         if xout is not None:
             qint_init = metrics['intQ']
             qsin_init = metrics['sinQ']
             wl_out = self.lattice.wilson_loops(x=xout)
-            qint_out = self.lattice._int_charges(wloops=wl_out)
+            qint_out = self.lattice.int_charges(x=xout, wloops=wl_out)
             qsin_out = self.lattice._sin_charges(wloops=wl_out)
             metrics.update({
                 'dQint': (qint_out - qint_init).abs(),
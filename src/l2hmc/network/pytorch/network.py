@@ -6,6 +6,8 @@ Contains the pytorch implementation of the Normalizing Flow network
 used to train the L2HMC model.
 """
 from __future__ import absolute_import, annotations, division, print_function
+from collections import defaultdict
+import re
 from typing import Callable, Optional
 
 import numpy as np
@@ -208,13 +210,314 @@ class Network(nn.Module):
         return (s, t, q)
 
 
+class StackedNetwork(nn.Module):
+    """`n` independent (MLP) `Network`s, with weights stacked along dim 0.
+
+    Each Linear layer is stored as a `[n, out, in]` weight (the `nn.Linear`
+    layout, which CPU BLAS handles much faster than `[n, in, out]`) and
+    `[n, out]` bias, so network `idx` is evaluated by indexing into the
+    stack, and the
+    projection of a shared input through several networks (e.g. `v`, for
+    the first and second xnet of a leapfrog step) is a single matmul, see
+    `StackedNetwork.project_v`.
+
+    Use `to_stacked_state_dict` / `from_stacked_state_dict` to convert
+    to / from the state dict layout of the per-step `Network`s.
+    """
+    def __init__(
+            self,
+            n: int,
+            xshape: tuple[int],
+            network_config: NetworkConfig,
+            input_shapes: Optional[dict[str, int]] = None,
+            net_weight: Optional[NetWeight] = None,
+            conv_config: Optional[ConvolutionConfig] = None,
+            name: Optional[str] = None,
+    ):
+        super().__init__()
+        if conv_config is not None and len(conv_config.filters) > 0:
+            raise ValueError('StackedNetwork does not support `conv_config`')
+        if net_weight is None:
+            net_weight = NetWeight(1., 1., 1.)
+
+        self.n = n
+        self.name = name if name is not None else 'network'
+        self.xshape = xshape
+        self.net_config = network_config
+        self.nw = net_weight
+        self.xdim = np.cumprod(xshape[1:])[-1]
+        if input_shapes is None:
+            input_shapes = {'x': self.xdim, 'v': self.xdim}
+
+        self.input_shapes = {
+            key: (np.cumprod(val)[-1] if isinstance(val, (list, tuple))
+                  else val)
+            for key, val in input_shapes.items()
+        }
+        act_fn = self.net_config.activation_fn
+        if isinstance(act_fn, str):
+            act_fn = ACTIVATION_FNS.get(act_fn, None)
+
+        assert isinstance(act_fn, Callable)
+        self.activation_fn = act_fn
+        self.units = self.net_config.units
+
+        self.s_coeff = nn.parameter.Parameter(torch.zeros(n, 1, self.xdim))
+        self.q_coeff = nn.parameter.Parameter(torch.zeros(n, 1, self.xdim))
+        self.x_weight, self.x_bias = self._linear(
+            self.input_shapes['x'], self.units[0]
+        )
+        self.v_weight, self.v_bias = self._linear(
+            self.input_shapes['v'], self.units[0]
+        )
+        self.hidden_weights = nn.ParameterList()
+        self.hidden_biases = nn.ParameterList()
+        for idx, units in enumerate(self.units[1:]):
+            w, b = self._linear(self.units[idx], units)
+            self.hidden_weights.append(w)
+            self.hidden_biases.append(b)
+
+        self.scale_weight, self.scale_bias = self._linear(
+            self.units[-1], self.xdim
+        )
+        self.transl_weight, self.transl_bias = self._linear(
+            self.units[-1], self.xdim
+        )
+        self.transf_weight, self.transf_bias = self._linear(
+            self.units[-1], self.xdim
+        )
+        if self.net_config.dropout_prob > 0:
+            self.dropout = nn.Dropout(self.net_config.dropout_prob)
+
+        if self.net_config.use_batch_norm:
+            self.batch_norms = nn.ModuleList([
+                nn.BatchNorm1d(self.units[-1]) for _ in range(n)
+            ])
+
+        self._views = {}
+        self._views_key = None
+
+    def _linear(
+            self,
+            nin: int,
+            nout: int
+    ) -> tuple[nn.parameter.Parameter, nn.parameter.Parameter]:
+        """Returns stacked (weight, bias), initialized as in `nn.Linear`."""
+        bound = 1. / np.sqrt(nin)
+        w = torch.empty(self.n, nout, nin).uniform_(-bound, bound)
+        b = torch.empty(self.n, nout).uniform_(-bound, bound)
+        return nn.parameter.Parameter(w), nn.parameter.Parameter(b)
+
+    def _get_views(self) -> dict[str, tuple[Tensor, ...]]:
+        """Returns per-network views of the stacked parameters.
+
+        Indexing into a stacked parameter on every call would make the
+        backward pass build (and sum) a full size gradient for each call, so
+        we `unbind` them once and reuse the views until they change.
+        """
+        params = dict(self.named_parameters(recurse=False))
+        params.update({
+            f'hidden_{key}.{i}': p
+            for key, plist in (('weights', self.hidden_weights),
+                               ('biases', self.hidden_biases))
+            for i, p in enumerate(plist)
+        })
+        key = (torch.is_grad_enabled(), *[
+            (p._version, p.data_ptr()) for p in params.values()
+        ])
+        if key != self._views_key:
+            self._views = {name: p.unbind(0) for name, p in params.items()}
+            self._views_key = key
+
+        return self._views
+
+    def project_v(self, v: Tensor, idxs: list[int]) -> Tensor:
+        """Returns v_layer(v) for each network in `idxs`, [len(idxs), nb, u]"""
+        # NOTE: Single GEMM with the `[len(idxs) * u, in]` stacked weights
+        vproj = F.linear(
+            flatten(v),
+            self.v_weight[idxs].flatten(0, 1),
+            self.v_bias[idxs].flatten(),
+        )
+        return vproj.reshape(v.shape[0], len(idxs), -1).transpose(0, 1)
+
+    def forward(
+            self,
+            inputs: tuple[Tensor, Tensor],
+            idx: int = 0,
+            vproj: Optional[Tensor] = None,
+    ) -> tuple[Tensor, Tensor, Tensor]:
+        """Evaluate network `idx`, optionally with `vproj = v_layer(v)`."""
+        x, v = inputs
+        p = {key: val[idx] for key, val in self._get_views().items()}
+        if vproj is None:
+            vproj = F.linear(flatten(v), p['v_weight'], p['v_bias'])
+
+        x = F.linear(flatten(x), p['x_weight'], p['x_bias'])
+        z = self.activation_fn(x + vproj)
+        for i in range(len(self.hidden_weights)):
+            z = self.activation_fn(F.linear(
+                z, p[f'hidden_weights.{i}'], p[f'hidden_biases.{i}']
+            ))
+
+        if self.net_config.dropout_prob > 0:
+            z = self.dropout(z)
+
+        if self.net_config.use_batch_norm:
+            z = self.batch_norms[idx](z)
+
+        scale = torch.exp(p['s_coeff']) * torch.tanh(
+            F.linear(z, p['scale_weight'], p['scale_bias'])
+        )
+        transl = F.linear(z, p['transl_weight'], p['transl_bias'])
+        transf = torch.exp(p['q_coeff']) * torch.tanh(
+            F.linear(z, p['transf_weight'], p['transf_bias'])
+        )
+
+        s = torch.mul(self.nw.s, scale)
+        t = torch.mul(self.nw.t, transl)
+        q = torch.mul(self.nw.q, transf)
+
+        return (s, t, q)
+
+
+# NOTE: Maps `Network` parameter names to `StackedNetwork` ones
+_STACKED_NAMES = [
+    (r'(x|v|scale|transl|transf)(?:_layer)?\.(weight|bias)', r'\1_\2'),
+    (r'hidden_layers\.(\d+)\.weight', r'hidden_weights.\1'),
+    (r'hidden_layers\.(\d+)\.bias', r'hidden_biases.\1'),
+    (r'(s_coeff|q_coeff)', r'\1'),
+]
+_STACKED_PARAM = re.compile(
+    r'(x|v|scale|transl|transf)_(weight|bias)'
+    r'|hidden_(weights|biases)\.\d+|(s|q)_coeff'
+)
+_NETWORK_KEY = re.compile(
+    r'^(?P<prefix>(?:.*\.)?)(?P<net>xnet|vnet)\.'
+    r'(?:(?P<step>\d+)\.)?(?:(?P<half>first|second)\.)?(?P<param>.+)$'
+)
+
+
+def to_stacked_state_dict(state_dict: dict[str, Tensor]) -> dict:
+    """Convert a state dict with per-step `Network`s to `StackedNetwork`s.
+
+    Keys of the form `[prefix.]xnet.{i}.first.x_layer.weight` (or
+    `vnet.{i}...`, `xnet.x_layer...`, etc.) are collected into the
+    corresponding stacked parameter, and all other keys are left as is.
+    Network `i` of a split xnet is stored at index `2 * i (+ 1)`.
+    """
+    if not any(key.endswith('x_layer.weight') for key in state_dict):
+        # NOTE: Nothing to convert (e.g. already stacked)
+        return dict(state_dict)
+
+    out = {}
+    stacks = defaultdict(dict)
+    for key, val in state_dict.items():
+        match = _NETWORK_KEY.match(key)
+        if match is None:
+            out[key] = val
+            continue
+        prefix, net, step, half, param = match.group(
+            'prefix', 'net', 'step', 'half', 'param'
+        )
+        idx = 0 if step is None else int(step)
+        if half is not None:
+            idx = 2 * idx + int(half == 'second')
+        bn = re.match(r'batch_norm\.(.+)$', param)
+        if bn is not None:
+            out[f'{prefix}{net}.batch_norms.{idx}.{bn.group(1)}'] = val
+            continue
+        for pattern, repl in _STACKED_NAMES:
+            if re.fullmatch(pattern, param) is not None:
+                name = re.sub(pattern, repl, param)
+                stacks[f'{prefix}{net}.{name}'][idx] = val
+                break
+        else:
+            out[key] = val
+
+    for key, vals in stacks.items():
+        out[key] = torch.stack([vals[i] for i in sorted(vals)])
+
+    return out
+
+
+def from_stacked_state_dict(state_dict: dict[str, Tensor]) -> dict:
+    """Inverse of `to_stacked_state_dict`."""
+    sizes = {}
+    for key, val in state_dict.items():
+        match = re.match(r'^(.*?)(xnet|vnet)\.s_coeff$', key)
+        if match is not None:
+            sizes[match.group(2)] = val.shape[0]
+
+    nv = sizes.get('vnet', 1)
+    split = sizes.get('xnet', 1) == 2 * nv and nv > 1
+
+    def _network_prefix(net: str, idx: int) -> str:
+        if nv == 1:
+            return f'{net}.'
+        if net == 'xnet' and split:
+            return f'{net}.{idx // 2}.{("first", "second")[idx % 2]}.'
+        return f'{net}.{idx}.'
+
+    out = {}
+    for key, val in state_dict.items():
+        match = re.match(r'^(?P<prefix>(?:.*\.)?)(?P<net>xnet|vnet)\.'
+                         r'(?P<param>.+)$', key)
+        if match is None:
+            out[key] = val
+            continue
+        prefix, net, param = match.group('prefix', 'net', 'param')
+        bn = re.match(r'batch_norms\.(\d+)\.(.+)$', param)
+        if bn is not None:
+            pre = _network_prefix(net, int(bn.group(1)))
+            out[f'{prefix}{pre}batch_norm.{bn.group(2)}'] = val
+            continue
+        if _STACKED_PARAM.fullmatch(param) is None:
+            out[key] = val
+            continue
+        name = _unstacked_name(param)
+        for idx in range(val.shape[0]):
+            out[f'{prefix}{_network_prefix(net, idx)}{name}'] = val[idx]
+
+    return out
+
+
+def _unstacked_name(name: str) -> str:
+    """Returns the `Network` name of the `StackedNetwork` parameter `name`."""
+    hidden = re.fullmatch(r'hidden_(weights|biases)\.(\d+)', name)
+    if hidden is not None:
+        pname = 'weight' if hidden.group(1) == 'weights' else 'bias'
+        return f'hidden_layers.{hidden.group(2)}.{pname}'
+    if name in ['s_coeff', 'q_coeff']:
+        return name
+    layer, pname = name.rsplit('_', 1)
+    layer = f'{layer}_layer' if layer in ['x', 'v'] else layer
+    return f'{layer}.{pname}'
+
+
 class NetworkFactory(BaseNetworkFactory):
-    def build_networks(self, n: int, split_xnets: bool) -> nn.ModuleDict:
-        """Build LeapfrogNetwork."""
+    def build_networks(
+            self,
+            n: int,
+            split_xnets: bool,
+            stacked: bool = False,
+    ) -> nn.ModuleDict:
+        """Build LeapfrogNetwork.
+
+        If `stacked`, the `n` (or `2n`, with `split_xnets`) networks are
+        stored in a single `StackedNetwork` each, for `xnet` and `vnet`.
+        """
         # TODO: if n == 0: build hmcNetwork (return zeros)
         assert n >= 1, 'Must build at least one network'
 
         cfg = self.get_build_configs()
+        if stacked:
+            nx = 2 * n if (split_xnets and n > 1) else n
+            return nn.ModuleDict({
+                'xnet': StackedNetwork(nx, **cfg['xnet'], name='xnet'),
+                'vnet': StackedNetwork(n, **cfg['vnet'], name='vnet'),
+            })
+
         if n == 1:
             return nn.ModuleDict({
                 'xnet': Network(**cfg['xnet']),
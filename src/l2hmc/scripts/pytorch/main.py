@@ -4,20 +4,35 @@ main_pytorch.py
 Contains entry-point for training and inference.
 """
 from __future__ import absolute_import, annotations, division, print_function
+import json
 import logging
 import os
 from pathlib import Path
 from typing import Any, Optional
 
 import hydra
+import joblib
+import numpy as np
 from omegaconf import DictConfig
 import torch
 
-from l2hmc.common import save_and_analyze_data
-from l2hmc.configs import get_jobdir
+from l2hmc.common import (
+    analyze_autocorr,
+    analyze_beta_scan,
+    compare_autocorr,
+    get_error_kwargs,
+    get_plot_kwargs,
+    save_and_analyze_data,
+)
+from l2hmc.configs import AnnealingSchedule, get_jobdir
 from l2hmc.experiment import Experiment
 from l2hmc.trainers.pytorch.trainer import Trainer
-from l2hmc.utils.pytorch.utils import get_summary_writer
+from l2hmc.utils.h5writer import H5Writer
+from l2hmc.utils.online import StreamingObservables
+from l2hmc.utils.pytorch.chains import ChainStore
+from l2hmc.utils.pytorch.stepsize import DualAveraging
+from l2hmc.utils.pytorch.tempering import ReplicaExchange, beta_ladder
+from l2hmc.utils.pytorch.utils import find_ckpt, get_summary_writer
 
 
 log = logging.getLogger(__name__)
@@ -30,6 +45,138 @@ Tensor = torch.Tensor
 # TODO: Gather and separate duplicate file I/O related methods
 # -------------------------------------------------------------
 
+def get_sink(cfg: DictConfig, jobdir: os.PathLike, job_type: str):
+    """Returns `H5Writer` for streaming metrics, if `cfg.stream_every > 0`."""
+    if cfg.get('stream_every', 0) > 0:
+        fpath = Path(jobdir).joinpath('data', f'{job_type}_stream.h5')
+        return H5Writer(fpath,
+                        compression=cfg.get('stream_compression', 'lzf'))
+    return None
+
+
+def get_observables(cfg: DictConfig) -> Optional[StreamingObservables]:
+    """Returns `StreamingObservables` for `eval`, if `cfg.online_stats`."""
+    if cfg.get('online_stats', False):
+        return StreamingObservables(
+            volume=float(np.prod(cfg.dynamics.latvolume)),
+            max_lag=cfg.get('online_max_lag', 64),
+            bin_size=cfg.get('online_bin_size', 1),
+        )
+    return None
+
+
+def get_tempering(
+        cfg: DictConfig,
+        schedule: AnnealingSchedule,
+) -> Optional[ReplicaExchange]:
+    """Returns `ReplicaExchange` for `eval`, if `cfg.pt_replicas > 1`.
+
+    The replicas use a geometric ladder of betas from `cfg.pt_beta_min`
+    (or `schedule.beta_init`) to the target, `schedule.beta_final`.
+    """
+    nreplicas = cfg.get('pt_replicas', 0)
+    if nreplicas is None or nreplicas < 2:
+        return None
+    beta_min = cfg.get('pt_beta_min', None)
+    beta_min = schedule.beta_init if beta_min is None else beta_min
+    beta_max = schedule.beta_final
+    assert beta_max is not None and beta_min <= beta_max
+    return ReplicaExchange(
+        betas=beta_ladder(beta_min, beta_max, nreplicas=nreplicas),
+        swap_every=cfg.get('pt_swap_every', 10),
+    )
+
+
+def get_eps_adapter(
+        cfg: DictConfig,
+        eps: Tensor,
+) -> Optional[DualAveraging]:
+    """Returns `DualAveraging` for HMC, if `cfg.hmc_adapt_steps > 0`."""
+    if cfg.get('hmc_adapt_steps', 0) > 0:
+        return DualAveraging(
+            eps0=eps,
+            target_accept=cfg.get('hmc_target_accept', 0.8),
+            per_chain=cfg.get('hmc_per_chain_eps', False),
+        )
+    return None
+
+
+def get_chain_store(cfg: DictConfig, load: bool = False) -> ChainStore:
+    """Returns `ChainStore` to save chains to (or, if `load`, load from).
+
+    Chains are saved to `{outdir}/chains`, and loaded from `cfg.chain_dir`
+    if provided (e.g. to warm start from a previous run).
+    """
+    chain_dir = cfg.get('chain_dir', None) if load else None
+    if chain_dir is None:
+        chain_dir = Path(cfg.get('outdir', os.getcwd())).joinpath('chains')
+    return ChainStore(chain_dir)
+
+
+def load_chains(
+        cfg: DictConfig,
+        job_type: str,
+        beta: float | list[float],
+        nchains: Optional[int] = None,
+) -> Optional[Tensor]:
+    """Returns saved chains at `beta` to warm start from, if any.
+
+    `nchains` is the total number of chains, split evenly between betas.
+    """
+    betas = beta if isinstance(beta, list) else [beta]
+    nchains = (
+        None if nchains is None or nchains < 1
+        else max(1, nchains // len(betas))
+    )
+    store = get_chain_store(cfg, load=True)
+    return store.load(job_type,
+                      beta=beta,
+                      nchains=nchains,
+                      nbranches=cfg.get('chain_branches', 1))
+
+
+def save_tempering(
+        tempering: ReplicaExchange,
+        jobdir: os.PathLike,
+        job_type: str,
+        run: Optional[Any] = None,
+) -> dict:
+    """Log (and save) the swap acceptance of each pair of replicas."""
+    summary = tempering.summary()
+    log.info(f'[{job_type}] Replica exchange ({summary["nrounds"]} rounds):')
+    betas = summary['betas']
+    for idx, acc in enumerate(summary['swap_acc']):
+        log.info(f'  {betas[idx]:.4f} <-> {betas[idx + 1]:.4f}: {acc:.4f}')
+        if run is not None:
+            run.summary[f'swap_acc{idx}_{job_type}'] = acc
+
+    outfile = Path(jobdir).joinpath('data', f'{job_type}_tempering.json')
+    outfile.parent.mkdir(exist_ok=True, parents=True)
+    with open(outfile, 'w') as f:
+        json.dump(summary, f, indent=2)
+    return summary
+
+
+def save_observables(
+        observables: StreamingObservables,
+        jobdir: os.PathLike,
+        job_type: str,
+        run: Optional[Any] = None,
+) -> dict:
+    """Log summary of (and save state of) streaming `observables`."""
+    summary = observables.summary()
+    log.info(f'[{job_type}] Streaming estimates (over {observables.n} steps):')
+    for key, val in summary.items():
+        log.info(f'  {key}: {val:.6g}')
+        if run is not None:
+            run.summary[f'{key}_{job_type}.online'] = val
+
+    outfile = Path(jobdir).joinpath('data', f'{job_type}_observables.z')
+    outfile.parent.mkdir(exist_ok=True, parents=True)
+    joblib.dump(observables.state_dict(), outfile)
+    return summary
+
+
 def evaluate(
         cfg: DictConfig,
         trainer: Trainer,
@@ -38,10 +185,15 @@ def evaluate(
         # writer: Optional[Any] = None,
         nchains: Optional[int] = None,
         eps: Optional[Tensor] = None,
+        shard: bool = False,
 ) -> dict:
-    """Evaluate model (nested as `trainer.model`)"""
+    """Evaluate model (nested as `trainer.model`)
+
+    If `shard`, this should be called on every rank, each of which evaluates
+    its own slice of the `nchains` chains (see `Trainer.eval`), with the
+    results analyzed (and saved) on the main process only.
+    """
     nchains = -1 if nchains is None else nchains
-    therm_frac = cfg.get('therm_frac', 0.2)
 
     # # writer = None
     jobdir = get_jobdir(cfg, job_type=job_type)
@@ -50,12 +202,90 @@ def evaluate(
     else:
         writer = None
 
-    output = trainer.eval(run=run,
-                          writer=writer,
-                          nchains=nchains,
-                          job_type=job_type,
-                          eps=eps)
+    sink = (
+        get_sink(cfg, jobdir=jobdir, job_type=job_type)
+        if trainer.accelerator.is_local_main_process else None
+    )
+    observables = get_observables(cfg)
+    tempering = get_tempering(cfg, schedule=trainer.schedule)
+    eps_adapter = (
+        get_eps_adapter(cfg, eps) if job_type == 'hmc' and eps is not None
+        else None
+    )
+    beta_scan = cfg.get('beta_scan', None)
+    beta_scan = None if beta_scan is None else list(beta_scan)
+    if tempering is not None and beta_scan is not None:
+        log.warning('Ignoring `beta_scan` in favor of parallel tempering!')
+        beta_scan = None
+    x = None
+    if cfg.get('warm_start', False):
+        x = load_chains(
+            cfg,
+            job_type=job_type,
+            nchains=nchains,
+            beta=(
+                tempering.betas.tolist() if tempering is not None
+                else beta_scan if beta_scan is not None
+                else trainer.schedule.beta_final
+            ),
+        )
+    # NOTE: Warm started chains are already thermalized
+    therm_frac = cfg.get('therm_frac', None)
+    if therm_frac is None:
+        therm_frac = 0.2 if x is None else 0.0
+    try:
+        output = trainer.eval(x=x,
+                              beta=beta_scan,
+                              run=run,
+                              writer=writer,
+                              nchains=nchains,
+                              job_type=job_type,
+                              sink=sink,
+                              sink_every=cfg.get('stream_every', 0),
+                              observables=observables,
+                              tempering=tempering,
+                              eps_adapter=eps_adapter,
+                              nadapt=cfg.get('hmc_adapt_steps', 0),
+                              shard=shard,
+                              eps=eps)
+    finally:
+        if sink is not None:
+            sink.close()
+
+    if not trainer.accelerator.is_local_main_process:
+        return output
+
+    _ = get_chain_store(cfg).save(output['x'],
+                                  job_type=job_type,
+                                  beta=output['beta'])
+    if observables is not None:
+        _ = save_observables(observables,
+                             run=run,
+                             jobdir=jobdir,
+                             job_type=job_type)
+    if eps_adapter is not None:
+        summary = eps_adapter.summary()
+        outfile = Path(jobdir).joinpath('data', f'{job_type}_stepsize.json')
+        outfile.parent.mkdir(exist_ok=True, parents=True)
+        with open(outfile, 'w') as f:
+            json.dump(summary, f, indent=2)
+        if run is not None:
+            run.summary[f'eps_{job_type}.adapted'] = summary['eps']
+    if tempering is not None:
+        _ = save_tempering(tempering,
+                           run=run,
+                           jobdir=jobdir,
+                           job_type=job_type)
+
     dataset = output['history'].get_dataset(therm_frac=therm_frac)
+    if beta_scan is not None:
+        output['beta_scan'] = analyze_beta_scan(
+            dataset,
+            run=run,
+            outdir=jobdir,
+            job_type=job_type,
+            volume=float(np.prod(cfg.dynamics.latvolume)),
+        )
     if run is not None:
         dQint = dataset.data_vars.get('dQint').values
         drop = int(0.1 * len(dQint))
@@ -63,13 +293,21 @@ def evaluate(
         run.summary[f'dQint_{job_type}'] = dQint
         run.summary[f'dQint_{job_type}.mean'] = dQint.mean()
 
+    output['autocorr'] = analyze_autocorr(dataset,
+                                          run=run,
+                                          outdir=jobdir,
+                                          job_type=job_type,
+                                          timer=output['timer'],
+                                          therm_frac=therm_frac)
     _ = save_and_analyze_data(dataset,
                               run=run,
                               outdir=jobdir,
                               output=output,
                               nchains=nchains,
                               job_type=job_type,
-                              framework='pytorch')
+                              framework='pytorch',
+                              plot_kwargs=get_plot_kwargs(cfg),
+                              **get_error_kwargs(cfg))
 
     return output
 
@@ -82,10 +320,17 @@ def train(
         nchains: Optional[int] = None,
 ) -> dict:
     writer = None
+    sink = None
     nchains = 16 if nchains is None else nchains
     jobdir = get_jobdir(cfg, job_type='train')
+    resume_from = None
+    if cfg.get('resume', None) is not None:
+        resume_from = find_ckpt(cfg.resume)
+        if resume_from is None:
+            raise FileNotFoundError(f'No checkpoints found in {cfg.resume}')
     if trainer.accelerator.is_local_main_process:
         writer = get_summary_writer(cfg, job_type='train')
+        sink = get_sink(cfg, jobdir=jobdir, job_type='train')
 
     # ------------------------------------------
     # NOTE: cfg.profile will be False by default
@@ -102,11 +347,21 @@ def train(
         prof.export_chrome_trace(tracefile)
 
     else:
-        output = trainer.train(run=run,
-                               writer=writer,
-                               train_dir=jobdir)
+        try:
+            output = trainer.train(run=run,
+                                   writer=writer,
+                                   sink=sink,
+                                   sink_every=cfg.get('stream_every', 0),
+                                   resume_from=resume_from,
+                                   train_dir=jobdir)
+        finally:
+            if sink is not None:
+                sink.close()
 
     if trainer.accelerator.is_local_main_process:
+        _ = get_chain_store(cfg).save(output['x'],
+                                      job_type='train',
+                                      beta=output['beta'])
         dset = output['history'].get_dataset()
         _ = save_and_analyze_data(dset,
                                   run=run,
@@ -114,7 +369,8 @@ def train(
                                   output=output,
                                   nchains=nchains,
                                   job_type='train',
-                                  framework='pytorch')
+                                  framework='pytorch',
+                                  plot_kwargs=get_plot_kwargs(cfg))
 
     if writer is not None:
         writer.close()
@@ -146,7 +402,12 @@ def main(cfg: DictConfig) -> dict:
     if run is not None:
         run.unwatch(objs['dynamics'])
 
-    if trainer.accelerator.is_local_main_process:
+    # NOTE: With `shard_eval`, every rank evaluates a slice of the chains
+    shard = (
+        cfg.get('shard_eval', False)
+        and trainer.accelerator.num_processes > 1
+    )
+    if shard or trainer.accelerator.is_local_main_process:
         # batch_size = cfg.dynamics.xshape[0]
         nchains = max((4, cfg.dynamics.nchains // 8))
         if should_train and cfg.steps.test > 0:                     # [2.]
@@ -157,6 +418,7 @@ def main(cfg: DictConfig) -> dict:
                                        # writer=ew,
                                        job_type='eval',
                                        nchains=nchains,
+                                       shard=shard,
                                        trainer=trainer)
         if cfg.steps.test > 0:                                      # [3.]
             log.warning('Running generic HMC')
@@ -168,7 +430,16 @@ def main(cfg: DictConfig) -> dict:
                                       eps=eps_hmc,
                                       job_type='hmc',
                                       nchains=nchains,
+                                      shard=shard,
                                       trainer=trainer)
+    if (
+            'eval' in outputs and 'hmc' in outputs
+            and trainer.accelerator.is_local_main_process
+    ):
+        _ = compare_autocorr(outputs['eval']['autocorr'],
+                             outputs['hmc']['autocorr'],
+                             run=run)
+
     if run is not None:
         run.finish()
 
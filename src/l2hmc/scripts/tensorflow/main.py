@@ -11,7 +11,13 @@ import hydra
 from omegaconf import DictConfig
 import tensorflow as tf
 
-from l2hmc.common import save_and_analyze_data
+from l2hmc.common import (
+    analyze_autocorr,
+    compare_autocorr,
+    get_error_kwargs,
+    get_plot_kwargs,
+    save_and_analyze_data,
+)
 from l2hmc.configs import get_jobdir
 from l2hmc.experiment import Experiment
 from l2hmc.trainers.tensorflow.trainer import Trainer
@@ -66,13 +72,21 @@ def evaluate(
         run.summary[f'dQint_{job_type}'] = dQint
         run.summary[f'dQint_{job_type}.mean'] = dQint.mean()
 
+    output['autocorr'] = analyze_autocorr(dataset,
+                                          run=run,
+                                          outdir=jobdir,
+                                          job_type=job_type,
+                                          timer=output['timer'],
+                                          therm_frac=therm_frac)
     _ = save_and_analyze_data(dataset,
                               run=run,
                               outdir=jobdir,
                               output=output,
                               nchains=nchains,
                               job_type=job_type,
-                              framework='tensorflow')
+                              framework='tensorflow',
+                              plot_kwargs=get_plot_kwargs(cfg),
+                              **get_error_kwargs(cfg))
 
     if writer is not None:
         writer.close()
@@ -110,7 +124,8 @@ def train(
                                   outdir=jobdir,
                                   output=output,
                                   nchains=nchains,
-                                  job_type='train')
+                                  job_type='train',
+                                  plot_kwargs=get_plot_kwargs(cfg))
     if writer is not None:
         writer.close()
 
@@ -164,6 +179,11 @@ def main(cfg: DictConfig) -> dict:
                                       job_type='hmc',
                                       nchains=nchains,
                                       trainer=trainer)
+    if 'eval' in outputs and 'hmc' in outputs:
+        _ = compare_autocorr(outputs['eval']['autocorr'],
+                             outputs['hmc']['autocorr'],
+                             run=run)
+
     if run is not None:
         run.finish()
 
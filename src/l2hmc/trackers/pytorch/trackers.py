@@ -4,11 +4,14 @@ Contains various utilities for tracking / logging metrics in TensorBoard
 """
 from __future__ import absolute_import, annotations, division, print_function
 import logging
-from typing import Optional, Union
+from typing import Optional, TYPE_CHECKING, Union
 
 import numpy as np
 import torch
-from torch.utils.tensorboard.writer import SummaryWriter
+
+if TYPE_CHECKING:
+    # NOTE: Importing tensorboard is slow, and only needed for annotations
+    from torch.utils.tensorboard.writer import SummaryWriter
 
 Tensor = torch.Tensor
 Array = np.ndarray
@@ -4,17 +4,18 @@ trainer.py
 Implements methods for training L2HMC sampler.
 """
 from __future__ import absolute_import, annotations, division, print_function
-from collections import defaultdict
+from collections import defaultdict, deque
 from contextlib import nullcontext
 from dataclasses import asdict
 import logging
 import os
 from pathlib import Path
+import random
 import time
-from typing import Any, Callable, Optional
+from typing import Any, Callable, Optional, Sequence
 
 from accelerate import Accelerator
-from accelerate.utils import extract_model_from_parallel
+from accelerate.utils import extract_model_from_parallel, gather_object
 import numpy as np
 from rich import box
 from rich.live import Live
@@ -22,7 +23,6 @@ from rich.live import Live
 from rich.table import Table
 import torch
 from torch import optim
-import wandb
 
 from l2hmc.configs import (
     Steps,
@@ -31,11 +31,29 @@ from l2hmc.configs import (
     LearningRateConfig,
 )
 from l2hmc.dynamics.pytorch.dynamics import Dynamics, random_angle, to_u1
+from l2hmc.learning_rate.pytorch.learning_rate import LearningRateScheduler
 from l2hmc.loss.pytorch.loss import LatticeLoss
 from l2hmc.trackers.pytorch.trackers import update_summaries
 from l2hmc.utils.history import BaseHistory, summarize_dict
+from l2hmc.utils.online import StreamingObservables
+from l2hmc.utils.pytorch.compile import compile_with_fallback
+from l2hmc.utils.pytorch.sharding import (
+    concat_chains,
+    gather_chains,
+    shard_chains,
+)
+from l2hmc.utils.pytorch.stepsize import DualAveraging
+from l2hmc.utils.pytorch.tempering import BetaLadder, ReplicaExchange
+from l2hmc.utils.pytorch.utils import (
+    get_rng_state,
+    list_ckpts,
+    load_ckpt_file,
+    set_rng_state,
+    to_cpu,
+)
 from l2hmc.utils.rich import add_columns, build_layout, console
 from l2hmc.utils.step_timer import StepTimer
+from l2hmc.utils.worker import BackgroundWorker
 # from torchinfo import summary as model_summary
 
 
@@ -52,6 +70,20 @@ def grab(x: Tensor) -> np.ndarray:
     return x.detach().cpu().numpy()
 
 
+def detach_metrics(metrics: dict) -> dict:
+    """Detach all tensors in (a possibly nested) `metrics` dict."""
+    def _detach(val: Any) -> Any:
+        if isinstance(val, Tensor):
+            return val.detach()
+        if isinstance(val, dict):
+            return {k: _detach(v) for k, v in val.items()}
+        if isinstance(val, list):
+            return [_detach(v) for v in val]
+        return val
+
+    return _detach(metrics)
+
+
 class Trainer:
     def __init__(
             self,
@@ -66,6 +98,12 @@ class Trainer:
             keep: Optional[str | list[str]] = None,
             skip: Optional[str | list[str]] = None,
             dynamics_config: Optional[DynamicsConfig] = None,
+            compile: bool = False,
+            async_metrics: bool = False,
+            metrics_queue_size: int = 8,
+            async_ckpt: bool = False,
+            keep_ckpts: Optional[int] = None,
+            micro_batches: int = 1,
     ) -> None:
         self.steps = steps
         self.dynamics = dynamics
@@ -78,6 +116,11 @@ class Trainer:
         self.accelerator = accelerator
         self.rank = self.accelerator.local_process_index
         self.lr_config = lr_config
+        # NOTE: Plateaus are detected from averages over each era, as in the
+        # (once per era) `ReduceLROnPlateau` of the tensorflow trainer
+        self.lr_schedule = LearningRateScheduler(lr_config,
+                                                 optimizer=optimizer,
+                                                 window=steps.nepoch)
         self._dynamics = extract_model_from_parallel(  # type: Module
             self.dynamics
         )
@@ -105,6 +148,35 @@ class Trainer:
             'eval': StepTimer(evals_per_step=self.nlf),
             'hmc': StepTimer(evals_per_step=self.nlf)
         }
+        # NOTE: Streaming estimators (by job_type), see `Trainer.eval`
+        self.observables: dict[str, StreamingObservables] = {}
+        # NOTE: If `async_metrics`, `record_metrics` is run on a background
+        # thread during training, see `Trainer.submit_metrics`
+        self.metrics_worker = (
+            BackgroundWorker(maxsize=metrics_queue_size, name='MetricsWorker')
+            if async_metrics else None
+        )
+        self._pending_metrics = deque()
+        # NOTE: If `async_ckpt`, checkpoints are written (from a cpu snapshot)
+        # on a background thread, keeping only the last `keep_ckpts`
+        self.ckpt_worker = (
+            BackgroundWorker(maxsize=1, name='CheckpointWorker')
+            if async_ckpt else None
+        )
+        self.keep_ckpts = keep_ckpts
+        # NOTE: Chains are split into `micro_batches` chunks in `train_step`,
+        # accumulating gradients before a single optimizer step
+        self.micro_batches = max(1, int(micro_batches))
+        self.compile = compile
+        if self.compile:
+            # NOTE: Compiled lazily (on first call), with eager fallback
+            self._dynamics.forward = compile_with_fallback(  # type: ignore
+                self._dynamics.forward, name='Dynamics.forward'
+            )
+            # NOTE: `beta` enters as a tensor, so annealing doesn't recompile
+            self._train_step = compile_with_fallback(
+                self._train_step, name='Trainer.train_step'
+            )
 
     def draw_x(self) -> Tensor:
         x = random_angle(self.xshape)
@@ -156,12 +228,12 @@ class Trainer:
 
     def hmc_step(
             self,
-            inputs: tuple[Tensor, float],
+            inputs: tuple[Tensor, float | Tensor],
             eps: Tensor,
     ) -> tuple[Tensor, dict]:
         xi, beta = inputs
         xi = to_u1(xi).to(self.accelerator.device)
-        beta = torch.tensor(beta).to(self.accelerator.device)
+        beta = torch.as_tensor(beta).to(self.accelerator.device)
         eps = eps.to(self.accelerator.device)
         # beta = torch.tensor(beta).to(self.accelerator.device)
         xo, metrics = self._dynamics.apply_transition_hmc(  # type: ignore
@@ -170,28 +242,61 @@ class Trainer:
         xo = to_u1(xo)
         xp = to_u1(metrics.pop('mc_states').proposed.x)
         loss = self.loss_fn(x_init=xi, x_prop=xp, acc=metrics['acc'])
-        lmetrics = self.loss_fn.lattice_metrics(xinit=xi, xout=xo)
+        lmetrics = self.loss_fn.lattice_metrics(xinit=xi, xout=xo, beta=beta)
         metrics.update(lmetrics)
         metrics.update({'loss': loss.detach().cpu().numpy()})
 
         return xo.detach(), metrics
 
-    def eval_step(self, inputs: tuple[Tensor, float]) -> tuple[Tensor, dict]:
+    def eval_step(
+            self,
+            inputs: tuple[Tensor, float | Tensor],
+    ) -> tuple[Tensor, dict]:
         xinit, beta = inputs
         xinit = xinit.to(self.accelerator.device)
         xout, metrics = self.dynamics((to_u1(xinit), beta))
         xprop = to_u1(metrics.pop('mc_states').proposed.x)
         loss = self.loss_fn(x_init=xinit, x_prop=xprop, acc=metrics['acc'])
         lmetrics = self.loss_fn.lattice_metrics(xinit=to_u1(xinit),
-                                                xout=to_u1(xout))
+                                                xout=to_u1(xout),
+                                                beta=beta)
         metrics.update(lmetrics)
         metrics.update({'loss': loss.detach().cpu().numpy()})
 
         return to_u1(xout).detach(), metrics
 
+    def adapt_eps(
+            self,
+            x: Tensor,
+            beta: float | Tensor,
+            eps: Tensor,
+            adapter: DualAveraging,
+            nsteps: int,
+    ) -> tuple[Tensor, Tensor]:
+        """Adapt the (generic) HMC step size for `nsteps`, then freeze it.
+
+        The chains keep evolving (and thermalizing) during adaptation, but
+        nothing is recorded. Returns the final `x` and (frozen) `eps`.
+        """
+        t0 = time.perf_counter()
+        for _ in range(nsteps):
+            x, metrics = self.hmc_step((x, beta), eps=eps)
+            eps = adapter.update(metrics['acc'])
+
+        eps = adapter.final
+        summary = adapter.summary()
+        log.info(
+            f'Adapted eps over {nsteps} steps '
+            f'(target acc={summary["target_accept"]:.3g}) in '
+            f'{time.perf_counter() - t0:.3g}s: '
+            + ', '.join([f'{k}={v:.4g}' for k, v in summary.items()
+                         if k.startswith('eps')])
+        )
+        return x, eps
+
     def eval(
             self,
-            beta: Optional[float] = None,
+            beta: Optional[float | Sequence[float] | Tensor] = None,
             x: Optional[Tensor] = None,
             skip: Optional[str | list[str]] = None,
             run: Optional[Any] = None,
@@ -199,7 +304,47 @@ class Trainer:
             job_type: Optional[str] = 'eval',
             nchains: Optional[int] = -1,
             eps: Optional[Tensor] = None,
+            sink: Optional[Any] = None,
+            sink_every: int = 1,
+            observables: Optional[StreamingObservables] = None,
+            tempering: Optional[ReplicaExchange] = None,
+            eps_adapter: Optional[DualAveraging] = None,
+            nadapt: int = 0,
+            shard: bool = False,
     ) -> dict:
+        """Evaluate the model (or generic HMC, if `job_type == 'hmc'`).
+
+        If `sink` (e.g. an `H5Writer`) is provided, the metrics from every
+        `sink_every` steps are appended to it as we go.
+
+        If `observables` is provided, it is updated with the metrics from
+        every step (and included in checkpoints, see `Trainer.save_ckpt`).
+
+        If `beta` is a sequence (or tensor) of `K` betas, the chains are
+        split into `K` groups, one at each beta, so that a single batched
+        run covers the whole scan. In this case, the (per-chain) `beta` is
+        included in the recorded metrics.
+
+        If `tempering` is provided, the chains are split into replicas at
+        each of `tempering.betas` (and `beta` is ignored), with swaps
+        between neighboring replicas attempted every `tempering.swap_every`
+        steps. Only the metrics of the target replica (at the largest beta)
+        are recorded.
+
+        If `job_type == 'hmc'` and `eps_adapter` is provided, the step size
+        is first adapted (starting from `eps`) for `nadapt` steps, see
+        `Trainer.adapt_eps`, and frozen for the remainder of the run.
+
+        The final chain state (and per-chain beta) are returned as `x` (and
+        `beta`), e.g. to warm start later jobs, see `ChainStore`.
+
+        If `shard`, each of the (`accelerator.num_processes`) ranks evaluates
+        its own slice of the chains, with an independent RNG stream. The
+        metrics of every rank are gathered (see `Trainer.gather_chains`) at
+        each step that is recorded (or written to `sink` / `observables`),
+        so that the history on every rank covers all of the chains. Beta
+        scans and replicas (`tempering`) are laid out within each rank.
+        """
         summaries = []
         self.dynamics.eval()
         if isinstance(skip, str):
@@ -238,6 +383,8 @@ class Trainer:
         assert job_type in ['eval', 'hmc']
         timer = self.timers[job_type]
         history = self.histories[job_type]
+        if observables is not None:
+            self.observables[job_type] = observables
 
         log.warning(f'x.shape (original): {x.shape}')
         if nchains is not None:
@@ -245,8 +392,44 @@ class Trainer:
                 x = x[:nchains]
 
         assert isinstance(x, Tensor)
-        assert isinstance(beta, float)
+        size = self.accelerator.num_processes if shard else 1
+        if size > 1:
+            rank = self.accelerator.process_index
+            x = shard_chains(x, rank=rank, size=size)
+            # NOTE: Offset by `rank`, in case every rank was seeded the same
+            seed = int(torch.randint(0, 2 ** 31, ()).item())
+            torch.manual_seed(seed + rank)
+            log.info(f'Rank {rank} / {size} evaluating {x.shape[0]} chains')
+        # NOTE: `beta_` is passed to `eval_fn`, `beta` is recorded
+        beta_ = beta
+        scan = None
+        if tempering is None and not isinstance(beta, (int, float)):
+            scan = BetaLadder(torch.as_tensor(beta).reshape(-1).tolist())
+            x = scan.init(x)
+            beta = scan.beta_target
+            beta_ = scan.beta(device=self.accelerator.device)
+            log.info(
+                f'Beta scan w/ {scan.nchains} chains at each of: '
+                f'{[round(b, 4) for b in scan.betas.tolist()]}'
+            )
+        if tempering is not None:
+            x = tempering.init(x)
+            beta = tempering.beta_target
+            beta_ = tempering.beta(device=self.accelerator.device)
+            log.info(
+                f'Parallel tempering w/ {tempering.nreplicas} replicas '
+                f'x {tempering.nchains} chains at betas: '
+                f'{[round(b, 4) for b in tempering.betas.tolist()]}'
+            )
         log.warning(f'x[:nchains].shape: {x.shape}')
+        if job_type == 'hmc' and eps_adapter is not None and nadapt > 0:
+            assert eps is not None
+            x, eps = self.adapt_eps(x,
+                                    beta=beta_,
+                                    eps=eps,
+                                    adapter=eps_adapter,
+                                    nsteps=nadapt)
+
         display = build_layout(job_type=job_type, steps=self.steps)
         step_task = display['tasks']['step']
         job_progress = display['job_progress']
@@ -267,9 +450,32 @@ class Trainer:
 
             for step in range(self.steps.test):
                 timer.start()
-                x, metrics = eval_fn((x, beta))
+                x, metrics = eval_fn((x, beta_))
+                if scan is not None:
+                    metrics['beta'] = beta_
+                if tempering is not None:
+                    metrics = tempering.select(metrics)
+                    if tempering.should_swap(step):
+                        x = tempering.swap(
+                            x, self._dynamics.potential_energy  # type:ignore
+                        )
+                if size > 1 and (
+                        step % nlog == 0 or step % nprint == 0
+                        or observables is not None
+                        or (sink_every > 0 and step % sink_every == 0)
+                ):
+                    nchains_ = (
+                        x.shape[0] if tempering is None else tempering.nchains
+                    )
+                    metrics = self.gather_chains(metrics, nchains=nchains_)
                 dt = timer.stop()
                 job_progress.advance(step_task)
+                if observables is not None:
+                    self.update_observables(observables, metrics)
+                if sink is not None and step % sink_every == 0:
+                    self.write_metrics(sink, metrics=metrics, record={
+                        'step': step, 'beta': beta, 'dt': dt,
+                    })
                 if step % nlog == 0 or step % nprint == 0:
                     record = {
                         'step': step, 'beta': beta, 'dt': dt,
@@ -291,18 +497,42 @@ class Trainer:
 
                     if avgs.get('acc', 1.0) < 1e-5:
                         log.warning('Chains are stuck! Re-drawing x !')
+                        nchains_ = x.shape[0]
                         x = random_angle(self.xshape)
-                        x = x.reshape(x.shape[0], -1)
+                        x = x.reshape(x.shape[0], -1)[:nchains_]
 
             tables[str(0)] = table
 
+        if self.metrics_worker is not None:
+            self.metrics_worker.flush()
+        if sink is not None:
+            sink.flush()
+        if size > 1:
+            state = self.gather_chains({'x': x, 'beta': beta_},
+                                       nchains=x.shape[0],
+                                       dim=0)
+            x, beta_ = state['x'], state['beta']
+
         return {
             'timer': timer,
             'history': history,
             'summaries': summaries,
             'tables': tables,
+            'observables': observables,
+            'tempering': tempering,
+            'eps': eps,
+            'x': x,
+            'beta': beta_,
         }
 
+    def gather_chains(self, metrics: dict, nchains: int, dim: int = -1):
+        """Concatenate per-chain `metrics` (along `dim`) across all ranks."""
+        return gather_chains(metrics,
+                             nchains=nchains,
+                             gather_fn=self.accelerator.gather,
+                             dim=dim,
+                             device=self.accelerator.device)
+
     def should_log(self, epoch):
         return (
             epoch % self.steps.log == 0
@@ -315,6 +545,80 @@ class Trainer:
             and self.accelerator.is_local_main_process
         )
 
+    def submit_metrics(self, gstep: int, epoch: int, **kwargs) -> None:
+        """Record metrics from training step `gstep`.
+
+        If `self.metrics_worker` exists, the (detached) metrics are queued
+        and `record_metrics` runs in the background, otherwise it is run
+        immediately. Results are collected with `Trainer.get_metrics`.
+        """
+        kwargs['metrics'] = detach_metrics(kwargs['metrics'])
+        if self.metrics_worker is None:
+            result = self.record_metrics(**kwargs)
+        else:
+            result = self.metrics_worker.submit(self.record_metrics, **kwargs)
+
+        self._pending_metrics.append((gstep, epoch, result))
+
+    def get_metrics(self, block: bool = False) -> list[tuple]:
+        """Returns `(gstep, epoch, avgs, summary)` for all finished records.
+
+        Results are returned in the order they were submitted. If `block`,
+        wait for all pending records to finish (e.g. at the end of an era).
+        """
+        if block and self.metrics_worker is not None:
+            self.metrics_worker.flush()
+
+        finished = []
+        while len(self._pending_metrics) > 0:
+            gstep, epoch, result = self._pending_metrics[0]
+            if not isinstance(result, tuple):
+                if not result.done():
+                    break
+                result = result.result()
+
+            self._pending_metrics.popleft()
+            finished.append((gstep, epoch, *result))
+
+        return finished
+
+    def write_metrics(
+            self,
+            sink: Any,
+            metrics: dict,
+            record: Optional[dict] = None,
+    ) -> None:
+        """Append `record` and (numpy) `metrics` to `sink`, e.g. `H5Writer`.
+
+        Runs on `self.metrics_worker` (in order with `record_metrics`),
+        if it exists.
+        """
+        record = {} if record is None else record
+
+        def _write(metrics: dict) -> None:
+            sink.append({**record, **self.metrics_to_numpy(metrics)})
+
+        if self.metrics_worker is None:
+            _write(metrics)
+        else:
+            self.metrics_worker.submit(_write, detach_metrics(metrics))
+
+    def update_observables(
+            self,
+            observables: StreamingObservables,
+            metrics: dict,
+    ) -> None:
+        """Update `observables` with `metrics` from a single step.
+
+        Runs on `self.metrics_worker` (in order with `record_metrics`),
+        if it exists.
+        """
+        if self.metrics_worker is None:
+            observables.update(metrics)
+        else:
+            self.metrics_worker.submit(observables.update,
+                                       detach_metrics(metrics))
+
     def record_metrics(
             self,
             metrics: dict,
@@ -394,15 +698,73 @@ class Trainer:
 
     def train_step(self, inputs: tuple[Tensor, Tensor]) -> tuple[Tensor, dict]:
         xinit, beta = inputs
-        xinit = to_u1(xinit).to(self.accelerator.device)
-        beta = torch.tensor(beta).to(self.accelerator.device)
+        # NOTE: Detached so that (compiled) steps see consistent inputs,
+        # and we don't backprop into the initial `x` (which we never use)
+        xinit = to_u1(xinit).detach().to(self.accelerator.device)
+        beta = torch.as_tensor(beta).to(self.accelerator.device)
+        return self._train_step(xinit, beta)
+
+    def _train_step(self, xinit: Tensor, beta: Tensor) -> tuple[Tensor, dict]:
+        self.optimizer.zero_grad()
+        nchains = xinit.shape[0]
+        xchunks = xinit.split(-(-nchains // max(1, self.micro_batches)))
+        if len(xchunks) == 1:
+            xout, metrics = self._forward_backward(xinit, beta)
+        else:
+            xouts, chunks = [], []
+            per_chain = beta.ndim > 0 and beta.shape[0] == nchains
+            start = 0
+            for idx, xchunk in enumerate(xchunks):
+                n = xchunk.shape[0]
+                beta_ = beta[start:start + n] if per_chain else beta
+                start += n
+                # NOTE: Only sync gradients (across ranks) on the last chunk
+                ctx = (
+                    self.accelerator.no_sync(self.dynamics)  # type:ignore
+                    if idx < len(xchunks) - 1 else nullcontext()
+                )
+                with ctx:
+                    xout_, metrics_ = self._forward_backward(
+                        xchunk, beta_, weight=n / nchains
+                    )
+                xouts.append(xout_)
+                chunks.append(metrics_)
+            xout = torch.cat(xouts, dim=0)
+            metrics = concat_chains(chunks,
+                                    sizes=[x.shape[0] for x in xchunks])
+
+        # extract_model_from_parallel(self.dynamics).parameters(),
+        self.accelerator.clip_grad_norm_(
+            self.dynamics.parameters(),
+            max_norm=self.clip_norm,
+        )
+        self.optimizer.step()
+
+        lmetrics = self.loss_fn.lattice_metrics(xinit=xinit, xout=xout)
+        metrics.update(lmetrics)
+
+        return xout, metrics
+
+    def _forward_backward(
+            self,
+            xinit: Tensor,
+            beta: Tensor,
+            weight: float = 1.0,
+    ) -> tuple[Tensor, dict]:
+        """Forward (and backward) pass over (a micro-batch of) chains.
+
+        Gradients of `weight * loss` are accumulated into `.grad`, where
+        `weight` is the fraction of the chains in this micro-batch, so that
+        accumulating over every micro-batch gives the gradient of the loss
+        (mean) over the full batch. Returns the (detached) output `x`.
+        """
         xout, metrics = self.dynamics((xinit, beta))
         xprop = to_u1(metrics.pop('mc_states').proposed.x)
         loss = self.loss_fn(x_init=xinit, x_prop=xprop, acc=metrics['acc'])
         xout = to_u1(xout)
 
         if self.aux_weight > 0:
-            yinit = to_u1(self.draw_x()).to(self.accelerator.device)
+            yinit = to_u1(self.draw_x()[:xinit.shape[0]]).to(xinit.device)
             _, metrics_ = self.dynamics((yinit, beta))
             yprop = to_u1(metrics_.pop('mc_states').proposed.x)
             aux_loss = self.aux_weight * self.loss_fn(x_init=yinit,
@@ -410,18 +772,8 @@ class Trainer:
                                                       acc=metrics_['acc'])
             loss = (loss + aux_loss) / (1. + self.aux_weight)
 
-        self.optimizer.zero_grad()
-        self.accelerator.backward(loss)
-        # extract_model_from_parallel(self.dynamics).parameters(),
-        self.accelerator.clip_grad_norm_(
-            self.dynamics.parameters(),
-            max_norm=self.clip_norm,
-        )
-        self.optimizer.step()
-
-        metrics['loss'] = loss
-        lmetrics = self.loss_fn.lattice_metrics(xinit=xinit, xout=xout)
-        metrics.update(lmetrics)
+        self.accelerator.backward(weight * loss)
+        metrics['loss'] = loss.detach()
 
         return xout.detach(), metrics
 
@@ -432,13 +784,33 @@ class Trainer:
             train_dir: os.PathLike,
             metrics: Optional[dict] = None,
             run: Optional[Any] = None,
+            x: Optional[Tensor] = None,
+            gstep: Optional[int] = None,
+            rng_states: Optional[list[dict]] = None,
     ) -> None:
+        """Save checkpoint to `train_dir/checkpoints/ckpt-{era}-{epoch}.tar`.
+
+        The checkpoint holds everything needed to resume training (see
+        `Trainer.load_ckpt`): the model, optimizer (and learning rate
+        schedule), step sizes, counters, RNG states and (if provided) the
+        chain state `x`.
+
+        On multiple ranks, `x` and `rng_states` should hold the chains and
+        RNG states of every rank, see `Trainer.gather_ckpt_state`, so that
+        each rank can restore its own on resume.
+
+        A cpu snapshot of the state is taken here, and written on
+        `self.ckpt_worker` if it exists, so that we only block for the
+        (device -> host) copy.
+        """
+        if self.metrics_worker is not None:
+            self.metrics_worker.flush()
+
         dynamics = extract_model_from_parallel(self.dynamics)
         ckpt_dir = Path(train_dir).joinpath('checkpoints')
         ckpt_dir.mkdir(exist_ok=True, parents=True)
         ckpt_file = ckpt_dir.joinpath(f'ckpt-{era}-{epoch}.tar')
         log.info(f'Saving checkpoint to: {ckpt_file.as_posix()}')
-        # self.dynamics.save(train_dir)  # type: ignore
         xeps = {
             k: grab(v) for k, v in dynamics.xeps.items()  # type:ignore
         }
@@ -448,25 +820,137 @@ class Trainer:
         ckpt = {
             'era': era,
             'epoch': epoch,
+            'gstep': gstep,
             'xeps': xeps,
             'veps': veps,
-            'model_state_dict': dynamics.state_dict(),  # type: ignore
-            'optimizer_state_dict': self.optimizer.state_dict(),
+            'model_state_dict': to_cpu(dynamics.state_dict()),  # type:ignore
+            'optimizer_state_dict': to_cpu(self.optimizer.state_dict()),
+            'scheduler_state_dict': self.lr_schedule.state_dict(),
+            'rng_state': get_rng_state(),
         }
+        if rng_states is not None:
+            ckpt['rng_states'] = rng_states
+        if x is not None:
+            ckpt['x'] = to_cpu(x)
+        if len(self.observables) > 0:
+            ckpt['observables'] = {
+                k: v.state_dict() for k, v in self.observables.items()
+            }
         if metrics is not None:
-            ckpt.update(metrics)
+            ckpt.update(to_cpu(metrics))
+
+        if self.ckpt_worker is None:
+            self._write_ckpt(ckpt, ckpt_file, run=run)
+        else:
+            self.ckpt_worker.submit(self._write_ckpt, ckpt, ckpt_file, run)
 
-        # torch.save(ckpt, ckpt_file)
-        self.accelerator.save(ckpt, ckpt_file)
+    def _write_ckpt(
+            self,
+            ckpt: dict,
+            ckpt_file: Path,
+            run: Optional[Any] = None,
+    ) -> None:
+        # NOTE: Written to a temporary file first, so that a job killed
+        # mid-write never leaves behind a truncated checkpoint
+        tmpfile = ckpt_file.with_name(f'{ckpt_file.name}.tmp')
+        self.accelerator.save(ckpt, tmpfile)
+        if tmpfile.is_file():
+            os.replace(tmpfile, ckpt_file)
+        if self.keep_ckpts is not None and self.keep_ckpts > 0:
+            for old in list_ckpts(ckpt_file.parent)[:-self.keep_ckpts]:
+                log.info(f'Removing old checkpoint: {old.as_posix()}')
+                old.unlink(missing_ok=True)
         if run is not None:
+            import wandb
             assert run is wandb.run
-            outfile = Path(train_dir).joinpath('model.pth').as_posix()
-            # torch.save(self.dynamics.state_dict(), outfile.as_posix())
-            self.accelerator.save(self.dynamics.state_dict(), outfile)
+            train_dir = ckpt_file.parent.parent
+            outfile = train_dir.joinpath('model.pth').as_posix()
+            self.accelerator.save(ckpt['model_state_dict'], outfile)
             artifact = wandb.Artifact('model', type='model')
             artifact.add_file(outfile)
             run.log_artifact(artifact)
 
+    def load_ckpt(
+            self,
+            ckpt_file: os.PathLike,
+            restore_rng: bool = True,
+    ) -> dict:
+        """Restore model, optimizer, lr schedule (and RNG) from `ckpt_file`.
+
+        Returns the checkpoint, e.g. for its `era` / `gstep` and `x`.
+        """
+        log.info(f'Loading checkpoint from: {Path(ckpt_file).as_posix()}')
+        ckpt = load_ckpt_file(ckpt_file)
+        dynamics = extract_model_from_parallel(self.dynamics)
+        # NOTE: `xeps` / `veps` are parameters, restored with the model
+        dynamics.load_state_dict(ckpt['model_state_dict'])  # type:ignore
+        self.optimizer.load_state_dict(ckpt['optimizer_state_dict'])
+        if 'scheduler_state_dict' in ckpt:
+            self.lr_schedule.load_state_dict(ckpt['scheduler_state_dict'])
+        if restore_rng:
+            self.restore_rng_state(ckpt)
+
+        return ckpt
+
+    def gather_ckpt_state(self, x: Tensor) -> tuple[Tensor, list[dict]]:
+        """Returns the chains `x` and RNG states of every rank.
+
+        The chains are concatenated (in rank order) along their first
+        dimension, and there is one RNG state per rank. This is a collective,
+        so must be called on every rank.
+        """
+        if self.accelerator.num_processes == 1:
+            return x.detach(), [get_rng_state()]
+        xall = self.accelerator.gather(x.detach().contiguous())
+        assert isinstance(xall, Tensor)
+        return xall, gather_object([get_rng_state()])
+
+    def restore_rng_state(self, ckpt: dict) -> None:
+        """Restore the RNG state of this rank from `ckpt`.
+
+        If `ckpt` wasn't saved by the same number of ranks, every rank would
+        restore the same state (and so draw identical random numbers), so we
+        offset the seed of each by its `rank` instead.
+        """
+        rank = self.accelerator.process_index
+        size = self.accelerator.num_processes
+        states = ckpt.get('rng_states', None)
+        if states is not None and len(states) == size:
+            set_rng_state(states[rank])
+            return
+        if 'rng_state' in ckpt:
+            set_rng_state(ckpt['rng_state'])
+        if size > 1:
+            log.warning(
+                f'Checkpoint has no RNG states for {size} ranks, '
+                'offsetting the seed of each by its rank'
+            )
+            seed = int(torch.randint(0, 2 ** 31, ()).item()) + rank
+            torch.manual_seed(seed)
+            np.random.seed(seed % 2 ** 32)
+            random.seed(seed)
+
+    def restore_chains(self, xall: Tensor) -> Tensor:
+        """Returns the chains of this rank, from the chains `xall` of all.
+
+        If `xall` doesn't hold `nchains` chains for each rank (e.g. it was
+        saved by a different number of ranks), fresh chains are drawn, so
+        that no two ranks start from the same chains.
+        """
+        rank = self.accelerator.process_index
+        size = self.accelerator.num_processes
+        nchains = self.xshape[0]
+        if xall.shape[0] == size * nchains:
+            x = shard_chains(xall, rank=rank, size=size)
+        else:
+            log.warning(
+                f'Checkpoint holds {xall.shape[0]} chains, expected '
+                f'{size} ranks x {nchains}, drawing new chains'
+            )
+            x = random_angle(self.xshape)
+            x = x.reshape(x.shape[0], -1)
+        return x.to(self.accelerator.device)
+
     def profile(self, nsteps: int = 5) -> dict:
         self.dynamics.train()
         x = self.draw_x()
@@ -484,8 +968,20 @@ class Trainer:
             train_dir: Optional[os.PathLike] = None,
             run: Optional[Any] = None,
             writer: Optional[Any] = None,
+            sink: Optional[Any] = None,
+            sink_every: int = 1,
+            resume_from: Optional[os.PathLike] = None,
             # keep: str | list[str] = None,
     ) -> dict:
+        """Train the sampler, over `steps.nera` eras of `steps.nepoch`.
+
+        A checkpoint is saved at the end of each era. If `resume_from` (a
+        checkpoint file) is provided, training continues from the era after
+        the one it was saved at, with the model, optimizer, RNG and (unless
+        `x` is given) chain states restored from it. On multiple ranks, each
+        restores its own RNG state and chains, see `restore_rng_state` and
+        `restore_chains`.
+        """
         skip = [skip] if isinstance(skip, str) else skip
 
         if train_dir is None:
@@ -498,13 +994,22 @@ class Trainer:
         if isinstance(skip, str):
             skip = [skip]
 
+        era = 0
+        gstep = 0
+        epoch = 0
+        start = 0
+        if resume_from is not None:
+            ckpt = self.load_ckpt(resume_from)
+            start = ckpt['era'] + 1
+            gstep = ckpt.get('gstep', None) or start * self.steps.nepoch
+            if x is None and ckpt.get('x', None) is not None:
+                x = self.restore_chains(ckpt['x'])
+            log.info(f'Resuming training from era {start} (step {gstep})')
+
         if x is None:
             x = random_angle(self.xshape, requires_grad=True)
             x = x.reshape(x.shape[0], -1)
 
-        era = 0
-        gstep = 0
-        epoch = 0
         tables = {}
         metrics = {}
         rows = {}
@@ -533,7 +1038,7 @@ class Trainer:
         estart = time.time()
         with ctxmgr:
             # console = getattr(live, 'console', None)
-            for era in range(self.steps.nera):
+            for era in range(start, self.steps.nera):
                 estart = time.time()
                 table = Table(**tkwargs)
                 beta = self.schedule.betas[str(era)]
@@ -553,9 +1058,16 @@ class Trainer:
 
                 for epoch in range(self.steps.nepoch):
                     timer.start()
+                    lr = self.lr_schedule.lr
                     x, metrics = self.train_step((x, beta))
                     dt = timer.stop()
                     gstep += 1
+                    _ = self.lr_schedule.step(metrics)
+                    metrics['lr'] = torch.tensor(lr)
+                    if sink is not None and gstep % sink_every == 0:
+                        self.write_metrics(sink, metrics=metrics, record={
+                            'era': era, 'epoch': epoch, 'beta': beta, 'dt': dt,
+                        })
                     display['job_progress'].advance(display['tasks']['step'])
                     display['job_progress'].advance(display['tasks']['epoch'])
                     # if console is not None and isinstance(live, LiveRender):
@@ -564,14 +1076,22 @@ class Trainer:
                         record = {
                             'era': era, 'epoch': epoch, 'beta': beta, 'dt': dt,
                         }
-                        avgs, summary = self.record_metrics(run=run,
-                                                            step=gstep,
-                                                            writer=writer,
-                                                            record=record,
-                                                            metrics=metrics,
-                                                            job_type='train',
-                                                            history=history)
-                        rows[gstep] = avgs
+                        self.submit_metrics(gstep=gstep,
+                                            epoch=epoch,
+                                            run=run,
+                                            step=gstep,
+                                            writer=writer,
+                                            record=record,
+                                            metrics=metrics,
+                                            job_type='train',
+                                            history=history)
+
+                    # NOTE: With `async_metrics`, these lag behind `gstep`
+                    last = (epoch == self.steps.nepoch - 1)
+                    for gstep_, epoch_, avgs, summary in self.get_metrics(
+                            block=last
+                    ):
+                        rows[gstep_] = avgs
                         summaries.append(summary)
 
                         if avgs.get('acc', 1.0) < 1e-5:
@@ -580,58 +1100,72 @@ class Trainer:
                             x = random_angle(self.xshape)
                             x = x.reshape(x.shape[0], -1)
 
-                        if epoch == 0:
+                        if epoch_ == 0:
                             table = add_columns(avgs, table)
 
-                        if self.should_print(epoch):
+                        if self.should_print(epoch_):
                             table.add_row(*[f'{v}' for _, v in avgs.items()])
 
-            # self.reset_optimizer()
-            tables[str(era)] = table
-            # if self.accelerator.is_local_main_process:
-            if self.accelerator.is_local_main_process:
-                # if writer is not None:
-                #     model = extract_model_from_parallel(self.dynamics)
-                #     model = model if isinstance(model, Module) else None
-                #     update_summaries(step=gstep,
-                #                      writer=writer,
-                #                      model=self.dynamics,
-                #                      optimizer=self.optimizer)
-
-                console.print(f'Era {era} took: {time.time() - estart:<5g}s')
-                emetrics = self.history.era_metrics[str(era)]
-                # era_summary = self.history.era_summary(era)
-                era_strs = [
-                    f'{k} = {np.mean(v):<.4g}' for k, v in emetrics.items()
-                    if k not in ['era', 'epoch']
-                ]
-                console.print('\n'.join([
-                    'Avgs over last era:', f'{", ".join(era_strs)}'
-                ]))
-                # if layout is not None:
-                #     layout['root']['footer']['bottom'].update(
-                #         Panel.fit(
-                #             '\n'.join([f'* {s}' for s in era_strs]),
-                #             title='Avgs over last era:',
-                #             border_style='white'
-                #         )
-                #     )
-                #     # live.console.print(Panel.fit(
-                #     # title='[b]Avgs over last era:',
-                #     # border_style='white',
-                console.log(f'Saving checkpoint to: {train_dir}')
-                ckpt_metrics = {'loss': metrics['loss']}
-                st0 = time.time()
-                self.save_ckpt(era, epoch, train_dir,
-                               metrics=ckpt_metrics, run=run)
-                console.log(f'Saving took: {time.time() - st0:<5g}s')
-
-                console.log(
-                    f'Era {era} took: {time.time() - estart:<5g}s',
-                )
-                console.log(
-                    f'Avgs over last era:\n {self.history.era_summary(era)}',
-                )
+                # self.reset_optimizer()
+                tables[str(era)] = table
+                if sink is not None:
+                    sink.flush()
+                # NOTE: Collective, so must run on every rank
+                xall, rng_states = self.gather_ckpt_state(x)
+                # if self.accelerator.is_local_main_process:
+                if self.accelerator.is_local_main_process:
+                    # if writer is not None:
+                    #     model = extract_model_from_parallel(self.dynamics)
+                    #     model = model if isinstance(model, Module) else None
+                    #     update_summaries(step=gstep,
+                    #                      writer=writer,
+                    #                      model=self.dynamics,
+                    #                      optimizer=self.optimizer)
+
+                    console.print(
+                        f'Era {era} took: {time.time() - estart:<5g}s'
+                    )
+                    emetrics = self.history.era_metrics[str(era)]
+                    # era_summary = self.history.era_summary(era)
+                    era_strs = [
+                        f'{k} = {np.mean(v):<.4g}' for k, v in emetrics.items()
+                        if k not in ['era', 'epoch']
+                    ]
+                    console.print('\n'.join([
+                        'Avgs over last era:', f'{", ".join(era_strs)}'
+                    ]))
+                    # if layout is not None:
+                    #     layout['root']['footer']['bottom'].update(
+                    #         Panel.fit(
+                    #             '\n'.join([f'* {s}' for s in era_strs]),
+                    #             title='Avgs over last era:',
+                    #             border_style='white'
+                    #         )
+                    #     )
+                    #     # live.console.print(Panel.fit(
+                    #     # title='[b]Avgs over last era:',
+                    #     # border_style='white',
+                    console.log(f'Saving checkpoint to: {train_dir}')
+                    ckpt_metrics = {'loss': metrics['loss']}
+                    st0 = time.time()
+                    self.save_ckpt(era, epoch, train_dir,
+                                   x=xall,
+                                   run=run,
+                                   gstep=gstep,
+                                   metrics=ckpt_metrics,
+                                   rng_states=rng_states)
+                    console.log(f'Saving took: {time.time() - st0:<5g}s')
+
+                    console.log(
+                        f'Era {era} took: {time.time() - estart:<5g}s',
+                    )
+                    console.log(
+                        'Avgs over last era:\n '
+                        f'{self.history.era_summary(era)}',
+                    )
+
+        if self.ckpt_worker is not None:
+            self.ckpt_worker.flush()
 
         return {
             'timer': timer,
@@ -639,4 +1173,6 @@ class Trainer:
             'summaries': summaries,
             'history': history,
             'tables': tables,
+            'x': x,
+            'beta': self.schedule.betas[str(self.steps.nera - 1)],
         }
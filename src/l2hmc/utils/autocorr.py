@@ -0,0 +1,206 @@
+"""
+autocorr.py
+
+Contains methods for computing (FFT-based) autocorrelation functions,
+integrated autocorrelation times and effective sample sizes (ESS).
+
+We use the conventions of Madras & Sokal (1988), i.e.
+
+    tau_int(M) = 1/2 + sum_{t=1}^{M} rho(t),
+
+with the window `M` chosen automatically as the smallest `M` for which
+`M >= c * tau_int(M)`, so that `ESS = N / (2 * tau_int)` for a single chain
+of `N` draws.
+"""
+from __future__ import absolute_import, annotations, division, print_function
+import logging
+from typing import Optional, Sequence
+
+import numpy as np
+import xarray as xr
+
+try:
+    import scipy.fft as fft
+    from scipy.fft import next_fast_len
+except ImportError:
+    import numpy.fft as fft
+
+    def next_fast_len(target: int, real: bool = True) -> int:
+        return 1 << int(np.ceil(np.log2(max(1, target))))
+
+
+log = logging.getLogger(__name__)
+
+# NOTE: Upper bound on the size of a single batch of FFTs, in bytes
+MAX_BATCH_BYTES = 2 ** 26
+# NOTE: Quantities related to the topological charge, from `lattice_metrics`
+CHARGES = ('intQ', 'sinQ', 'dQint', 'dQsin')
+
+
+def _as_chains(x: np.ndarray, axis: int = 0) -> np.ndarray:
+    """Returns `x` as `[draw, chain]`, with all other axes as chains."""
+    x = np.moveaxis(np.asarray(x), axis, 0)
+    if not np.issubdtype(x.dtype, np.floating):
+        x = x.astype(np.float64)
+    return x.reshape(x.shape[0], -1)
+
+
+def _batches(x: np.ndarray, max_lag: int):
+    """Yields `(chains, rho)`, with `rho[chain, lag]` for batches of chains.
+
+    Each batch is computed with a single (vectorized) real FFT, where the
+    number of chains per batch is chosen to keep memory use bounded.
+    """
+    ndraws, nchains = x.shape
+    nfft = next_fast_len(2 * ndraws, real=True)
+    itemsize = 2 * np.dtype(x.dtype).itemsize
+    bsize = max(1, MAX_BATCH_BYTES // (itemsize * nfft))
+    for start in range(0, nchains, bsize):
+        chains = slice(start, min(start + bsize, nchains))
+        xb = np.ascontiguousarray(x[:, chains].T)
+        xb = xb - xb.mean(axis=-1, keepdims=True)
+        f = fft.rfft(xb, n=nfft, axis=-1)
+        acov = fft.irfft((f * f.conj()).real, n=nfft, axis=-1)[:, :max_lag]
+        var = acov[:, :1]
+        frozen = (var <= 0.)
+        rho = acov / np.where(frozen, 1., var)
+        # NOTE: Chains that never move are (perfectly) correlated at all lags
+        rho = np.where(frozen, 1., rho)
+        yield chains, rho
+
+
+def autocorr(
+        x: np.ndarray,
+        axis: int = 0,
+        max_lag: Optional[int] = None,
+) -> np.ndarray:
+    """Returns the normalized autocorrelation function of `x` along `axis`.
+
+    The result has the same shape as `x`, with `axis` (of length `max_lag`)
+    indexing the lag, and is computed for each chain (all other axes)
+    independently.
+    """
+    x = np.asarray(x)
+    shape = np.moveaxis(x, axis, 0).shape
+    chains = _as_chains(x, axis)
+    max_lag = shape[0] if max_lag is None else min(max_lag, shape[0])
+    rho = np.empty((max_lag, chains.shape[1]), dtype=chains.dtype)
+    for idxs, rb in _batches(chains, max_lag=max_lag):
+        rho[:, idxs] = rb.T
+
+    return np.moveaxis(rho.reshape(max_lag, *shape[1:]), 0, axis)
+
+
+def auto_window(taus: np.ndarray, c: float = 6.0) -> np.ndarray:
+    """Returns the (Sokal) window for `taus[..., M] = tau_int(M)`.
+
+    This is the smallest `M` such that `M >= c * tau_int(M)`, or the largest
+    available lag if there is no such `M`.
+    """
+    m = np.arange(taus.shape[-1]) >= c * taus
+    return np.where(m.any(axis=-1), m.argmax(axis=-1), taus.shape[-1] - 1)
+
+
+def _tau_int(rho: np.ndarray, c: float = 6.0) -> tuple[np.ndarray, ...]:
+    """Returns `(tau_int, window)` from `rho[..., lag]`."""
+    taus = np.cumsum(rho, axis=-1) - 0.5
+    window = auto_window(taus, c=c)
+    tau = np.take_along_axis(taus, window[..., None], axis=-1)[..., 0]
+    return tau, window
+
+
+def integrated_autocorr(
+        x: np.ndarray,
+        axis: int = 0,
+        c: float = 6.0,
+        max_lag: Optional[int] = None,
+) -> dict:
+    """Returns the integrated autocorrelation time of `x` along `axis`.
+
+    `x` is interpreted as `[draw, chain, ...]` (for `axis=0`), with all axes
+    other than `axis` treated as independent chains. Returns a dict with:
+
+      - `tau_int`: Estimated from the chain-averaged autocorrelation function
+      - `tau_err`: Statistical error on `tau_int` (Madras & Sokal)
+      - `window`: Window used to truncate the sum over lags
+      - `ess`: Effective sample size, summed over all chains
+      - `tau_chains`, `ess_chains`: Per-chain estimates, shape `[nchains]`
+    """
+    chains = _as_chains(x, axis)
+    ndraws, nchains = chains.shape
+    max_lag = ndraws if max_lag is None else min(max_lag, ndraws)
+    rho_sum = np.zeros(max_lag, dtype=np.float64)
+    tau_chains = np.empty(nchains, dtype=np.float64)
+    for idxs, rho in _batches(chains, max_lag=max_lag):
+        rho_sum += rho.sum(axis=0)
+        tau_chains[idxs], _ = _tau_int(rho, c=c)
+
+    tau, window = _tau_int(rho_sum / nchains, c=c)
+    tau_err = tau * np.sqrt(2. * (2. * window + 1) / ndraws)
+    return {
+        'tau_int': float(tau),
+        'tau_err': float(tau_err),
+        'window': int(window),
+        'ess': float(nchains * ndraws / (2. * tau)),
+        'ndraws': ndraws,
+        'nchains': nchains,
+        'tau_chains': tau_chains,
+        'ess_chains': ndraws / (2. * tau_chains),
+    }
+
+
+def ess_rates(
+        result: dict,
+        rate: dict,
+        nsteps: Optional[float] = None,
+) -> dict:
+    """Returns the ESS (from `integrated_autocorr`) per unit of cost.
+
+    `rate` is the output of `StepTimer.get_eval_rate`, and `nsteps` the
+    number of (timed) steps spanned by the draws used to compute `result`
+    (by default, all of them). Returns the ESS per second (of wall time),
+    per trajectory (of a single chain) and per (leapfrog) evaluation.
+    """
+    nsteps = rate['num_steps'] if nsteps is None else nsteps
+    seconds = nsteps * rate['elapsed'] / rate['num_steps']
+    trajectories = nsteps * result['nchains']
+    evals = trajectories * rate['evals_per_step']
+    return {
+        'ess_per_sec': result['ess'] / seconds,
+        'ess_per_traj': result['ess'] / trajectories,
+        'ess_per_eval': result['ess'] / evals,
+    }
+
+
+def summarize(
+        dataset: xr.Dataset,
+        keys: Optional[Sequence[str]] = None,
+        rate: Optional[dict] = None,
+        nsteps: Optional[float] = None,
+        c: float = 6.0,
+) -> dict[str, dict[str, float]]:
+    """Returns `{key: {tau_int, tau_err, ess, ...}}` for `keys` in `dataset`.
+
+    By default, `keys` are the topological charge metrics (`CHARGES`). If
+    `rate` (from `StepTimer.get_eval_rate`) is provided, includes the ESS per
+    second / trajectory / evaluation, see `ess_rates`.
+    """
+    keys = CHARGES if keys is None else keys
+    summary = {}
+    for key in keys:
+        if key not in dataset.data_vars:
+            continue
+        val = dataset[key]
+        if val.sizes.get('draw', 0) < 2:
+            continue
+        arr = val.transpose('draw', ...).values
+        result = integrated_autocorr(arr, axis=0, c=c)
+        out = {
+            k: v for k, v in result.items()
+            if k not in ['tau_chains', 'ess_chains']
+        }
+        if rate is not None and rate.get('num_steps', 0) > 0:
+            out.update(ess_rates(result, rate=rate, nsteps=nsteps))
+        summary[key] = out
+
+    return summary
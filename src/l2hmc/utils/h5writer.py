@@ -0,0 +1,220 @@
+"""
+h5writer.py
+
+Contains implementation of `H5Writer`, for streaming records (e.g. metrics
+from each step of `Trainer.eval`) to chunked, extendable HDF5 datasets.
+"""
+from __future__ import absolute_import, annotations, division, print_function
+import logging
+import os
+from pathlib import Path
+from typing import Any, Optional
+
+import h5py
+import numpy as np
+
+
+log = logging.getLogger(__name__)
+
+# NOTE: Upper bound on the size of a single (HDF5) chunk, in bytes
+MAX_CHUNK_BYTES = 2 ** 20
+
+
+def compression_kwargs(
+        compression: Optional[str] = 'lzf',
+        level: Optional[int] = None,
+) -> dict:
+    """Returns `h5py.create_dataset` kwargs for the specified `compression`.
+
+    `gzip` and `lzf` are built in to h5py, `lz4`, `blosc` and `zstd` require
+    the (optional) `hdf5plugin` package and fall back to `gzip` without it.
+    """
+    if compression is None or str(compression).lower() == 'none':
+        return {}
+    compression = str(compression).lower()
+    if compression in ['gzip', 'lzf']:
+        kwargs: dict[str, Any] = {'compression': compression}
+        if compression == 'gzip' and level is not None:
+            kwargs['compression_opts'] = level
+        return kwargs
+    if compression not in ['lz4', 'blosc', 'zstd']:
+        raise ValueError(f'Unexpected value for `compression`: {compression}')
+    try:
+        import hdf5plugin
+    except ImportError:
+        log.warning(f'`hdf5plugin` is required for {compression}, using gzip')
+        return compression_kwargs('gzip', level)
+    if compression == 'lz4':
+        return dict(hdf5plugin.LZ4())
+    if compression == 'zstd':
+        return dict(hdf5plugin.Zstd(clevel=(3 if level is None else level)))
+    return dict(hdf5plugin.Blosc(
+        cname='lz4',
+        clevel=(5 if level is None else level),
+        shuffle=hdf5plugin.Blosc.SHUFFLE,
+    ))
+
+
+def record_dims(shape: tuple) -> list[str]:
+    """Returns dimension names for a dataset of records with `shape`.
+
+    Follows the conventions of `BaseHistory.to_DataArray`, i.e. records are
+    either scalars, `[nchains]` or `[nleapfrog, nchains]`.
+    """
+    if len(shape) == 1:
+        return ['draw', 'chain']
+    if len(shape) == 2:
+        return ['draw', 'leapfrog', 'chain']
+    return ['draw', *[f'dim_{i}' for i in range(len(shape))]]
+
+
+class H5Writer:
+    """Streams records to chunked, extendable HDF5 datasets, one per key.
+
+    Records are buffered (`chunk_size` rows per key) and written to
+    `{key}[draw, ...]` datasets in the file, which is kept open. Every
+    `flush_every` records all buffers are written and the file is flushed,
+    so memory use stays flat for arbitrarily long runs.
+
+    If `swmr`, the file is written in single-writer / multiple-reader mode:
+    it can be read while the run is in progress, and stays readable (with all
+    records up to the last flush) if the writing process crashes.
+
+    NOTE: In SWMR mode, all datasets are created on the first write, so keys
+    which first appear after that are skipped (with a warning).
+
+    Example:
+        >>> with H5Writer('eval_stream.h5', chunk_size=128) as writer:
+        ...     for step in range(nsteps):
+        ...         x, metrics = eval_step((x, beta))
+        ...         writer.append({'step': step, **metrics})
+    """
+    def __init__(
+            self,
+            fpath: os.PathLike,
+            chunk_size: int = 256,
+            flush_every: Optional[int] = None,
+            compression: Optional[str] = 'lzf',
+            compression_level: Optional[int] = None,
+            swmr: bool = True,
+            mode: str = 'a',
+    ) -> None:
+        self.fpath = Path(fpath)
+        self.chunk_size = max(1, int(chunk_size))
+        self.flush_every = (
+            self.chunk_size if flush_every is None
+            else max(1, int(flush_every))
+        )
+        self.swmr = swmr
+        self.mode = mode
+        self.nrecords = 0
+        self._ckwargs = compression_kwargs(compression, compression_level)
+        self._file: Optional[h5py.File] = None
+        self._buffers: dict[str, np.ndarray] = {}
+        self._counts: dict[str, int] = {}
+        self._skipped: set[str] = set()
+
+    def __enter__(self) -> H5Writer:
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def _skip(self, key: str, reason: str) -> None:
+        if key not in self._skipped:
+            log.warning(f'Not writing {key} to {self.fpath.name}: {reason}')
+        self._skipped.add(key)
+
+    def _create_dataset(self, f: h5py.File, key: str) -> None:
+        buf = self._buffers[key]
+        shape = buf.shape[1:]
+        rows = MAX_CHUNK_BYTES // max(1, buf[0].nbytes)
+        dset = f.create_dataset(
+            key,
+            shape=(0, *shape),
+            maxshape=(None, *shape),
+            chunks=(max(1, min(self.chunk_size, rows)), *shape),
+            dtype=buf.dtype,
+            **self._ckwargs,
+        )
+        dset.attrs['dims'] = record_dims(shape)
+
+    def _get_file(self) -> h5py.File:
+        if self._file is None:
+            self.fpath.parent.mkdir(exist_ok=True, parents=True)
+            log.info(f'Streaming records to: {self.fpath.as_posix()}')
+            f = h5py.File(self.fpath, self.mode, libver='latest')
+            for key, buf in self._buffers.items():
+                if key not in f:
+                    self._create_dataset(f, key)
+                elif f[key].shape[1:] != buf.shape[1:]:  # type:ignore
+                    raise ValueError(
+                        f'Existing {key} in {self.fpath} has shape '
+                        f'{f[key].shape}, expected records of {buf.shape[1:]}'
+                    )
+            if self.swmr:
+                f.swmr_mode = True
+            self._file = f
+
+        return self._file
+
+    def _write(self, key: str) -> None:
+        n = self._counts[key]
+        if n == 0:
+            return
+        dset = self._get_file()[key]
+        start = dset.shape[0]
+        dset.resize(start + n, axis=0)
+        dset[start:] = self._buffers[key][:n]
+        self._counts[key] = 0
+
+    def append(self, record: dict[str, Any]) -> None:
+        """Append a single record (e.g. metrics from one step)."""
+        for key, val in record.items():
+            key = key.replace('/', '_')
+            if val is None or key in self._skipped:
+                continue
+            arr = np.asarray(val)
+            buf = self._buffers.get(key, None)
+            if buf is None:
+                if arr.dtype.kind not in 'biufc':
+                    self._skip(key, f'unsupported dtype {arr.dtype}')
+                    continue
+                new = (self._file is not None and key not in self._file)
+                if new and self.swmr:
+                    self._skip(key, 'new key after first write (SWMR)')
+                    continue
+                buf = np.empty((self.chunk_size, *arr.shape), dtype=arr.dtype)
+                self._buffers[key] = buf
+                self._counts[key] = 0
+                if new:
+                    self._create_dataset(self._file, key)
+            elif arr.shape != buf.shape[1:]:
+                log.warning(
+                    f'Skipping {key} record with shape {arr.shape}, '
+                    f'expected: {buf.shape[1:]}'
+                )
+                continue
+
+            buf[self._counts[key]] = arr
+            self._counts[key] += 1
+            if self._counts[key] == self.chunk_size:
+                self._write(key)
+
+        self.nrecords += 1
+        if self.nrecords % self.flush_every == 0:
+            self.flush()
+
+    def flush(self) -> None:
+        """Write all buffered records and flush the file to disk."""
+        if len(self._buffers) == 0:
+            return
+        for key in self._buffers:
+            self._write(key)
+        self._get_file().flush()
+
+    def close(self) -> None:
+        self.flush()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -10,26 +10,112 @@ from pathlib import Path
 from typing import Any, Optional
 from typing import Union
 
-import matplotlib.pyplot as plt
-import matplotx
 import numpy as np
-import seaborn as sns
 import xarray as xr
 
 from l2hmc.configs import MonteCarloStates, Steps
-import l2hmc.utils.plot_helpers as hplt
 
 
 log = logging.getLogger(__name__)
 
-xplt = xr.plot  # type:ignore
-LW = plt.rcParams.get('axes.linewidth', 1.75)
+
+def _plotting() -> tuple:
+    """Returns `(plt, sns, matplotx, hplt)`, imported on first use.
+
+    NOTE: These are slow to import and only needed when plotting, so we
+    avoid importing them (at startup) with `l2hmc.utils.history`.
+    """
+    import matplotlib.pyplot as plt
+    import matplotx
+    import seaborn as sns
+    import l2hmc.utils.plot_helpers as hplt
+    return plt, sns, matplotx, hplt
 
 
 def summarize_dict(d: dict) -> str:
     return ', '.join([f'{k}={v:<3.2f}' for k, v in d.items()])
 
 
+def num_records(steps: Steps) -> int:
+    """Returns the number of records logged during training with `steps`."""
+    epochs = np.arange(steps.nepoch)
+    logged = (epochs % steps.log == 0) | (epochs % steps.print == 0)
+    return max(1, steps.nera * int(logged.sum()))
+
+
+class HistoryBuffer:
+    """Growable NumPy buffer, holding one record (row) per `append`.
+
+    Records are copied into a preallocated array of shape
+    `[capacity, *record.shape]`, whose capacity is doubled whenever it fills
+    up (amortized O(1) appends). `values` (and `np.asarray(buffer)`) return a
+    zero-copy view of the records appended so far.
+
+    NOTE: If a record with a different shape is appended, the buffer falls
+    back to storing its records in a (python) list.
+    """
+    def __init__(self, capacity: int = 64) -> None:
+        self.capacity = max(1, int(capacity))
+        self._data: Optional[np.ndarray] = None
+        self._size = 0
+        self._ragged: Optional[list] = None
+
+    def __len__(self) -> int:
+        return self._size if self._ragged is None else len(self._ragged)
+
+    def __getitem__(self, idx):
+        return self.values[idx]
+
+    def __iter__(self):
+        return iter(self.values)
+
+    def __array__(self, dtype=None, copy=None) -> np.ndarray:
+        if self._ragged is not None or copy:
+            return np.array(self.values, dtype=dtype)
+        return np.asarray(self.values, dtype=dtype)
+
+    @property
+    def values(self) -> np.ndarray | list:
+        if self._ragged is not None:
+            return self._ragged
+        if self._data is None:
+            return np.empty((0,))
+        return self._data[:self._size]
+
+    def _grow(self) -> None:
+        assert self._data is not None
+        data = np.empty((2 * len(self._data), *self._data.shape[1:]),
+                        dtype=self._data.dtype)
+        data[:self._size] = self._data[:self._size]
+        self._data = data
+
+    def append(self, val: Any) -> None:
+        if self._ragged is not None:
+            self._ragged.append(val)
+            return
+
+        arr = np.asarray(val)
+        if self._data is None:
+            self._data = np.empty((self.capacity, *arr.shape), dtype=arr.dtype)
+        elif arr.shape != self._data.shape[1:]:
+            log.warning(
+                f'Record shape changed ({self._data.shape[1:]} -> '
+                f'{arr.shape}), falling back to list storage'
+            )
+            self._ragged = [*self.values, val]
+            self._data = None
+            return
+        else:
+            if arr.dtype != self._data.dtype:
+                dtype = np.result_type(self._data.dtype, arr.dtype)
+                self._data = self._data.astype(dtype, copy=False)
+            if self._size == len(self._data):
+                self._grow()
+
+        self._data[self._size] = arr
+        self._size += 1
+
+
 @dataclass
 class StateHistory:
     def __post_init__(self):
@@ -47,11 +133,30 @@ class StateHistory:
 
 
 class BaseHistory:
-    def __init__(self, steps: Optional[Steps] = None):
+    def __init__(
+            self,
+            steps: Optional[Steps] = None,
+            capacity: Optional[int] = None,
+    ):
+        """Initialization method.
+
+        Each metric is stored in a `HistoryBuffer`, preallocated to hold
+        `capacity` records. If not specified, `capacity` is determined from
+        (the number of records logged during training with) `steps`.
+        """
         self.steps = steps
-        self.history = {}
+        self.history: dict[str, HistoryBuffer] = {}
         nera = 1 if steps is None else steps.nera
         self.era_metrics = {str(era): {} for era in range(nera)}
+        if capacity is None:
+            capacity = 64 if steps is None else num_records(steps)
+        self.capacity = capacity
+
+    def _append(self, key: str, val: Any) -> None:
+        if key not in self.history:
+            self.history[key] = HistoryBuffer(capacity=self.capacity)
+
+        self.history[key].append(val)
 
     def _update(self, key: str, val: Any) -> float:
         if val is None:
@@ -60,10 +165,7 @@ class BaseHistory:
         if isinstance(val, list):
             val = np.array(val)
 
-        try:
-            self.history[key].append(val)
-        except KeyError:
-            self.history[key] = [val]
+        self._append(key, val)
 
         if isinstance(val, (float, int)):
             return val
@@ -117,6 +219,8 @@ class BaseHistory:
             plot_kwargs: Optional[dict[str, Any]] = None,
 
     ) -> tuple:
+        plt, sns, matplotx, hplt = _plotting()
+        LW = plt.rcParams.get('axes.linewidth', 1.75)
         plot_kwargs = {} if plot_kwargs is None else plot_kwargs
         subplots_kwargs = {} if subplots_kwargs is None else subplots_kwargs
         figsize = subplots_kwargs.get('figsize', hplt.set_size())
@@ -218,6 +322,8 @@ class BaseHistory:
             subplots_kwargs: Optional[dict[str, Any]] = None,
             plot_kwargs: Optional[dict[str, Any]] = None,
     ):
+        plt, sns, matplotx, hplt = _plotting()
+        LW = plt.rcParams.get('axes.linewidth', 1.75)
         plot_kwargs = {} if plot_kwargs is None else plot_kwargs
         subplots_kwargs = {} if subplots_kwargs is None else subplots_kwargs
         figsize = subplots_kwargs.get('figsize', hplt.set_size())
@@ -314,6 +420,7 @@ class BaseHistory:
             subplots_kwargs: Optional[dict[str, Any]] = None,
             plot_kwargs: Optional[dict[str, Any]] = None,
     ):
+        plt, sns, _, _ = _plotting()
         plot_kwargs = {} if plot_kwargs is None else plot_kwargs
         subplots_kwargs = {} if subplots_kwargs is None else subplots_kwargs
 
@@ -337,8 +444,8 @@ class BaseHistory:
                 plt.rcParams['axes.edgecolor'] = plt.rcParams['axes.facecolor']
                 ax = subfigs[0].subplots(1, 1)
                 # ax = fig[1].subplots(constrained_layout=True)
-                _ = xplt.pcolormesh(val, 'draw', 'chain', ax=ax,
-                                    robust=True, add_colorbar=True)
+                _ = xr.plot.pcolormesh(val, 'draw', 'chain', ax=ax,
+                                       robust=True, add_colorbar=True)
                 # im = val.plot(ax=ax, cbar_kwargs=cbar_kwargs)
                 # im.colorbar.set_label(f'{key}')  # , labelpad=1.25)
                 sns.despine(subfigs[0], top=True, right=True,
@@ -353,10 +460,10 @@ class BaseHistory:
 
     def to_DataArray(
             self,
-            x: Union[list, np.ndarray],
+            x: Union[list, np.ndarray, HistoryBuffer],
             therm_frac: Optional[float] = 0.0,
     ) -> xr.DataArray:
-        arr = np.array(x)
+        arr = np.asarray(x)
         if therm_frac is not None and therm_frac > 0:
             drop = int(therm_frac * arr.shape[0])
             arr = arr[drop:]
@@ -390,6 +497,11 @@ class BaseHistory:
             data: Optional[dict[str, Union[list, np.ndarray]]] = None,
             therm_frac: Optional[float] = 0.0,
     ):
+        """Returns an `xr.Dataset` built from (by default) `self.history`.
+
+        NOTE: The variables are views into the underlying `HistoryBuffer`s,
+        (not copies) and so should be treated as read-only.
+        """
         data = self.history if data is None else data
         data_vars = {}
         for key, val in data.items():
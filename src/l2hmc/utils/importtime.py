@@ -0,0 +1,102 @@
+"""
+importtime.py
+
+Startup benchmark for l2hmc entry points, using `python -X importtime`.
+
+Each module is imported in a fresh interpreter, and the cumulative import
+time of the module (plus the slowest of its dependencies) is reported.
+
+Example:
+    $ python3 -m l2hmc.utils.importtime --budget 5.0 \
+        l2hmc.trainers.pytorch.trainer
+
+exits with a nonzero status if any module takes longer than `--budget` (s).
+"""
+from __future__ import absolute_import, annotations, division, print_function
+import argparse
+import os
+import subprocess
+import sys
+from typing import Optional, Sequence
+
+DEFAULT_MODULES = ('l2hmc.trainers.pytorch.trainer',)
+SRC_DIR = os.path.dirname(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+)
+
+
+def parse_importtime(stderr: str) -> dict[str, float]:
+    """Returns `{module: cumulative import time (s)}` from `-X importtime`.
+
+    NOTE: For modules imported more than once (which can't happen within a
+    single interpreter, but can in concatenated logs) we keep the largest.
+    """
+    times: dict[str, float] = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        parts = line[len('import time:'):].split('|')
+        if len(parts) != 3:
+            continue
+        try:
+            cumulative = int(parts[1]) / 1e6
+        except ValueError:  # header line
+            continue
+        name = parts[2].strip()
+        times[name] = max(cumulative, times.get(name, 0.))
+
+    return times
+
+
+def measure(module: str) -> dict[str, float]:
+    """Import `module` in a fresh interpreter, returning its import times."""
+    env = dict(os.environ)
+    env.pop('PYTHONIMPORTTIME', None)
+    # NOTE: Import this copy of `l2hmc`, even if it isn't installed
+    paths = [SRC_DIR, *env.get('PYTHONPATH', '').split(os.pathsep)]
+    env['PYTHONPATH'] = os.pathsep.join(p for p in paths if p)
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f'Unable to import {module}:\n{proc.stderr}')
+
+    return parse_importtime(proc.stderr)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[3])
+    parser.add_argument('modules', nargs='*', default=DEFAULT_MODULES)
+    parser.add_argument('--budget', type=float, default=None,
+                        help='Max import time (in seconds) of each module')
+    parser.add_argument('--top', type=int, default=10,
+                        help='Number of slowest dependencies to print')
+    args = parser.parse_args(argv)
+
+    failed = []
+    for module in args.modules:
+        times = measure(module)
+        total = times[module]
+        print(f'{module}: {total:.3f}s')
+        # NOTE: Only report top-level packages, since their cumulative time
+        # already includes that of their submodules
+        top = sorted(
+            ((k, v) for k, v in times.items()
+             if k != module and '.' not in k),
+            key=lambda kv: kv[1],
+            reverse=True,
+        )[:args.top]
+        for name, val in top:
+            print(f'  {name:<40s} {val:.3f}s')
+        if args.budget is not None and total > args.budget:
+            failed.append(module)
+            print(f'  FAILED: {total:.3f}s > budget ({args.budget:.3f}s)')
+
+    return 1 if len(failed) > 0 else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
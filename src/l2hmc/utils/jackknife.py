@@ -0,0 +1,251 @@
+"""
+jackknife.py
+
+Contains a (vectorized) blocking and jackknife error analysis engine for
+datasets produced by `BaseHistory.get_dataset`.
+
+Blocking follows Flyvbjerg & Petersen (1989): the draws are repeatedly
+averaged in (adjacent) pairs, with the error on the mean estimated at each
+level, and the optimal block size chosen automatically (Wolff 2004, Lee et
+al. 2011) as the smallest `B` with `B^3 > 2 N (err_B / err_1)^4`.
+
+All (chain, draw) variables are stacked and analyzed together, so that the
+cost of each level is a single (vectorized) NumPy operation.
+"""
+from __future__ import absolute_import, annotations, division, print_function
+import logging
+import os
+from pathlib import Path
+from typing import Callable, Optional
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+
+log = logging.getLogger(__name__)
+
+# NOTE: Derived quantities are functions of jackknife means `{name: [nj]}`
+Derived = Callable[[dict[str, np.ndarray]], np.ndarray]
+
+
+def _as_components(val: xr.DataArray) -> np.ndarray:
+    """Returns `val` as `[ncomponents, nchains, ndraws]`."""
+    if 'chain' not in val.dims:
+        val = val.expand_dims('chain')
+    other = [d for d in val.dims if d not in ['chain', 'draw']]
+    arr = val.transpose(*other, 'chain', 'draw').values
+    return arr.reshape(-1, *arr.shape[-2:]).astype(np.float64)
+
+
+def blocking_scan(x: np.ndarray, min_blocks: int = 32) -> dict:
+    """Returns the error on the mean of `x[..., chain, draw]` vs block size.
+
+    Chains are treated as independent, so each level has `nchains * nblocks`
+    blocks, and we stop once there are fewer than `min_blocks` of them.
+    Returns a dict with:
+
+      - `block_size`: `[nlevels]`, block sizes `1, 2, 4, ...`
+      - `nblocks`: `[nlevels]`, number of blocks at each level
+      - `err`: `[..., nlevels]`, error on the mean at each level
+    """
+    x = np.asarray(x, dtype=np.float64)
+    nchains = x.shape[-2]
+    sizes, nblocks, errs = [], [], []
+    blocks = x
+    size = 1
+    while blocks.shape[-1] * nchains >= max(2, min_blocks):
+        nb = blocks.shape[-1]
+        n = nb * nchains
+        flat = blocks.reshape(*blocks.shape[:-2], n)
+        errs.append(np.sqrt(flat.var(axis=-1, ddof=1) / n))
+        sizes.append(size)
+        nblocks.append(n)
+        half = 2 * (nb // 2)
+        blocks = 0.5 * (blocks[..., 0:half:2] + blocks[..., 1:half:2])
+        size *= 2
+
+    if len(errs) == 0:
+        raise ValueError(f'Not enough draws for blocking: {x.shape}')
+
+    return {
+        'block_size': np.array(sizes),
+        'nblocks': np.array(nblocks),
+        'err': np.stack(errs, axis=-1),
+    }
+
+
+def optimal_level(scan: dict) -> np.ndarray:
+    """Returns (index of) the optimal blocking level for each component.
+
+    This is the smallest `B` with `B^3 > 2 N (err_B / err_1)^4`, or the
+    largest level available if no such `B` exists (in which case the
+    error is likely underestimated).
+    """
+    err = scan['err']
+    ntot = scan['nblocks'][0]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = np.where(err[..., :1] > 0, err / err[..., :1], 1.)
+    cond = scan['block_size'] ** 3 > 2. * ntot * ratio ** 4
+    return np.where(cond.any(axis=-1), cond.argmax(axis=-1), err.shape[-1] - 1)
+
+
+def jackknife(
+        data: dict[str, np.ndarray],
+        fn: Derived,
+        block_size: int = 1,
+) -> tuple[float, float]:
+    """Returns jackknife estimate of `fn(means)`, with its error.
+
+    Each of `data` is a `[nchains, ndraws]` array, which is split into
+    (non-overlapping) blocks of `block_size` draws. The leave-one-block-out
+    means are computed for all blocks at once from the block sums, and
+    passed to `fn` as `{name: [nblocks]}` arrays.
+
+    Returns the bias corrected estimate and its (jackknife) error.
+    """
+    means, jmeans = {}, {}
+    nj = None
+    for key, val in data.items():
+        val = np.asarray(val, dtype=np.float64)
+        val = val.reshape(-1, val.shape[-1])
+        nb = val.shape[-1] // block_size
+        if nb < 1:
+            raise ValueError(f'block_size={block_size} too large for {key}')
+        # NOTE: Reshape of the (truncated) draws is a view, no copies
+        sums = val[:, :nb * block_size].reshape(
+            val.shape[0], nb, block_size
+        ).sum(axis=-1).reshape(-1)
+        total = sums.sum()
+        ntot = sums.size * block_size
+        means[key] = np.array([total / ntot])
+        jmeans[key] = (total - sums) / (ntot - block_size)
+        nj = sums.size if nj is None else min(nj, sums.size)
+
+    assert nj is not None
+    if any(v.size != nj for v in jmeans.values()):
+        raise ValueError('Inconsistent number of blocks in `data`')
+
+    full = float(np.asarray(fn(means)).reshape(-1)[0])
+    samples = np.asarray(fn(jmeans), dtype=np.float64).reshape(-1)
+    mean = samples.mean()
+    est = nj * full - (nj - 1) * mean
+    err = np.sqrt((nj - 1) / nj * np.sum((samples - mean) ** 2))
+    return float(est), float(err)
+
+
+def error_analysis(
+        dataset: xr.Dataset,
+        beta: Optional[float] = None,
+        volume: Optional[float] = None,
+        charge: str = 'intQ',
+        derived: Optional[dict[str, tuple[list[str], Derived]]] = None,
+        min_blocks: int = 32,
+) -> pd.DataFrame:
+    """Blocking / jackknife error analysis of all variables in `dataset`.
+
+    Variables with more than one component (e.g. `[chain, leapfrog, draw]`)
+    are analyzed, and reported, per component as `{key}[i]`.
+
+    Derived quantities are computed (with a jackknife, using the largest
+    optimal block size of their inputs) from `derived`, specified as
+    `{name: ([inputs], fn)}` plus, by default:
+
+      - `dplaq = plaq_exact(beta) - <plaqs>` if `beta` is given (U(1))
+      - `chi_Q = (<Q^2> - <Q>^2) / volume` if `volume` is given
+
+    Returns a `pd.DataFrame` indexed by name, with columns
+    `mean, err, err_naive, tau_int, block_size, nblocks`.
+    """
+    data = {}
+    for key, val in dataset.data_vars.items():
+        if 'draw' not in val.dims or val.sizes['draw'] < 2:
+            continue
+        if not np.issubdtype(val.dtype, np.number):
+            continue
+        arr = _as_components(val)
+        if arr.shape[0] == 1:
+            data[str(key)] = arr[0]
+        else:
+            for idx in range(arr.shape[0]):
+                data[f'{key}[{idx}]'] = arr[idx]
+
+    derived = {} if derived is None else dict(derived)
+    if charge in data:
+        data[f'{charge}^2'] = data[charge] ** 2
+        if volume is not None:
+            derived.setdefault('chi_Q', (
+                [charge, f'{charge}^2'],
+                lambda m: (m[f'{charge}^2'] - m[charge] ** 2) / volume,
+            ))
+    if beta is not None and 'plaqs' in data:
+        from l2hmc.lattice.u1.numpy.lattice import plaq_exact
+        pexact = float(plaq_exact(beta))
+        derived.setdefault('dplaq', (['plaqs'], lambda m: pexact - m['plaqs']))
+
+    # NOTE: Group (and stack) variables with the same [chain, draw] shape
+    groups: dict[tuple, list[str]] = {}
+    for key, val in data.items():
+        groups.setdefault(val.shape, []).append(key)
+
+    rows = {}
+    for shape, keys in groups.items():
+        x = np.stack([data[k] for k in keys])
+        try:
+            scan = blocking_scan(x, min_blocks=min_blocks)
+        except ValueError:
+            log.warning(f'Not enough draws for blocking {keys}, skipping!')
+            continue
+        level = optimal_level(scan)
+        err = np.take_along_axis(scan['err'], level[:, None], axis=-1)[:, 0]
+        naive = scan['err'][:, 0]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            tau = np.where(naive > 0, 0.5 * (err / naive) ** 2, np.nan)
+        means = x.mean(axis=(-2, -1))
+        for idx, key in enumerate(keys):
+            rows[key] = {
+                'mean': means[idx],
+                'err': err[idx],
+                'err_naive': naive[idx],
+                'tau_int': tau[idx],
+                'block_size': int(scan['block_size'][level[idx]]),
+                'nblocks': int(scan['nblocks'][level[idx]]),
+            }
+
+    for name, (inputs, fn) in derived.items():
+        if any(k not in rows for k in inputs):
+            log.warning(f'Missing inputs for {name}: {inputs}, skipping!')
+            continue
+        bsize = max(rows[k]['block_size'] for k in inputs)
+        try:
+            est, err = jackknife({k: data[k] for k in inputs}, fn, bsize)
+        except ValueError as exc:
+            log.warning(f'Unable to compute {name}: {exc}')
+            continue
+        rows[name] = {
+            'mean': est,
+            'err': err,
+            'err_naive': np.nan,
+            'tau_int': np.nan,
+            'block_size': bsize,
+            'nblocks': min(rows[k]['nblocks'] for k in inputs),
+        }
+
+    return pd.DataFrame.from_dict(rows, orient='index')
+
+
+def save_summary(
+        summary: pd.DataFrame,
+        outdir: os.PathLike,
+        job_type: Optional[str] = None,
+) -> Path:
+    """Save `summary` (from `error_analysis`) as `.csv` (and `.txt`)."""
+    fname = 'summary' if job_type is None else f'{job_type}_summary'
+    outfile = Path(outdir).joinpath(f'{fname}.csv')
+    outfile.parent.mkdir(exist_ok=True, parents=True)
+    log.info(f'Saving error analysis to: {outfile.as_posix()}')
+    summary.to_csv(outfile, float_format='%.8g')
+    with open(outfile.with_suffix('.txt'), 'w') as f:
+        f.write(summary.to_string(float_format=lambda v: f'{v:.6g}'))
+
+    return outfile
@@ -0,0 +1,324 @@
+"""
+online.py
+
+Contains implementations of online (streaming) estimators, which are updated
+with the (per-chain) value of an observable at every step, in O(nchains)
+memory, without storing any of the draws.
+
+All accumulators are framework agnostic (anything accepted by `np.asarray`)
+and expose `state_dict` / `load_state_dict`, so they can be checkpointed.
+"""
+from __future__ import absolute_import, annotations, division, print_function
+import logging
+from typing import Any, Optional, Sequence
+
+import numpy as np
+
+from l2hmc.utils.autocorr import auto_window
+
+
+log = logging.getLogger(__name__)
+
+
+def _to_numpy(x: Any) -> np.ndarray:
+    if hasattr(x, 'detach'):
+        x = x.detach().cpu().numpy()
+    elif hasattr(x, 'numpy'):
+        x = x.numpy()
+    return np.asarray(x, dtype=np.float64)
+
+
+class Accumulator:
+    """Base class, handling (de)serialization of the attrs in `_state`."""
+    _state: tuple[str, ...] = ()
+
+    def state_dict(self) -> dict:
+        return {
+            k: (v.copy() if isinstance(v, np.ndarray) else v)
+            for k, v in ((k, getattr(self, k)) for k in self._state)
+        }
+
+    def load_state_dict(self, state: dict) -> None:
+        for key in self._state:
+            val = state[key]
+            setattr(self, key, (
+                np.array(val, dtype=np.float64) if isinstance(val, np.ndarray)
+                else val
+            ))
+
+
+class Welford(Accumulator):
+    """Running (per-chain) mean and variance, using Welford's algorithm."""
+    _state = ('n', 'mean', 'm2')
+
+    def __init__(self) -> None:
+        self.n = 0
+        self.mean: Optional[np.ndarray] = None
+        self.m2: Optional[np.ndarray] = None
+
+    def update(self, x: Any) -> None:
+        x = _to_numpy(x)
+        if self.mean is None or self.m2 is None:
+            self.mean = np.zeros_like(x)
+            self.m2 = np.zeros_like(x)
+        self.n += 1
+        delta = x - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (x - self.mean)
+
+    @property
+    def variance(self) -> np.ndarray:
+        assert self.m2 is not None
+        return self.m2 / max(1, self.n - 1)
+
+    @property
+    def second_moment(self) -> np.ndarray:
+        """Running mean of `x ** 2`."""
+        assert self.mean is not None and self.m2 is not None
+        return self.m2 / max(1, self.n) + self.mean ** 2
+
+
+class OnlineCovariance(Accumulator):
+    """Running (per-chain) covariance and correlation of `x` and `y`."""
+    _state = ('n', 'mx', 'my', 'm2x', 'm2y', 'cxy')
+
+    def __init__(self) -> None:
+        self.n = 0
+        self.mx = self.my = self.m2x = self.m2y = self.cxy = None
+
+    def update(self, x: Any, y: Any) -> None:
+        x, y = _to_numpy(x), _to_numpy(y)
+        if self.mx is None:
+            self.mx, self.m2x = np.zeros_like(x), np.zeros_like(x)
+            self.my, self.m2y = np.zeros_like(y), np.zeros_like(y)
+            self.cxy = np.zeros(np.broadcast(x, y).shape)
+        self.n += 1
+        dx = x - self.mx
+        dy = y - self.my
+        self.mx += dx / self.n
+        self.my += dy / self.n
+        self.m2x += dx * (x - self.mx)
+        self.m2y += dy * (y - self.my)
+        self.cxy += dx * (y - self.my)
+
+    @property
+    def covariance(self) -> np.ndarray:
+        return self.cxy / max(1, self.n - 1)
+
+    @property
+    def correlation(self) -> np.ndarray:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return self.cxy / np.sqrt(self.m2x * self.m2y)
+
+
+class OnlineAutocorr(Accumulator):
+    """Running (per-chain) autocorrelation, for lags `0, ..., max_lag`.
+
+    Consecutive draws are averaged into bins of `bin_size` and the lagged
+    products of the last `max_lag + 1` bins (kept in a ring buffer) are
+    accumulated, so lags of up to `max_lag * bin_size` steps are reachable
+    in O(max_lag * nchains) memory.
+    """
+    _state = ('n', 'nbins', 'pos', 'cur', 'ncur', 'buf', 'total', 'lagsum')
+
+    def __init__(self, max_lag: int = 64, bin_size: int = 1) -> None:
+        self.max_lag = max(1, int(max_lag))
+        self.bin_size = max(1, int(bin_size))
+        self.n = 0
+        self.nbins = 0
+        self.pos = 0
+        self.ncur = 0
+        self.cur = self.buf = self.total = self.lagsum = None
+        self.draws = Welford()
+
+    def state_dict(self) -> dict:
+        return {
+            'max_lag': self.max_lag,
+            'bin_size': self.bin_size,
+            'draws': self.draws.state_dict(),
+            **super().state_dict(),
+        }
+
+    def load_state_dict(self, state: dict) -> None:
+        self.max_lag = state['max_lag']
+        self.bin_size = state['bin_size']
+        self.draws.load_state_dict(state['draws'])
+        super().load_state_dict(state)
+
+    def update(self, x: Any) -> None:
+        x = _to_numpy(x)
+        if self.cur is None:
+            self.cur = np.zeros_like(x)
+            self.total = np.zeros_like(x)
+            self.buf = np.zeros((self.max_lag + 1, *x.shape))
+            self.lagsum = np.zeros((self.max_lag + 1, *x.shape))
+        self.n += 1
+        self.draws.update(x)
+        self.cur += x
+        self.ncur += 1
+        if self.ncur < self.bin_size:
+            return
+
+        b = self.cur / self.ncur
+        self.cur = np.zeros_like(self.cur)
+        self.ncur = 0
+        self.buf[self.pos] = b
+        self.nbins += 1
+        self.total += b
+        nlags = min(self.nbins, self.max_lag + 1)
+        # NOTE: buf[(pos - k) % (max_lag + 1)] holds the bin from `k` bins ago
+        idxs = (self.pos - np.arange(nlags)) % (self.max_lag + 1)
+        self.lagsum[:nlags] += b * self.buf[idxs]
+        self.pos = (self.pos + 1) % (self.max_lag + 1)
+
+    def autocovariance(self) -> np.ndarray:
+        """Returns `[lag, nchains]` autocovariance of the binned draws."""
+        nlags = min(self.nbins, self.max_lag + 1)
+        mean = self.total / max(1, self.nbins)
+        counts = self.nbins - np.arange(nlags)
+        counts = counts.reshape(-1, *([1] * (self.lagsum.ndim - 1)))
+        return self.lagsum[:nlags] / counts - mean ** 2
+
+    def autocorr(self) -> np.ndarray:
+        """Returns the chain-averaged autocorrelation of the binned draws."""
+        acov = self.autocovariance()
+        acov = acov.reshape(acov.shape[0], -1).mean(axis=-1)
+        if acov[0] <= 0.:
+            return np.ones_like(acov)
+        return acov / acov[0]
+
+    def tau_int(self, c: float = 6.0) -> float:
+        """Returns the integrated autocorrelation time (in steps).
+
+        NOTE: For `bin_size > 1`, this is `bin_size * tau_bins` scaled by the
+        ratio of the variance of the bin means to that of the draws, which
+        is the tau_int relevant for the error on the mean.
+        """
+        rho = self.autocorr()
+        taus = np.cumsum(rho) - 0.5
+        tau = taus[auto_window(taus, c=c)]
+        if self.bin_size == 1:
+            return float(tau)
+        acov = self.autocovariance()
+        var_bins = acov.reshape(acov.shape[0], -1).mean(axis=-1)[0]
+        var = np.mean(self.draws.variance)
+        return float(self.bin_size * tau * var_bins / var) if var > 0 else tau
+
+
+class StreamingObservables:
+    """Streaming estimators for the observables measured during `eval`.
+
+    For each of `keys` (and the topological `charge`) we track the per-chain
+    running mean and variance. In addition, we track the covariance of the
+    charge with each of `keys`, the (binned) autocorrelation of the charge
+    up to `max_lag`, and the topological susceptibility `chi_Q = <Q^2> / V`.
+
+    Example:
+        >>> obs = StreamingObservables(volume=np.prod(latvolume))
+        >>> for step in range(nsteps):
+        ...     x, metrics = eval_step((x, beta))
+        ...     obs.update(metrics)
+        >>> obs.summary()  # {'intQ/mean': ..., 'chi_Q': ..., ...}
+    """
+    def __init__(
+            self,
+            volume: float = 1.0,
+            charge: str = 'intQ',
+            keys: Optional[Sequence[str]] = ('plaqs', 'sinQ'),
+            max_lag: int = 64,
+            bin_size: int = 1,
+    ) -> None:
+        self.volume = float(volume)
+        self.charge = charge
+        self.keys = [k for k in ([] if keys is None else keys) if k != charge]
+        self.moments = {k: Welford() for k in [charge, *self.keys]}
+        self.covs = {k: OnlineCovariance() for k in self.keys}
+        self.acorr = OnlineAutocorr(max_lag=max_lag, bin_size=bin_size)
+        self._missing: set[str] = set()
+
+    def update(self, metrics: dict) -> None:
+        """Update estimators with `metrics` from a single step."""
+        q = metrics.get(self.charge, None)
+        if q is None:
+            self._warn_missing(self.charge)
+            return
+        q = _to_numpy(q)
+        self.moments[self.charge].update(q)
+        self.acorr.update(q)
+        for key in self.keys:
+            val = metrics.get(key, None)
+            if val is None:
+                self._warn_missing(key)
+                continue
+            val = _to_numpy(val)
+            self.moments[key].update(val)
+            self.covs[key].update(q, val)
+
+    def _warn_missing(self, key: str) -> None:
+        if key not in self._missing:
+            log.warning(f'{key} missing from metrics, not tracking it!')
+        self._missing.add(key)
+
+    @property
+    def n(self) -> int:
+        return self.moments[self.charge].n
+
+    def summary(self, c: float = 6.0) -> dict[str, float]:
+        """Returns chain-averaged estimates (with errors) of all observables.
+
+        Errors are computed from the spread of the (independent) per-chain
+        means, and so account for autocorrelations within each chain.
+        """
+        out = {}
+        if self.n == 0:
+            return out
+        for key, w in self.moments.items():
+            if w.n == 0:
+                continue
+            means = w.mean.reshape(-1)
+            nchains = len(means)
+            out[f'{key}/mean'] = float(means.mean())
+            out[f'{key}/err'] = (
+                float(means.std(ddof=1) / np.sqrt(nchains)) if nchains > 1
+                else np.nan
+            )
+            out[f'{key}/var'] = float(np.mean(w.variance))
+        for key, cov in self.covs.items():
+            if cov.n == 0:
+                continue
+            out[f'cov_{self.charge}_{key}'] = float(np.mean(cov.covariance))
+            out[f'corr_{self.charge}_{key}'] = float(
+                np.nanmean(cov.correlation)
+            )
+        q2 = self.moments[self.charge].second_moment.reshape(-1)
+        out['chi_Q'] = float(q2.mean() / self.volume)
+        out['chi_Q/err'] = (
+            float(q2.std(ddof=1) / np.sqrt(len(q2)) / self.volume)
+            if len(q2) > 1 else np.nan
+        )
+        if self.acorr.nbins > 1:
+            out[f'{self.charge}/tau_int'] = self.acorr.tau_int(c=c)
+
+        return out
+
+    def state_dict(self) -> dict:
+        return {
+            'volume': self.volume,
+            'charge': self.charge,
+            'keys': list(self.keys),
+            'moments': {k: v.state_dict() for k, v in self.moments.items()},
+            'covs': {k: v.state_dict() for k, v in self.covs.items()},
+            'acorr': self.acorr.state_dict(),
+        }
+
+    def load_state_dict(self, state: dict) -> None:
+        self.volume = state['volume']
+        self.charge = state['charge']
+        self.keys = list(state['keys'])
+        self.moments = {k: Welford() for k in state['moments']}
+        self.covs = {k: OnlineCovariance() for k in state['covs']}
+        for key, val in state['moments'].items():
+            self.moments[key].load_state_dict(val)
+        for key, val in state['covs'].items():
+            self.covs[key].load_state_dict(val)
+        self.acorr.load_state_dict(state['acorr'])
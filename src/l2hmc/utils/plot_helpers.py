@@ -209,13 +209,20 @@ def plot_combined(
         num_chains: Optional[int] = 10,
         subplots_kwargs: Optional[dict[str, Any]] = None,
         plot_kwargs: Optional[dict[str, Any]] = None,
+        density: Optional[xr.DataArray] = None,
 ) -> tuple:
+    """Plot traces (and density) of `val`, with dims `[chain, draw]`.
+
+    NOTE: Traces are plotted against the `draw` coordinate of `val` (so it
+    may be decimated), the density is estimated from `density` if provided.
+    """
     plot_kwargs = {} if plot_kwargs is None else plot_kwargs
     subplots_kwargs = {} if subplots_kwargs is None else subplots_kwargs
     figsize = subplots_kwargs.get('figsize', set_size())
     subplots_kwargs.update({'figsize': figsize})
     subfigs = None
     num_chains = 10 if num_chains is None else num_chains
+    density = val if density is None else density
 
     _ = subplots_kwargs.pop('constrained_layout', True)
     figsize = (3 * figsize[0], 1.5 * figsize[1])
@@ -234,7 +241,7 @@ def plot_combined(
     (ax1, ax2) = subfigs[1].subplots(1, 2, sharey=True, gridspec_kw=gs_kw)
     ax1.grid(alpha=0.4)
     ax2.grid(False)
-    sns.kdeplot(y=val.values.flatten(), ax=ax2, color=color, shade=True)
+    sns.kdeplot(y=density.values.flatten(), ax=ax2, color=color, shade=True)
     axes = (ax1, ax2)
     ax0 = subfigs[0].subplots(1, 1)
     val = val.dropna('chain')
@@ -245,7 +252,7 @@ def plot_combined(
     nchains = min(num_chains, len(val.coords['chain']))
     label = f'{key}_avg'
     # label = r'$\langle$' + f'{key} ' + r'$\rangle$'
-    steps = np.arange(len(val.coords['draw']))
+    steps = val.coords['draw'].values
     chain_axis = val.get_axis_num('chain')
     if chain_axis == 0:
         for idx in range(nchains):
@@ -278,6 +285,7 @@ def plot_dataArray(
         subplots_kwargs: Optional[dict[str, Any]] = None,
         plot_kwargs: Optional[dict[str, Any]] = None,
         line_labels: Optional[bool] = True,
+        density: Optional[xr.DataArray] = None,
 ) -> tuple:
     plot_kwargs = {} if plot_kwargs is None else plot_kwargs
     subplots_kwargs = {} if subplots_kwargs is None else subplots_kwargs
@@ -289,7 +297,7 @@ def plot_dataArray(
         therm_frac = 0.2
 
     arr = val.values  # shape: [nchains, ndraws]
-    steps = np.arange(len(val.coords['draw']))
+    steps = val.coords['draw'].values
 
     if therm_frac is not None and therm_frac > 0.0:
         drop = int(therm_frac * arr.shape[0])
@@ -299,6 +307,7 @@ def plot_dataArray(
     if len(arr.shape) == 2:
         fig, axes = plot_combined(val, key=key,
                                   num_chains=num_chains,
+                                  density=density,
                                   plot_kwargs=plot_kwargs,
                                   subplots_kwargs=subplots_kwargs)
     else:
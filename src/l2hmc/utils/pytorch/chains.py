@@ -0,0 +1,149 @@
+"""
+utils/pytorch/chains.py
+
+On-disk store of the (final) Markov chain state `x` of each job.
+
+Chains are saved per job type and per beta, to
+
+    {root}/{job_type}-beta{beta:.4f}.pt
+
+so that a later job (e.g. `eval` after `train`, or `hmc` after `eval`, in
+this or a subsequent run) can start from thermalized configurations instead
+of from `random_angle`. If `x` was sampled at a (per-chain) ladder of betas
+(see `BetaLadder`), the chains at each beta are saved separately.
+
+Starting from a (small) thermalized ensemble, `branch` tiles it across
+more chains, so that multiple short runs can be branched from it.
+"""
+from __future__ import absolute_import, division, print_function, annotations
+import logging
+import os
+from pathlib import Path
+from typing import Optional, Sequence
+
+import torch
+
+
+log = logging.getLogger(__name__)
+
+Tensor = torch.Tensor
+
+JOB_TYPES = ('eval', 'hmc', 'train')
+
+
+def branch(x: Tensor, nchains: int, nbranches: int = 1) -> Tensor:
+    """Returns `nchains` chains, branched from the ensemble `x`.
+
+    Each of the first `ceil(nchains / nbranches)` chains of `x` is copied
+    (at least) `nbranches` times, repeating the ensemble as needed to fill
+    `nchains`. The copies are identical, and decorrelate through the
+    (independent) momenta drawn at each step.
+    """
+    nbranches = max(1, int(nbranches))
+    nroots = min(x.shape[0], -(-nchains // nbranches))
+    x = x[:nroots]
+    reps = -(-nchains // nroots)
+    return x.repeat(reps, *([1] * (x.ndim - 1)))[:nchains]
+
+
+class ChainStore:
+    """Save (and load) the chain state `x` of each job, by beta.
+
+    Example:
+        >>> store = ChainStore('outputs/chains')
+        >>> store.save(output['x'], job_type='train', beta=beta)
+        >>> x = store.load('eval', beta=beta, nchains=64)  # from 'train'
+    """
+    def __init__(self, root: os.PathLike) -> None:
+        self.root = Path(root)
+
+    def fpath(self, job_type: str, beta: float) -> Path:
+        return self.root.joinpath(f'{job_type}-beta{float(beta):.4f}.pt')
+
+    def save(
+            self,
+            x: Tensor,
+            job_type: str,
+            beta: float | Tensor,
+    ) -> list[Path]:
+        """Save `x`, sampled at (scalar or per-chain) `beta`.
+
+        Returns the list of files written, one for each distinct beta.
+        """
+        self.root.mkdir(exist_ok=True, parents=True)
+        x = x.detach().to('cpu')
+        beta = torch.as_tensor(beta).detach().to('cpu').reshape(-1)
+        if beta.numel() == 1:
+            beta = beta.expand(x.shape[0])
+        assert beta.shape[0] == x.shape[0]
+        saved = []
+        for b in torch.unique(beta).tolist():
+            fpath = self.fpath(job_type, b)
+            xb = x[beta == b].clone()
+            # NOTE: Written to a temporary file first, so that a job killed
+            # mid-write never leaves behind a truncated state
+            tmpfile = fpath.with_name(f'{fpath.name}.tmp')
+            torch.save({'x': xb, 'beta': b, 'job_type': job_type}, tmpfile)
+            os.replace(tmpfile, fpath)
+            log.info(
+                f'Saved {xb.shape[0]} chains ({job_type}, beta={b:.4f}) '
+                f'to: {fpath.as_posix()}'
+            )
+            saved.append(fpath)
+
+        return saved
+
+    def find(
+            self,
+            job_type: str,
+            beta: float,
+            fallback: Optional[Sequence[str]] = JOB_TYPES,
+    ) -> Optional[Path]:
+        """Returns the saved state for `(job_type, beta)`, if it exists.
+
+        Otherwise, the first of `fallback` job types with saved state at
+        `beta` is used, since the (equilibrium) distribution at a given
+        beta does not depend on the sampler.
+        """
+        job_types = [job_type, *[j for j in (fallback or []) if j != job_type]]
+        for jtype in job_types:
+            fpath = self.fpath(jtype, beta)
+            if fpath.is_file():
+                return fpath
+        return None
+
+    def load(
+            self,
+            job_type: str,
+            beta: float | Sequence[float],
+            nchains: Optional[int] = None,
+            nbranches: int = 1,
+            fallback: Optional[Sequence[str]] = JOB_TYPES,
+    ) -> Optional[Tensor]:
+        """Load saved chains at `beta`, branched to `nchains` (per beta).
+
+        If `beta` is a sequence, the chains at each beta are concatenated,
+        in (sorted) order, to match the layout of a `BetaLadder`. Returns
+        `None` if there is no saved state at (any of the) `beta`.
+        """
+        betas = (
+            [float(beta)] if isinstance(beta, (int, float))
+            else sorted(float(b) for b in beta)
+        )
+        xs = []
+        for b in betas:
+            fpath = self.find(job_type, beta=b, fallback=fallback)
+            if fpath is None:
+                log.warning(f'No saved chains for {job_type} at beta={b:.4f}')
+                return None
+            x = torch.load(fpath, map_location='cpu')['x']
+            n = x.shape[0] if nchains is None else nchains
+            if n > x.shape[0] or nbranches > 1:
+                log.info(
+                    f'Branching {n} chains from {x.shape[0]} '
+                    f'({nbranches} branches) in: {fpath.as_posix()}'
+                )
+            xs.append(branch(x, n, nbranches=nbranches))
+            log.info(f'Warm start from: {fpath.as_posix()}')
+
+        return torch.cat(xs, dim=0)
@@ -0,0 +1,53 @@
+"""
+utils/pytorch/compile.py
+
+Helpers for (optionally) compiling functions with `torch.compile`.
+"""
+from __future__ import absolute_import, division, print_function, annotations
+import functools
+import logging
+from typing import Any, Callable
+
+import torch
+
+
+log = logging.getLogger(__name__)
+
+
+def compile_with_fallback(
+        fn: Callable,
+        name: str = '',
+        **kwargs: Any,
+) -> Callable:
+    """Wrap `fn` with `torch.compile`, falling back to eager on failure.
+
+    Compilation happens lazily, on the first call. Each call runs with
+    `torch._dynamo.config.suppress_errors`, so that if dynamo (or the
+    backend, e.g. inductor) fails to compile a frame of `fn`, that frame
+    is run eagerly *instead*, before any of its code has run.
+
+    NOTE: We never re-run a call, since `fn` may have side effects (e.g.
+    `Trainer._train_step` takes an optimizer step), and code before a graph
+    break has already run by the time a later frame fails to compile. Any
+    exception that escapes the call (e.g. a genuine runtime error) is
+    re-raised as is.
+
+    NOTE: Any `kwargs` are passed through to `torch.compile`
+    (e.g. `mode='max-autotune'`, `dynamic=True`).
+    """
+    name = name if name else getattr(fn, '__qualname__', repr(fn))
+    if not hasattr(torch, 'compile'):
+        log.warning(f'`torch.compile` unavailable, running {name} eagerly')
+        return fn
+
+    from torch import _dynamo
+
+    compiled = torch.compile(fn, **kwargs)
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kw):
+        with _dynamo.config.patch(suppress_errors=True):
+            return compiled(*args, **kw)
+
+    setattr(wrapper, '_eager_fn', fn)
+    return wrapper
@@ -0,0 +1,204 @@
+"""
+utils/pytorch/sharding.py
+
+Helpers for chain-sharded evaluation across (torch.distributed) ranks.
+
+Each of the `size` ranks evaluates its own (contiguous) slice of the
+chains. At the steps where metrics are recorded, the per-chain metrics of
+every rank are concatenated (along the chain dimension) with a single
+collective, see `gather_chains`, so that every rank sees the metrics of
+all `size * nchains` chains (and the recorded history is identical to
+that of a single process running every chain).
+
+The same (nested) layout of per-chain metrics is stitched back together
+from micro-batches of chains by `concat_chains`, see `Trainer.train_step`.
+
+Every tensor (or array) in the metrics holds one value per chain along a
+fixed chain dimension (the last, by default), except for scalars (e.g. the
+loss), and `SHARED_METRICS` (e.g. the step sizes), which are the same for
+every chain, see `is_chain_metric`.
+"""
+from __future__ import absolute_import, division, print_function, annotations
+import logging
+from typing import Any, Callable, NamedTuple, Optional, Sequence
+
+import numpy as np
+import torch
+
+
+log = logging.getLogger(__name__)
+
+Tensor = torch.Tensor
+
+# NOTE: Metrics shared by all chains, rather than one per chain, e.g. the
+# (per leapfrog step) step sizes
+SHARED_METRICS = ('xeps', 'veps')
+
+
+class _Leaf(NamedTuple):
+    """Placeholder for a packed tensor, see `gather_chains`."""
+    idx: int
+    chain: bool
+    shape: torch.Size
+    dtype: torch.dtype
+    device: torch.device
+    is_array: bool
+
+
+def is_chain_metric(
+        key: Any,
+        val: Tensor | np.ndarray,
+        nchains: int,
+        dim: int = -1,
+        shared: Sequence[str] = SHARED_METRICS,
+) -> bool:
+    """Returns True if the metric `key` holds one value per chain (on `dim`).
+
+    Scalars and `shared` metrics don't. Any other tensor (or array) must
+    have `nchains` entries along `dim`, otherwise we raise a `ValueError`
+    (rather than guess which of its dimensions holds the chains).
+    """
+    if key in shared or val.ndim == 0:
+        return False
+    if val.shape[dim] != nchains:
+        raise ValueError(
+            f'Expected {nchains} chains along dim={dim} of {key!r}, '
+            f'got shape: {tuple(val.shape)}'
+        )
+    return True
+
+
+def shard_chains(x: Tensor, rank: int, size: int) -> Tensor:
+    """Returns the slice of (the first dimension of) `x` held by `rank`.
+
+    Each rank gets `x.shape[0] // size` chains, so that every rank holds
+    the same number of chains (as required by `gather_chains`).
+    """
+    nchains = x.shape[0] // size
+    if nchains < 1:
+        raise ValueError(f'Need at least {size} chains, got {x.shape[0]}')
+    if nchains * size != x.shape[0]:
+        log.warning(
+            f'Truncating {x.shape[0]} chains to {size} ranks '
+            f'x {nchains} chains'
+        )
+    return x[rank * nchains:(rank + 1) * nchains]
+
+
+def gather_chains(
+        metrics: Any,
+        nchains: int,
+        gather_fn: Callable[[Tensor], Tensor],
+        dim: int = -1,
+        device: Optional[Any] = None,
+        shared: Sequence[str] = SHARED_METRICS,
+) -> Any:
+    """Concatenate (possibly nested) per-chain `metrics` across ranks.
+
+    Every per-chain tensor (or array) in `metrics` (see `is_chain_metric`)
+    is gathered along `dim`, scalars are averaged across ranks, and
+    `shared` metrics are kept as is. Everything is packed into a single
+    `[nchains, nfeatures]` tensor, so that this costs one call to
+    `gather_fn`, e.g. `Accelerator.gather`, which should concatenate along
+    the first dimension of its input across ranks (and return it on every
+    rank). The packed tensor is moved to `device` (e.g. for NCCL) if
+    provided.
+    """
+    cols = []
+    leaves = []
+
+    def _pack(val: Any, key: Any = None) -> Any:
+        if isinstance(val, dict):
+            return {k: _pack(v, k) for k, v in val.items()}
+        if isinstance(val, (list, tuple)):
+            return type(val)(_pack(v, key) for v in val)
+        if not isinstance(val, (Tensor, np.ndarray, np.generic)):
+            return val
+        if key in shared:
+            return val
+        t = torch.as_tensor(val)
+        chain = is_chain_metric(key, t, nchains, dim=dim, shared=shared)
+        if chain:
+            t = t.movedim(dim, 0)
+            col = t.reshape(nchains, -1)
+        else:
+            col = t.reshape(1, -1).expand(nchains, -1)
+        cols.append(col.detach().to('cpu', torch.float64))
+        leaves.append(_Leaf(len(leaves), chain, t.shape[int(chain):],
+                            t.dtype, t.device, not isinstance(val, Tensor)))
+        return leaves[-1]
+
+    packed = _pack(metrics)
+    if len(cols) == 0:
+        return metrics
+
+    packed_cols = torch.cat(cols, dim=1)
+    if device is not None:
+        packed_cols = packed_cols.to(device)
+    gathered = gather_fn(packed_cols).to('cpu')
+    ntotal = gathered.shape[0]
+    splits = gathered.split([c.shape[1] for c in cols], dim=1)
+
+    def _unpack(val: Any) -> Any:
+        if isinstance(val, dict):
+            return {k: _unpack(v) for k, v in val.items()}
+        if not isinstance(val, _Leaf):
+            if isinstance(val, (list, tuple)):
+                return type(val)(_unpack(v) for v in val)
+            return val
+        col = splits[val.idx]
+        if val.chain:
+            t = col.reshape(ntotal, *val.shape).movedim(0, dim)
+        else:
+            t = col.mean(0).reshape(val.shape)
+        t = t.to(val.device, val.dtype)
+        return t.numpy() if val.is_array else t
+
+    return _unpack(packed)
+
+
+def concat_chains(
+        chunks: list,
+        sizes: list[int],
+        dim: int = -1,
+        shared: Sequence[str] = SHARED_METRICS,
+        key: Any = None,
+) -> Any:
+    """Concatenate (possibly nested) per-chain metrics of chunks of chains.
+
+    `chunks[i]` holds the metrics of `sizes[i]` chains. Per-chain tensors
+    (or arrays), see `is_chain_metric`, are concatenated along `dim`, and
+    scalars are averaged, weighted by `sizes`, so that a mean over chains
+    (e.g. the loss) is that of the full batch. `shared` metrics are taken
+    from the first chunk.
+    """
+    first = chunks[0]
+    if isinstance(first, dict):
+        return {
+            k: concat_chains([c[k] for c in chunks], sizes, dim=dim,
+                             shared=shared, key=k)
+            for k in first
+        }
+    if isinstance(first, (list, tuple)):
+        return type(first)(
+            concat_chains(list(vals), sizes, dim=dim, shared=shared, key=key)
+            for vals in zip(*chunks)
+        )
+    if not isinstance(first, (Tensor, np.ndarray, np.generic)) or (
+            key in shared
+    ):
+        return first
+    is_array = not isinstance(first, Tensor)
+    ts = [torch.as_tensor(c) for c in chunks]
+    chain = [
+        is_chain_metric(key, t, n, dim=dim, shared=shared)
+        for t, n in zip(ts, sizes)
+    ]
+    if all(chain):
+        t = torch.cat(ts, dim=dim)
+    else:
+        weights = torch.tensor(sizes, dtype=torch.float64) / sum(sizes)
+        t = sum(
+            w.item() * t_.to(torch.float64) for w, t_ in zip(weights, ts)
+        ).to(ts[0].dtype)
+    return t.numpy() if is_array else t
@@ -0,0 +1,120 @@
+"""
+utils/pytorch/stepsize.py
+
+Step size adaptation for (generic) HMC, using Nesterov dual averaging.
+
+Follows Algorithm 5 of Hoffman & Gelman (2014), "The No-U-Turn Sampler":
+
+    Hbar_m = (1 - 1 / (m + t0)) Hbar_{m-1} + (target - acc_m) / (m + t0)
+    log eps_m = mu - sqrt(m) / gamma * Hbar_m
+    log epsbar_m = m^-kappa log eps_m + (1 - m^-kappa) log epsbar_{m-1}
+
+with `mu = log(10 * eps0)`. The iterates `eps_m` are used while adapting,
+after which the step size is frozen at the (averaged) `epsbar`.
+
+With `per_chain=True`, each chain has its own step size, adapted to its
+own acceptance, and held in a `[nchains]` tensor (see
+`Dynamics.leapfrog_hmc`). Otherwise, a single (scalar) step size is adapted
+to the acceptance averaged over chains.
+"""
+from __future__ import absolute_import, division, print_function, annotations
+import logging
+import math
+
+import torch
+
+
+log = logging.getLogger(__name__)
+
+Tensor = torch.Tensor
+
+
+class DualAveraging:
+    """Nesterov dual averaging of `log(eps)` toward `target_accept`.
+
+    Example:
+        >>> da = DualAveraging(eps0=0.1, target_accept=0.8)
+        >>> eps = da.eps
+        >>> for _ in range(nadapt):
+        ...     x, metrics = hmc_step((x, beta), eps=eps)
+        ...     eps = da.update(metrics['acc'])
+        >>> eps = da.final  # frozen step size
+    """
+    def __init__(
+            self,
+            eps0: float | Tensor,
+            target_accept: float = 0.8,
+            gamma: float = 0.05,
+            t0: float = 10.0,
+            kappa: float = 0.75,
+            per_chain: bool = False,
+    ) -> None:
+        assert 0. < target_accept < 1.
+        self.target_accept = target_accept
+        self.gamma = gamma
+        self.t0 = t0
+        self.kappa = kappa
+        self.per_chain = per_chain
+        eps0 = torch.as_tensor(eps0, dtype=torch.float64).mean()
+        self.mu = math.log(10. * float(eps0))
+        self.m = 0
+        # NOTE: With `per_chain`, these are expanded to `[nchains]` on the
+        # first call to `update`
+        self.hbar = torch.zeros((), dtype=torch.float64)
+        self.log_eps = eps0.log()
+        self.log_epsbar = torch.zeros((), dtype=torch.float64)
+
+    @property
+    def eps(self) -> Tensor:
+        """Current (adapting) step size."""
+        return self.log_eps.exp().to(torch.get_default_dtype())
+
+    @property
+    def final(self) -> Tensor:
+        """Averaged step size, to be used once adaptation is finished."""
+        if self.m == 0:
+            return self.eps
+        return self.log_epsbar.exp().to(torch.get_default_dtype())
+
+    def update(self, acc: Tensor) -> Tensor:
+        """Update with the (per-chain) acceptance `acc`, returns new `eps`."""
+        acc = torch.as_tensor(acc).detach().to('cpu', torch.float64)
+        acc = acc.reshape(-1)
+        acc = acc if self.per_chain else acc.mean()
+        if self.m == 0:
+            self.hbar = self.hbar.expand_as(acc).clone()
+            self.log_eps = self.log_eps.expand_as(acc).clone()
+            self.log_epsbar = self.log_epsbar.expand_as(acc).clone()
+        self.m += 1
+        w = 1. / (self.m + self.t0)
+        self.hbar = (1. - w) * self.hbar + w * (self.target_accept - acc)
+        self.log_eps = self.mu - math.sqrt(self.m) / self.gamma * self.hbar
+        eta = self.m ** (-self.kappa)
+        self.log_epsbar = eta * self.log_eps + (1. - eta) * self.log_epsbar
+        return self.eps
+
+    def summary(self) -> dict:
+        final = self.final
+        return {
+            'nsteps': self.m,
+            'target_accept': self.target_accept,
+            'eps': final.mean().item(),
+            'eps_min': final.min().item(),
+            'eps_max': final.max().item(),
+        }
+
+    def state_dict(self) -> dict:
+        return {
+            'mu': self.mu,
+            'm': self.m,
+            'hbar': self.hbar.clone(),
+            'log_eps': self.log_eps.clone(),
+            'log_epsbar': self.log_epsbar.clone(),
+        }
+
+    def load_state_dict(self, state: dict) -> None:
+        self.mu = state['mu']
+        self.m = state['m']
+        self.hbar = state['hbar'].clone()
+        self.log_eps = state['log_eps'].clone()
+        self.log_epsbar = state['log_epsbar'].clone()
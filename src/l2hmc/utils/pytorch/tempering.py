@@ -0,0 +1,227 @@
+"""
+utils/pytorch/tempering.py
+
+Replica exchange (parallel tempering) across a ladder of `beta` values.
+
+All `K` replicas are run as a single batch of `K * n` chains, laid out
+replica-major, i.e. chain `k * n + j` is the `j`-th chain of replica `k`,
+which is sampled at `betas[k]`. The (per-chain) `beta` vector is broadcast
+through `Dynamics` (and the lattice action), so one step of the sampler
+updates every replica at once.
+
+Every `swap_every` steps, we attempt to swap the configurations of each
+chain between neighboring replicas `(k, k + 1)`, alternating between even
+and odd `k`, accepting with probability
+
+    min(1, exp((beta[k] - beta[k+1]) * (S(x[k]) - S(x[k+1])))),
+
+where `S(x)` is the action at unit `beta`. Since betas are fixed to replica
+slots, only the configurations move and the chains at the largest `beta`
+(the target replica) always sample the target distribution.
+"""
+from __future__ import absolute_import, division, print_function, annotations
+import logging
+from typing import Any, Callable, Optional, Sequence
+
+import numpy as np
+import torch
+
+from l2hmc.utils.pytorch.sharding import SHARED_METRICS, is_chain_metric
+
+
+log = logging.getLogger(__name__)
+
+Tensor = torch.Tensor
+
+
+def beta_ladder(
+        beta_min: float,
+        beta_max: float,
+        nreplicas: int,
+        spacing: str = 'geometric',
+) -> list[float]:
+    """Returns `nreplicas` (increasing) betas from `beta_min` to `beta_max`.
+
+    With `spacing='geometric'` (default), neighboring betas have a constant
+    ratio, which gives roughly uniform swap acceptance when the specific
+    heat is approximately constant.
+    """
+    if nreplicas < 2:
+        return [float(beta_max)]
+    if spacing == 'geometric':
+        betas = np.geomspace(beta_min, beta_max, nreplicas)
+    elif spacing == 'linear':
+        betas = np.linspace(beta_min, beta_max, nreplicas)
+    else:
+        raise ValueError(f'Unexpected spacing: {spacing}')
+
+    return [float(b) for b in betas]
+
+
+class BetaLadder:
+    """Layout of `nreplicas * nchains` chains across (sorted) `betas`.
+
+    Chain `k * nchains + j` is the `j`-th chain at `betas[k]`. On its own,
+    this describes a (batched) beta scan, see `Trainer.eval`.
+    """
+    def __init__(self, betas: Sequence[float]) -> None:
+        if len(betas) < 1:
+            raise ValueError('Expected at least one beta')
+        self.betas = torch.tensor(sorted(betas),
+                                  dtype=torch.get_default_dtype())
+        self.nreplicas = len(betas)
+        self.nchains = 0  # NOTE: Number of chains per replica, see `init`
+
+    @property
+    def beta_target(self) -> float:
+        return float(self.betas[-1])
+
+    @property
+    def ntotal(self) -> int:
+        return self.nreplicas * self.nchains
+
+    def init(self, x: Tensor) -> Tensor:
+        """Truncate `x` to `nreplicas * nchains` chains, setting `nchains`."""
+        nchains = x.shape[0] // self.nreplicas
+        if nchains < 1:
+            raise ValueError(
+                f'Need at least {self.nreplicas} chains, got {x.shape[0]}'
+            )
+        if nchains * self.nreplicas != x.shape[0]:
+            log.warning(
+                f'Truncating {x.shape[0]} chains to {self.nreplicas} '
+                f'replicas x {nchains} chains'
+            )
+        self.nchains = nchains
+        return x[:self.ntotal]
+
+    def beta(self, device: Optional[Any] = None) -> Tensor:
+        """Returns `[nreplicas * nchains]` beta (one per chain)."""
+        beta = self.betas.repeat_interleave(self.nchains)
+        return beta if device is None else beta.to(device)
+
+    def target(self) -> slice:
+        """Returns (slice of) the chains sampled at the target beta."""
+        return slice(self.ntotal - self.nchains, self.ntotal)
+
+    def select(
+            self,
+            metrics: dict,
+            dim: int = -1,
+            shared: Sequence[str] = SHARED_METRICS,
+    ) -> dict:
+        """Returns `metrics`, keeping only the chains of the target replica.
+
+        Per-chain tensors (or arrays), see `is_chain_metric`, are sliced
+        along `dim`; scalars and `shared` metrics are passed through.
+        """
+        idx = self.target()
+
+        def _select(val: Any, key: Any = None) -> Any:
+            if isinstance(val, (Tensor, np.ndarray)):
+                if is_chain_metric(key, val, self.ntotal, dim=dim,
+                                   shared=shared):
+                    sl = [slice(None)] * val.ndim
+                    sl[dim] = idx
+                    return val[tuple(sl)]
+                return val
+            if isinstance(val, dict):
+                return {k: _select(v, k) for k, v in val.items()}
+            if isinstance(val, list):
+                return [_select(v, key) for v in val]
+            return val
+
+        return {k: _select(v, k) for k, v in metrics.items()}
+
+
+class ReplicaExchange(BetaLadder):
+    """Parallel tempering across `betas`, with the target at `max(betas)`.
+
+    Example:
+        >>> pt = ReplicaExchange(beta_ladder(1.0, 6.0, 4), swap_every=10)
+        >>> x = pt.init(x)         # truncated to a multiple of 4 chains
+        >>> beta = pt.beta()       # [nchains], per-chain beta
+        >>> for step in range(nsteps):
+        ...     x, metrics = eval_step((x, beta))
+        ...     metrics = pt.select(metrics)  # metrics of target replica
+        ...     if pt.should_swap(step):
+        ...         x = pt.swap(x, dynamics.potential_energy)
+        >>> pt.summary()  # {'swap_acc': [...], ...}
+    """
+    def __init__(
+            self,
+            betas: Sequence[float],
+            swap_every: int = 10,
+    ) -> None:
+        super().__init__(betas)
+        self.swap_every = max(1, int(swap_every))
+        self.nrounds = 0
+        self.nattempts = torch.zeros(max(0, self.nreplicas - 1))
+        self.naccepts = torch.zeros(max(0, self.nreplicas - 1))
+
+    def should_swap(self, step: int) -> bool:
+        return self.nreplicas > 1 and (step + 1) % self.swap_every == 0
+
+    @torch.no_grad()
+    def swap(
+            self,
+            x: Tensor,
+            potential_fn: Callable[[Tensor, Tensor], Tensor],
+    ) -> Tensor:
+        """Attempt swaps between neighboring replicas, returning new `x`.
+
+        `potential_fn(x, beta)` should return the (per-chain) action, and
+        is evaluated once (at `beta = 1`) for all chains.
+        """
+        k, n = self.nreplicas, self.nchains
+        if k < 2:
+            return x
+        beta1 = torch.ones((), dtype=x.dtype, device=x.device)
+        action = potential_fn(x, beta1).detach().reshape(k, n)
+        betas = self.betas.to(action.device, action.dtype)
+        lo = torch.arange(self.nrounds % 2, k - 1, 2, device=action.device)
+        hi = lo + 1
+        dbeta = (betas[lo] - betas[hi]).unsqueeze(-1)
+        logp = dbeta * (action[lo] - action[hi])
+        accept = torch.rand_like(logp).log() < logp
+        # NOTE: src[k, j] is the (flat) index of the chain moving to [k, j]
+        idxs = torch.arange(k * n, device=x.device).reshape(k, n)
+        src = idxs.clone()
+        src[lo] = torch.where(accept, idxs[hi], idxs[lo])
+        src[hi] = torch.where(accept, idxs[lo], idxs[hi])
+        self.nattempts[lo.cpu()] += n
+        self.naccepts[lo.cpu()] += accept.sum(-1).to(self.naccepts)
+        self.nrounds += 1
+        return x[src.reshape(-1)]
+
+    @property
+    def swap_acc(self) -> Tensor:
+        """Returns the swap acceptance rate of each neighboring pair."""
+        return self.naccepts / self.nattempts.clamp(min=1)
+
+    def summary(self) -> dict:
+        return {
+            'betas': self.betas.tolist(),
+            'nchains': self.nchains,
+            'nrounds': self.nrounds,
+            'swap_acc': self.swap_acc.tolist(),
+        }
+
+    def state_dict(self) -> dict:
+        return {
+            'betas': self.betas.clone(),
+            'swap_every': self.swap_every,
+            'nchains': self.nchains,
+            'nrounds': self.nrounds,
+            'nattempts': self.nattempts.clone(),
+            'naccepts': self.naccepts.clone(),
+        }
+
+    def load_state_dict(self, state: dict) -> None:
+        self.betas = state['betas'].clone()
+        self.nreplicas = len(self.betas)
+        self.swap_every = state['swap_every']
+        self.nchains = state['nchains']
+        self.nrounds = state['nrounds']
+        self.nattempts = state['nattempts'].clone()
+        self.naccepts = state['naccepts'].clone()
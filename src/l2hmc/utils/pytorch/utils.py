@@ -8,8 +8,10 @@ from omegaconf import DictConfig
 from pathlib import Path
 import os
 import logging
-from torch.utils.tensorboard.writer import SummaryWriter
+import random
+from typing import Any, Optional
 
+import numpy as np
 from l2hmc.dynamics.pytorch.dynamics import Dynamics
 import torch
 
@@ -22,6 +24,7 @@ def get_summary_writer(
         job_type: str
 ):
     """Returns SummaryWriter object for tracking summaries."""
+    from torch.utils.tensorboard.writer import SummaryWriter
     outdir = Path(cfg.get('outdir', os.getcwd()))
     jobdir = outdir.joinpath(job_type)
     summary_dir = jobdir.joinpath('summaries')
@@ -32,6 +35,75 @@ def get_summary_writer(
     return writer
 
 
+def to_cpu(obj: Any) -> Any:
+    """Returns (a copy of) a possibly nested `obj`, with tensors on cpu."""
+    if isinstance(obj, torch.Tensor):
+        return obj.detach().to('cpu', copy=True)
+    if isinstance(obj, dict):
+        return {k: to_cpu(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(to_cpu(v) for v in obj)
+    return obj
+
+
+def get_rng_state() -> dict:
+    """Returns the state of the (python, numpy, torch) RNGs."""
+    state = {
+        'random': random.getstate(),
+        'numpy': np.random.get_state(),
+        'torch': torch.get_rng_state(),
+    }
+    if torch.cuda.is_available():
+        state['cuda'] = torch.cuda.get_rng_state_all()
+    return state
+
+
+def set_rng_state(state: dict) -> None:
+    """Restore the RNGs from `state`, as returned by `get_rng_state`."""
+    random.setstate(state['random'])
+    np.random.set_state(state['numpy'])
+    torch.set_rng_state(state['torch'])
+    if 'cuda' in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state['cuda'])
+
+
+def list_ckpts(ckpt_dir: os.PathLike) -> list[Path]:
+    """Returns the `ckpt-{era}-{epoch}.tar` files in `ckpt_dir`, in order."""
+    def _key(f: Path) -> tuple[int, int]:
+        era, epoch = f.name[len('ckpt-'):-len('.tar')].split('-')
+        return int(era), int(epoch)
+
+    return sorted(Path(ckpt_dir).glob('ckpt-*-*.tar'), key=_key)
+
+
+def find_ckpt(path: os.PathLike) -> Optional[Path]:
+    """Returns the latest checkpoint in `path`.
+
+    `path` can be a checkpoint file, a `checkpoints/` directory, or the
+    `train/` directory (or the output directory) containing it.
+    """
+    path = Path(path)
+    if path.is_file():
+        return path
+    for ckpt_dir in [
+            path,
+            path.joinpath('checkpoints'),
+            path.joinpath('train', 'checkpoints'),
+    ]:
+        ckpts = list_ckpts(ckpt_dir) if ckpt_dir.is_dir() else []
+        if len(ckpts) > 0:
+            return ckpts[-1]
+    return None
+
+
+def load_ckpt_file(ckpt_file: os.PathLike) -> dict:
+    """Load checkpoint (to cpu), which includes non-tensor (RNG) states."""
+    try:
+        return torch.load(ckpt_file, map_location='cpu', weights_only=False)
+    except TypeError:  # NOTE: `weights_only` was added in torch 1.13
+        return torch.load(ckpt_file, map_location='cpu')
+
+
 def load_from_ckpt(
         dynamics: Dynamics,
         optimizer: torch.optim.Optimizer,
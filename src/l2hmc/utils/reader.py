@@ -0,0 +1,293 @@
+"""
+reader.py
+
+Contains methods for lazily loading saved run data as `xr.Dataset`s.
+
+Variables are backed by the arrays on disk (h5py datasets, `np.memmap`s or
+lazily loaded netCDF variables), so that slicing e.g.
+`dataset.isel(draw=slice(-100, None), chain=0)` only reads what is needed.
+Data from multiple files (e.g. runs listed in `outputs/outdirs.log`) is
+concatenated along the `draw` dimension into a single (lazy) view.
+"""
+from __future__ import absolute_import, annotations, division, print_function
+from collections import Counter
+import logging
+import os
+from pathlib import Path
+from typing import Any, Callable, Optional, Sequence
+
+import h5py
+import numpy as np
+import xarray as xr
+from xarray.backends import BackendArray
+from xarray.core import indexing
+
+
+log = logging.getLogger(__name__)
+
+# NOTE: Dimensions are ordered as in `BaseHistory.to_DataArray`
+DIMS_ORDER = {'chain': 0, 'leapfrog': 1, 'draw': 3}
+
+
+def open_h5pyfile(hfile: os.PathLike) -> h5py.File:
+    """Open `hfile` for reading.
+
+    This includes (partial) files which are still being written by, or were
+    left behind by a crashed, `H5Writer` in SWMR mode.
+    """
+    try:
+        # NOTE: Registers the lz4 / blosc / zstd filters, if available
+        import hdf5plugin  # noqa:F401
+    except ImportError:
+        pass
+    try:
+        return h5py.File(hfile, 'r')
+    except OSError:
+        return h5py.File(hfile, 'r', swmr=True)
+
+
+def default_dims(ndim: int) -> list[str]:
+    """Dimension names of arrays saved (w/o a `dims` attr) from a Dataset."""
+    if ndim == 1:
+        return ['draw']
+    if ndim == 2:
+        return ['chain', 'draw']
+    if ndim == 3:
+        return ['chain', 'leapfrog', 'draw']
+    return [*[f'dim_{i}' for i in range(ndim - 1)], 'draw']
+
+
+def _memmap(hfile: os.PathLike, dset: h5py.Dataset) -> Optional[np.memmap]:
+    """Returns `np.memmap` of `dset` if it is stored contiguously."""
+    if dset.chunks is not None or dset.compression is not None:
+        return None
+    offset = dset.id.get_offset()
+    if offset is None or dset.dtype.hasobject or dset.size == 0:
+        return None
+    return np.memmap(hfile, mode='r', dtype=dset.dtype,
+                     offset=offset, shape=dset.shape)
+
+
+class ArrayPart:
+    """A single on-disk array, indexed with its dimensions in `order`."""
+    def __init__(self, array: Any, dims: Sequence[str], order: Sequence[str]):
+        self.array = array
+        self.dims = list(dims)
+        self.perm = [self.dims.index(d) for d in order]
+        self.shape = tuple(array.shape[p] for p in self.perm)
+        self.dtype = np.dtype(array.dtype)
+
+    def __getitem__(self, key: tuple) -> np.ndarray:
+        """Index with a (basic) `key` of ints / slices, given in `order`."""
+        native: list[Any] = [slice(None)] * len(key)
+        for idx, k in enumerate(key):
+            native[self.perm[idx]] = k
+        out = self.array[tuple(native)]
+        if isinstance(out, xr.Variable):
+            out = out.values
+        kept = [
+            self.perm[idx] for idx, k in enumerate(key)
+            if not isinstance(k, (int, np.integer))
+        ]
+        axes = sorted(kept)
+        return np.asarray(out).transpose([axes.index(a) for a in kept])
+
+
+class ConcatArray(BackendArray):
+    """Lazy concatenation of `ArrayPart`s along `axis`."""
+    def __init__(self, parts: Sequence[ArrayPart], axis: int):
+        self.parts = list(parts)
+        self.axis = axis
+        shape = list(self.parts[0].shape)
+        shape[axis] = sum(p.shape[axis] for p in self.parts)
+        self.shape = tuple(shape)
+        self.dtype = np.result_type(*[p.dtype for p in self.parts])
+        self.offsets = np.cumsum([0] + [p.shape[axis] for p in self.parts])
+
+    def __getitem__(self, key: indexing.ExplicitIndexer) -> np.ndarray:
+        return indexing.explicit_indexing_adapter(
+            key,
+            self.shape,
+            indexing.IndexingSupport.BASIC,
+            self._getitem,
+        )
+
+    def _getitem(self, key: tuple) -> np.ndarray:
+        k = key[self.axis]
+        if isinstance(k, (int, np.integer)):
+            idx = int(np.searchsorted(self.offsets, k, side='right')) - 1
+            sub = list(key)
+            sub[self.axis] = int(k - self.offsets[idx])
+            return self.parts[idx][tuple(sub)].astype(self.dtype, copy=False)
+
+        start, stop, step = k.indices(self.shape[self.axis])
+        out = []
+        for idx, part in enumerate(self.parts):
+            lo, hi = self.offsets[idx], self.offsets[idx + 1]
+            # NOTE: First index in [lo, hi) that is selected by `k`
+            first = (
+                start if start >= lo
+                else start + -(-(lo - start) // step) * step
+            )
+            end = min(stop, hi)
+            if first >= end:
+                continue
+            sub = list(key)
+            sub[self.axis] = slice(first - lo, end - lo, step)
+            out.append(part[tuple(sub)])
+
+        if len(out) == 0:
+            sub = list(key)
+            sub[self.axis] = slice(0, 0)
+            return self.parts[0][tuple(sub)].astype(self.dtype, copy=False)
+
+        axis = sum(
+            not isinstance(i, (int, np.integer)) for i in key[:self.axis]
+        )
+        return np.concatenate(out, axis=axis).astype(self.dtype, copy=False)
+
+
+def _open_arrays(
+        fpath: Path
+) -> tuple[dict[str, tuple[Any, list[str]]], Callable]:
+    """Returns `{name: (array, dims)}` for the data in `fpath`, and closer."""
+    if fpath.suffix == '.nc':
+        ds = xr.open_dataset(fpath)
+        arrays = {
+            str(name): (var.variable, list(map(str, var.dims)))
+            for name, var in ds.data_vars.items()
+        }
+        return arrays, ds.close
+
+    f = open_h5pyfile(fpath)
+    arrays = {}
+    for name, dset in f.items():
+        if not isinstance(dset, h5py.Dataset):
+            continue
+        dims = dset.attrs.get('dims', None)
+        dims = (
+            default_dims(dset.ndim) if dims is None
+            else [d.decode() if isinstance(d, bytes) else str(d) for d in dims]
+        )
+        mmap = _memmap(fpath, dset)
+        arrays[name] = (dset if mmap is None else mmap, dims)
+
+    return arrays, f.close
+
+
+def open_dataset(fpaths: os.PathLike | Sequence[os.PathLike]) -> xr.Dataset:
+    """Returns a lazy `xr.Dataset` view of the data saved in `fpaths`.
+
+    Each of `fpaths` is either a `.h5` file (written by `save_dataset` or
+    `H5Writer`) or a `.nc` file. Data from multiple files is concatenated
+    along `draw`, for variables (with matching shapes) in all of them.
+
+    NOTE: The underlying files are kept open until `dataset.close()`.
+    """
+    if isinstance(fpaths, (str, os.PathLike)):
+        fpaths = [fpaths]
+
+    closers = []
+    files = []
+    for fpath in fpaths:
+        arrays, closer = _open_arrays(Path(fpath))
+        files.append(arrays)
+        closers.append(closer)
+
+    if len(files) == 0:
+        raise ValueError('No files to open!')
+
+    def close():
+        for closer in closers:
+            closer()
+
+    variables = {}
+    for name, (_, dims) in files[0].items():
+        if any(name not in arrays for arrays in files[1:]):
+            log.warning(f'{name} missing from some files, skipping!')
+            continue
+        if 'draw' not in dims:
+            log.warning(f'{name} has no `draw` dimension, skipping!')
+            continue
+        order = sorted(dims, key=lambda d: DIMS_ORDER.get(d, 2))
+        try:
+            parts = [ArrayPart(*arrays[name], order=order) for arrays in files]
+        except ValueError:
+            log.warning(f'Inconsistent dimensions for {name}, skipping!')
+            continue
+        axis = order.index('draw')
+        other = {p.shape[:axis] + p.shape[axis + 1:] for p in parts}
+        if len(other) > 1:
+            log.warning(f'Inconsistent shapes for {name}, skipping!')
+            continue
+        array = indexing.LazilyIndexedArray(ConcatArray(parts, axis=axis))
+        variables[name] = xr.Variable(order, array)
+
+    # NOTE: Drop variables whose number of draws differs from the rest
+    ndraws = Counter(v.sizes['draw'] for v in variables.values())
+    if len(ndraws) > 1:
+        nmax = ndraws.most_common(1)[0][0]
+        for name in list(variables.keys()):
+            if variables[name].sizes['draw'] != nmax:
+                log.warning(f'{name} has an unexpected number of draws!')
+                variables.pop(name)
+
+    sizes = {}
+    for var in variables.values():
+        sizes.update(var.sizes)
+    coords = {dim: np.arange(size) for dim, size in sizes.items()}
+    dataset = xr.Dataset(variables, coords=coords)
+    dataset.set_close(close)
+
+    return dataset
+
+
+def find_datafile(jobdir: os.PathLike, job_type: str) -> Optional[Path]:
+    """Returns the file containing (saved) data from `jobdir`, if any.
+
+    In order of preference: `{job_type}_data.h5`, `{job_type}_dataset.nc`,
+    then the (streamed) `{job_type}_stream.h5`.
+    """
+    datadir = Path(jobdir).joinpath('data')
+    for fname in [
+            f'{job_type}_data.h5',
+            f'{job_type}_dataset.nc',
+            f'{job_type}_stream.h5',
+    ]:
+        fpath = datadir.joinpath(fname)
+        if fpath.is_file():
+            return fpath
+
+    return None
+
+
+def load_runs(
+        job_type: str = 'eval',
+        outdirs_file: Optional[os.PathLike] = None,
+        jobdirs: Optional[Sequence[os.PathLike]] = None,
+) -> xr.Dataset:
+    """Returns lazy view of `job_type` data from multiple runs.
+
+    Runs are taken from `jobdirs` if provided, otherwise from (the
+    `job_type` entries of) `outdirs_file`, by default `outputs/outdirs.log`.
+    """
+    if jobdirs is None:
+        if outdirs_file is None:
+            from l2hmc.configs import OUTDIRS_FILE
+            outdirs_file = OUTDIRS_FILE
+        with open(outdirs_file, 'r') as f:
+            lines = [line.strip() for line in f.readlines()]
+        jobdirs = [
+            Path(line) for line in dict.fromkeys(lines)
+            if len(line) > 0 and Path(line).name == job_type
+        ]
+
+    fpaths = []
+    for jobdir in jobdirs:
+        fpath = find_datafile(jobdir, job_type=job_type)
+        if fpath is None:
+            log.warning(f'No {job_type} data found in {jobdir}, skipping!')
+            continue
+        fpaths.append(fpath)
+
+    return open_dataset(fpaths)
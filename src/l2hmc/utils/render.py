@@ -0,0 +1,235 @@
+"""
+render.py
+
+Contains helpers for rendering the plots of a dataset in parallel, with each
+figure drawn in a worker process using the (non-interactive) Agg backend.
+
+Before plotting, arrays are downsampled: traces are min / max decimated to
+`max_points` draws (so that spikes remain visible) and densities are
+estimated from a strided subsample. Figures whose underlying data (and
+options) haven't changed since they were last rendered are skipped, using
+a content hash stored in `outdir/.plot_hashes.json`.
+"""
+from __future__ import absolute_import, annotations, division, print_function
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import json
+import logging
+import multiprocessing as mp
+import os
+from pathlib import Path
+from typing import Any, Optional, Sequence
+
+import numpy as np
+import xarray as xr
+
+
+log = logging.getLogger(__name__)
+
+# NOTE: Max number of draws (per chain) in each (decimated) trace
+MAX_POINTS = 2000
+# NOTE: Max number of chains to include in each plot
+MAX_CHAINS = 128
+HASHFILE = '.plot_hashes.json'
+
+
+def decimate(val: xr.DataArray, max_points: int = MAX_POINTS) -> xr.DataArray:
+    """Min / max decimation of `val` along `draw`, to `max_points` draws.
+
+    Draws are split into `max_points // 2` bins, each of which is replaced
+    by its (NaN-ignoring) min and max, placed at 1/4 and 3/4 of the bin.
+    """
+    ndraws = val.sizes['draw']
+    if ndraws <= max_points:
+        return val
+    nbins = max(1, max_points // 2)
+    axis = val.get_axis_num('draw')
+    edges = np.linspace(0, ndraws, nbins + 1).astype(int)
+    starts, widths = edges[:-1], np.diff(edges)
+    arr = val.values
+    lo = np.fmin.reduceat(arr, starts, axis=axis)
+    hi = np.fmax.reduceat(arr, starts, axis=axis)
+    shape = list(arr.shape)
+    shape[axis] = 2 * nbins
+    out = np.stack([lo, hi], axis=axis + 1).reshape(shape)
+    draws = np.stack([
+        starts + 0.25 * widths, starts + 0.75 * widths
+    ], axis=-1).reshape(-1)
+    coords = {
+        dim: val.coords[dim] for dim in val.dims
+        if dim != 'draw' and dim in val.coords
+    }
+    coords['draw'] = draws
+    return xr.DataArray(out, dims=val.dims, coords=coords, name=val.name)
+
+
+def subsample(val: xr.DataArray, max_points: int = MAX_POINTS) -> xr.DataArray:
+    """Returns (strided) subsample of `val`, with <= `max_points` draws."""
+    stride = int(np.ceil(val.sizes['draw'] / max(1, max_points)))
+    return val if stride <= 1 else val.isel(draw=slice(None, None, stride))
+
+
+def content_hash(val: xr.DataArray, **options: Any) -> str:
+    """Returns hash of (the underlying array of) `val` and plot `options`."""
+    arr = np.ascontiguousarray(val.values)
+    h = hashlib.blake2b(digest_size=16)
+    h.update(json.dumps({
+        'dims': list(val.dims),
+        'shape': list(arr.shape),
+        'dtype': str(arr.dtype),
+        **options,
+    }, sort_keys=True, default=str).encode())
+    h.update(memoryview(arr).cast('B'))
+    return h.hexdigest()
+
+
+def get_outfile(outdir: os.PathLike, name: str, fmt: str) -> Path:
+    """`.svg` files are saved to `outdir`, all others to `outdir/{fmt}s`."""
+    outdir = Path(outdir)
+    if fmt == 'svg':
+        return outdir.joinpath(f'{name}.{fmt}')
+    return outdir.joinpath(f'{fmt}s', f'{name}.{fmt}')
+
+
+def _init_worker() -> None:
+    import matplotlib
+    matplotlib.use('Agg')
+
+
+def _render(job: dict) -> tuple[str, Optional[str]]:
+    """Render (and save) the figure specified by `job`.
+
+    Returns `(name, error)`, with `error = None` on success.
+    """
+    import matplotlib.pyplot as plt
+    from l2hmc.utils.plot_helpers import make_ridgeplots, plot_dataArray
+    name, key, val = job['name'], job['key'], job['val']
+    try:
+        with plt.rc_context():
+            if job['kind'] == 'ridgeplot':
+                fig, _, _ = make_ridgeplots(
+                    xr.Dataset({key: val}),
+                    num_chains=job['nchains'],
+                    drop_nans=True,
+                    drop_zeros=False,
+                )
+            else:
+                fig, _, _ = plot_dataArray(val,
+                                           key=key,
+                                           title=job['title'],
+                                           line_labels=False,
+                                           num_chains=job['nchains'],
+                                           density=job['density'])
+            for outfile in job['outfiles']:
+                Path(outfile).parent.mkdir(exist_ok=True, parents=True)
+                fig.savefig(outfile, dpi=job['dpi'], bbox_inches='tight')
+    except Exception as exc:
+        return name, f'{type(exc).__name__}: {exc}'
+    finally:
+        plt.close('all')
+
+    return name, None
+
+
+def render_dataset(
+        dataset: xr.Dataset,
+        outdir: os.PathLike,
+        title: Optional[str] = None,
+        nchains: Optional[int] = 10,
+        formats: Sequence[str] = ('svg', 'png'),
+        dpi: int = 500,
+        num_workers: Optional[int] = None,
+        max_points: int = MAX_POINTS,
+        max_chains: int = MAX_CHAINS,
+        ridgeplots: bool = True,
+) -> list[Path]:
+    """Plot all variables in `dataset` (and ridgeplots), in parallel.
+
+    Each figure is saved in each of `formats` (see `get_outfile`), and
+    rendered in one of `num_workers` processes (by default, one per CPU).
+    With `num_workers <= 1`, figures are rendered serially, in process.
+
+    Returns the list of (newly) saved files.
+    """
+    outdir = Path(outdir)
+    outdir.mkdir(exist_ok=True, parents=True)
+    hashfile = outdir.joinpath(HASHFILE)
+    hashes = {}
+    if hashfile.is_file():
+        with open(hashfile, 'r') as f:
+            hashes = json.load(f)
+
+    jobs = []
+    hashed = {}
+    nskipped = 0
+    for key, val in dataset.data_vars.items():
+        key = str(key)
+        if key == 'x' or 'draw' not in val.dims:
+            continue
+        if 'chain' in val.dims:
+            val = val.isel(chain=slice(0, max_chains))
+        kinds = ['plot']
+        if ridgeplots and 'leapfrog' in val.dims:
+            kinds.append('ridgeplot')
+        for kind in kinds:
+            name = key if kind == 'plot' else f'{key}_ridgeplot'
+            options = {
+                'kind': kind, 'title': title, 'nchains': nchains,
+                'dpi': dpi, 'max_points': max_points,
+            }
+            digest = content_hash(val, **options)
+            outfiles = [get_outfile(outdir, name, fmt) for fmt in formats]
+            if (
+                    hashes.get(name, None) == digest
+                    and all(f.is_file() for f in outfiles)
+            ):
+                nskipped += 1
+                continue
+            job = {
+                'name': name,
+                'key': key,
+                'kind': kind,
+                'title': title,
+                'nchains': nchains,
+                'dpi': dpi,
+                'outfiles': [f.as_posix() for f in outfiles],
+            }
+            if kind == 'plot':
+                job.update({
+                    'val': decimate(val, max_points=max_points),
+                    'density': subsample(val, max_points=max_points),
+                })
+            else:
+                job['val'] = subsample(val, max_points=max_points)
+            jobs.append(job)
+            hashed[name] = digest
+
+    if nskipped > 0:
+        log.info(f'Skipping {nskipped} unchanged figures in {outdir}')
+
+    if num_workers is None:
+        num_workers = os.cpu_count() or 1
+    num_workers = max(1, min(num_workers, len(jobs)))
+    if num_workers <= 1:
+        results = [_render(job) for job in jobs]
+    else:
+        log.info(f'Rendering {len(jobs)} figures w/ {num_workers} workers')
+        with ProcessPoolExecutor(
+                max_workers=num_workers,
+                mp_context=mp.get_context('spawn'),
+                initializer=_init_worker,
+        ) as executor:
+            results = list(executor.map(_render, jobs))
+
+    saved = []
+    for job, (name, error) in zip(jobs, results):
+        if error is not None:
+            log.error(f'Unable to plot {name}: {error}')
+            continue
+        hashes[name] = hashed[name]
+        saved.extend([Path(f) for f in job['outfiles']])
+
+    with open(hashfile, 'w') as f:
+        json.dump(hashes, f, indent=2)
+
+    return saved
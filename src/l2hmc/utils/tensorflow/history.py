@@ -48,10 +48,7 @@ class History(BaseHistory):
         if isinstance(val, list):
             val = np.array(val)
 
-        try:
-            self.history[key].append(val)
-        except KeyError:
-            self.history[key] = [val]
+        self._append(key, val)
 
         if isinstance(val, (float, int)):
             return val
@@ -0,0 +1,87 @@
+"""
+worker.py
+
+Contains implementation of `BackgroundWorker`, a single background thread
+for running (e.g. logging) callables off of the main training loop.
+"""
+from __future__ import absolute_import, annotations, division, print_function
+from concurrent.futures import Future
+import logging
+import queue
+import threading
+from typing import Any, Callable, Optional
+
+
+log = logging.getLogger(__name__)
+
+
+class BackgroundWorker:
+    """Runs submitted callables, in order, on a single background thread.
+
+    Jobs are held in a bounded queue so that, if the worker falls behind,
+    `submit` blocks (backpressure) instead of letting pending jobs (and the
+    tensors they reference) pile up in memory.
+
+    Example:
+        >>> worker = BackgroundWorker(maxsize=8)
+        >>> future = worker.submit(sum, [1, 2, 3])
+        >>> worker.flush()  # wait for all pending jobs to finish
+        >>> future.result()
+        6
+    """
+    def __init__(self, maxsize: int = 8, name: str = 'BackgroundWorker'):
+        self.name = name
+        self._queue = queue.Queue(maxsize=max(1, maxsize))
+        self._thread: Optional[threading.Thread] = None
+        self._error: Optional[BaseException] = None
+
+    def _start(self) -> None:
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run,
+                                            name=self.name,
+                                            daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            job = self._queue.get()
+            try:
+                if job is None:
+                    return
+                future, fn, args, kwargs = job
+                if future.set_running_or_notify_cancel():
+                    try:
+                        future.set_result(fn(*args, **kwargs))
+                    except BaseException as exc:
+                        log.exception(f'Error in {self.name}')
+                        self._error = exc
+                        future.set_exception(exc)
+            finally:
+                self._queue.task_done()
+
+    def _raise_error(self) -> None:
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise RuntimeError(f'Error in {self.name}') from error
+
+    def submit(self, fn: Callable, *args: Any, **kwargs: Any) -> Future:
+        """Queue `fn(*args, **kwargs)`, blocking while the queue is full."""
+        self._raise_error()
+        self._start()
+        future = Future()
+        self._queue.put((future, fn, args, kwargs))
+        return future
+
+    def flush(self) -> None:
+        """Block until every queued job has finished."""
+        if self._thread is not None:
+            self._queue.join()
+        self._raise_error()
+
+    def close(self) -> None:
+        """Finish any queued jobs and stop the worker thread."""
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        self._thread = None
+        self._raise_error()
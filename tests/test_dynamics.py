@@ -0,0 +1,194 @@
+"""
+tests/test_dynamics.py
+
+Tests for the (pytorch) `Dynamics`, on a small U(1) lattice.
+"""
+from __future__ import absolute_import, division, print_function, annotations
+
+import numpy as np
+import pytest
+import torch
+
+from l2hmc.configs import DynamicsConfig, InputSpec, NetworkConfig
+from l2hmc.dynamics.pytorch.dynamics import Dynamics, State
+from l2hmc.lattice.u1.pytorch.lattice import LatticeU1
+from l2hmc.network.pytorch.network import (
+    NetworkFactory,
+    from_stacked_state_dict,
+    to_stacked_state_dict,
+)
+
+
+NCHAINS = 6
+LATVOLUME = [4, 4]
+
+
+@pytest.fixture(autouse=True)
+def float64():
+    dtype = torch.get_default_dtype()
+    torch.set_default_dtype(torch.float64)
+    yield
+    torch.set_default_dtype(dtype)
+
+
+def build(
+        nleapfrog: int = 3,
+        use_batch_norm: bool = False,
+        seed: int = 0,
+        **kwargs,
+) -> Dynamics:
+    # NOTE: The (x update) masks are drawn with numpy
+    np.random.seed(seed)
+    torch.manual_seed(seed)
+    config = DynamicsConfig(
+        nchains=NCHAINS,
+        group='U1',
+        latvolume=LATVOLUME,
+        nleapfrog=nleapfrog,
+        eps=0.1,
+        **kwargs,
+    )
+    xdim = config.xdim
+    input_spec = InputSpec(
+        xshape=tuple(config.xshape),
+        vnet={'v': [xdim], 'x': [xdim]},
+        xnet={'v': [xdim], 'x': [xdim, 2]},
+    )
+    network_config = NetworkConfig(
+        units=[8, 8],
+        activation_fn='tanh',
+        dropout_prob=0.,
+        use_batch_norm=use_batch_norm,
+    )
+    lattice = LatticeU1(NCHAINS, LATVOLUME)
+    return Dynamics(
+        config=config,
+        potential_fn=lattice.action,
+        force_fn=lattice.force,
+        network_factory=NetworkFactory(
+            input_spec=input_spec, network_config=network_config
+        ),
+    )
+
+
+def random_state(beta: float | torch.Tensor = 1.5) -> State:
+    gen = torch.Generator().manual_seed(1)
+    xdim = LATVOLUME[0] * LATVOLUME[1] * 2
+    x = torch.pi * (2 * torch.rand(NCHAINS, xdim, generator=gen) - 1)
+    v = torch.randn(NCHAINS, xdim, generator=gen)
+    return State(x=x, v=v, beta=torch.as_tensor(beta))
+
+
+@pytest.mark.parametrize('separate,split,batch_norm', [
+    (True, True, False),
+    (True, False, False),
+    (False, True, False),
+    (True, True, True),
+])
+def test_stacked_state_dict(separate, split, batch_norm):
+    kwargs = dict(
+        use_separate_networks=separate,
+        use_split_xnets=split,
+        use_batch_norm=batch_norm,
+    )
+    dynamics = build(**kwargs)
+    state_dict = dynamics.state_dict()
+    if separate and split:
+        assert 'networks.xnet.0.first.x_layer.weight' in state_dict
+    stacked = build(use_stacked_networks=True, **kwargs)
+    stacked.load_state_dict(to_stacked_state_dict(state_dict))
+    state = random_state()
+    for forward in (True, False):
+        out, metrics = dynamics.transition_kernel(state, forward=forward)
+        sout, smetrics = stacked.transition_kernel(state, forward=forward)
+        torch.testing.assert_close(sout.x, out.x, rtol=0., atol=1e-12)
+        torch.testing.assert_close(sout.v, out.v, rtol=0., atol=1e-12)
+        torch.testing.assert_close(
+            smetrics['sumlogdet'], metrics['sumlogdet'], rtol=0., atol=1e-12
+        )
+    # NOTE: The round trip recovers the per-step layout exactly
+    back = from_stacked_state_dict(stacked.state_dict())
+    assert sorted(back) == sorted(state_dict)
+    for key, val in state_dict.items():
+        assert torch.equal(back[key], val), key
+    dynamics.load_state_dict(back)
+
+
+@pytest.mark.parametrize('beta', [
+    1.5,
+    torch.tensor(1.5),
+    torch.tensor([0.5, 1., 1.5, 2., 3., 4.]),
+], ids=['float', 'scalar', 'per_chain'])
+@pytest.mark.parametrize('verbose', [True, False])
+def test_partitioned_matches_apply_transition(beta, verbose, monkeypatch):
+    dynamics = build(verbose=verbose)
+    state = random_state(beta)
+    # NOTE: Fix the directions, acceptance and momenta of every chain
+    mf = torch.tensor([1., 0., 1., 1., 0., 0.])
+    u = torch.rand(NCHAINS, generator=torch.Generator().manual_seed(2))
+    monkeypatch.setattr(torch, 'randn_like', lambda _: state.v.clone())
+    monkeypatch.setattr(dynamics, '_get_direction_masks',
+                        lambda batch_size: (mf, 1. - mf))
+    monkeypatch.setattr(dynamics, '_get_accept_masks',
+                        lambda px: ((px > u).float(), (px <= u).float()))
+    inputs = (state.x, beta)
+    xout, metrics = dynamics.apply_transition(inputs)
+    pxout, pmetrics = dynamics.apply_transition_partitioned(inputs)
+    torch.testing.assert_close(pxout, xout, rtol=0., atol=1e-12)
+    assert sorted(pmetrics) == sorted(metrics)
+    for key in ('init', 'proposed', 'out'):
+        for attr in ('x', 'v'):
+            torch.testing.assert_close(
+                getattr(getattr(pmetrics['mc_states'], key), attr),
+                getattr(getattr(metrics['mc_states'], key), attr),
+                rtol=0., atol=1e-12,
+            )
+    for key, val in metrics.items():
+        if key == 'mc_states':
+            continue
+        pval = pmetrics[key]
+        torch.testing.assert_close(pval, val, rtol=0., atol=1e-12,
+                                   msg=lambda m: f'{key}: {m}')
+
+
+@pytest.mark.parametrize('kernel', ['fwd', 'bwd', 'fb'])
+@pytest.mark.parametrize('use_ncp', [True, False])
+def test_reversible_backprop_gradients(kernel, use_ncp, monkeypatch):
+    dynamics = build(use_ncp=use_ncp, reversible_backprop=True)
+    assert dynamics._use_reversible()
+    state = random_state()
+
+    def _grads() -> dict[str, torch.Tensor]:
+        dynamics.zero_grad()
+        x = state.x.clone().requires_grad_(True)
+        init = State(x=x, v=state.v, beta=state.beta)
+        if kernel == 'fb':
+            out, metrics = dynamics.transition_kernel_fb(init)
+        else:
+            out, metrics = dynamics.transition_kernel(
+                init, forward=(kernel == 'fwd')
+            )
+        dx = (1. - torch.cos(out.x - x)).sum(-1)
+        loss = (
+            (metrics['acc'] * dx).sum()
+            + out.v.square().sum()
+            + metrics['sumlogdet'].sum()
+        )
+        loss.backward()
+        grads = {
+            name: p.grad.clone() for name, p in dynamics.named_parameters()
+            if p.grad is not None
+        }
+        assert x.grad is not None
+        grads['x'] = x.grad.clone()
+        return grads
+
+    grads = _grads()
+    # NOTE: The same (branch-keeping) updates, with plain autograd
+    monkeypatch.setattr(dynamics, '_use_reversible', lambda: False)
+    expected = _grads()
+    assert sorted(grads) == sorted(expected)
+    assert any(key.endswith('eps.0') for key in expected)
+    for key, val in expected.items():
+        torch.testing.assert_close(grads[key], val, rtol=1e-8, atol=1e-10,
+                                   msg=lambda m: f'{key}: {m}')
@@ -0,0 +1,114 @@
+"""
+tests/test_group_su3.py
+
+Tests for the closed-form SU(3) `expTAH3` and `logSU3` (pytorch).
+"""
+from __future__ import absolute_import, division, print_function, annotations
+
+import numpy as np
+import pytest
+import scipy.linalg
+import torch
+
+from l2hmc.group.pytorch import group as g
+
+
+ATOL = {torch.complex128: 1e-12, torch.complex64: 1e-4}
+
+
+def random_tah(
+        n: int,
+        scale: float,
+        dtype: torch.dtype,
+        degeneracy: float = 0.,
+        seed: int = 0,
+) -> torch.Tensor:
+    """Random traceless anti-Hermitian 3x3 X, with |X| <= `scale`.
+
+    If `degeneracy > 0`, two eigenvalues of X are only `degeneracy` apart.
+    """
+    gen = torch.Generator().manual_seed(seed)
+    h = torch.randn(n, 3, 3, dtype=torch.complex128, generator=gen)
+    h = 0.5 * (h + h.adjoint())
+    if degeneracy > 0:
+        _, vecs = torch.linalg.eigh(h)
+        a = torch.randn(n, dtype=torch.float64, generator=gen)
+        d = degeneracy * torch.randn(n, dtype=torch.float64, generator=gen)
+        evals = torch.stack([a, a + d, -2 * a - d], -1)
+        h = vecs @ torch.diag_embed(evals.to(h.dtype)) @ vecs.adjoint()
+    h = h - (g.trace(h) / 3.)[..., None, None] * torch.eye(3)
+    norm = torch.linalg.matrix_norm(h)[..., None, None]
+    r = torch.rand(n, 1, 1, dtype=torch.float64, generator=gen)
+    return (1j * scale * r * h / norm).to(dtype)
+
+
+def check_su3(u: torch.Tensor, atol: float) -> None:
+    eye = torch.eye(3, dtype=u.dtype).expand_as(u)
+    torch.testing.assert_close(u @ u.adjoint(), eye, rtol=0., atol=atol)
+    det = torch.linalg.det(u)
+    torch.testing.assert_close(det, torch.ones_like(det), rtol=0., atol=atol)
+
+
+def check_tah(y: torch.Tensor, atol: float) -> None:
+    torch.testing.assert_close(y, -y.adjoint(), rtol=0., atol=atol)
+    tr = g.trace(y)
+    torch.testing.assert_close(tr, torch.zeros_like(tr), rtol=0., atol=atol)
+
+
+@pytest.mark.parametrize('dtype', [torch.complex128, torch.complex64])
+@pytest.mark.parametrize('scale', [1e-3, 1., 3., 10., 30.])
+@pytest.mark.parametrize('degeneracy', [0., 1e-3, 1e-6])
+def test_exp_matches_expm(dtype, scale, degeneracy):
+    x = random_tah(500, scale, dtype, degeneracy)
+    u = g.expTAH3(x)
+    expected = scipy.linalg.expm(x.to(torch.complex128).numpy())
+    # NOTE: expm of X (with entries ~ |X|) loses ~ |X| ulps
+    atol = ATOL[dtype] * max(1., scale)
+    np.testing.assert_allclose(
+        u.to(torch.complex128).numpy(), expected, rtol=0., atol=atol
+    )
+    check_su3(u, ATOL[dtype])
+
+
+@pytest.mark.parametrize('dtype', [torch.complex128, torch.complex64])
+@pytest.mark.parametrize('degeneracy', [0., 1e-3, 1e-6])
+def test_log_matches_logm(dtype, degeneracy):
+    # NOTE: For |X| < 2.5 < π, the principal log of exp(X) is X itself
+    x = random_tah(500, 2.5, dtype, degeneracy)
+    u = torch.linalg.matrix_exp(x.to(torch.complex128))
+    y = g.logSU3(u.to(dtype))
+    expected = np.stack([scipy.linalg.logm(m) for m in u.numpy()])
+    np.testing.assert_allclose(
+        y.to(torch.complex128).numpy(), expected, rtol=0.,
+        atol=10 * ATOL[dtype],
+    )
+    check_tah(y, ATOL[dtype])
+
+
+@pytest.mark.parametrize('dtype', [torch.complex128, torch.complex64])
+@pytest.mark.parametrize('scale', [1., 3., 10., 30.])
+@pytest.mark.parametrize('degeneracy', [0., 1e-3, 1e-6])
+def test_log_round_trip(dtype, scale, degeneracy):
+    # NOTE: For |X| > π, log(exp(X)) != X, but exp(log(U)) == U
+    x = random_tah(2000, scale, dtype, degeneracy)
+    u = g.expTAH3(x)
+    y = g.logSU3(u)
+    assert torch.isfinite(torch.view_as_real(y)).all()
+    check_tah(y, ATOL[dtype] * max(1., scale))
+    atol = ATOL[dtype] * max(1., scale)
+    torch.testing.assert_close(g.expTAH3(y), u, rtol=0., atol=atol)
+
+
+@pytest.mark.parametrize('dtype', [torch.complex128, torch.complex64])
+@pytest.mark.parametrize('eps', [0., 1e-6, 1e-3, 1e-1])
+def test_log_near_center(dtype, eps):
+    # NOTE: All three eigenvalues of U ~ exp(±2πi / 3) are (nearly) equal
+    x = random_tah(200, eps, torch.complex128, seed=1)
+    z = torch.tensor(np.exp(2j * np.pi / 3.))
+    u = torch.cat([z * torch.linalg.matrix_exp(x),
+                   z.conj() * torch.linalg.matrix_exp(x)]).to(dtype)
+    y = g.logSU3(u)
+    check_tah(y, ATOL[dtype] * 10)
+    torch.testing.assert_close(
+        g.expTAH3(y), u, rtol=0., atol=10 * ATOL[dtype]
+    )
@@ -0,0 +1,37 @@
+"""
+tests/test_importtime.py
+
+Startup budget of the (pytorch) entry points, see `l2hmc.utils.importtime`.
+"""
+from __future__ import absolute_import, division, print_function, annotations
+
+import pytest
+
+from l2hmc.utils.importtime import measure
+
+
+# NOTE: Import time (s) in a fresh interpreter, most of which is torch and
+# accelerate for the trainer (~2-3s on a single CPU)
+BUDGETS = {
+    'l2hmc.experiment': 1.5,
+    'l2hmc.trainers.pytorch.trainer': 5.0,
+}
+
+# NOTE: Only imported when (and where) they are used
+DEFERRED = ('tensorflow', 'wandb', 'matplotlib', 'seaborn')
+
+
+@pytest.mark.parametrize('module', list(BUDGETS))
+def test_import_time_budget(module):
+    times = measure(module)
+    assert times[module] < BUDGETS[module], (
+        f'import {module} took {times[module]:.3f}s '
+        f'(budget: {BUDGETS[module]:.3f}s)'
+    )
+
+
+@pytest.mark.parametrize('module', list(BUDGETS))
+def test_heavy_imports_deferred(module):
+    times = measure(module)
+    imported = sorted(dep for dep in DEFERRED if dep in times)
+    assert imported == [], f'import {module} pulls in: {imported}'
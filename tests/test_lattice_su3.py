@@ -0,0 +1,157 @@
+"""
+tests/test_lattice_su3.py
+
+Tests for the (pytorch) `LatticeSU3`, against the numpy reference.
+"""
+from __future__ import absolute_import, division, print_function, annotations
+
+import math
+
+import numpy as np
+import pytest
+import torch
+
+from l2hmc.group.pytorch import group as g
+from l2hmc.lattice.su3.numpy.lattice import BaseLatticeSU3, PLAQ_DIRS
+from l2hmc.lattice.su3.pytorch.lattice import LatticeSU3
+
+
+# NOTE: Every extent differs, to catch any mixed up directions
+SHAPE = (4, 2, 3, 5)
+
+
+@pytest.fixture
+def float64():
+    dtype = torch.get_default_dtype()
+    torch.set_default_dtype(torch.float64)
+    yield
+    torch.set_default_dtype(dtype)
+
+
+def random_links(lattice: LatticeSU3) -> torch.Tensor:
+    torch.manual_seed(0)
+    return lattice.random()
+
+
+def roll(x: np.ndarray, mu: int, n: int = 1) -> np.ndarray:
+    """x(n + n * mu), for x.shape = [nb, nt, nx, ny, nz, 3, 3]."""
+    return np.roll(x, shift=-n, axis=mu + 1)
+
+
+def rectangle(x: np.ndarray, u: int, v: int) -> np.ndarray:
+    """Trace of the 1x2 (u, v) rectangle (two links in v), starting at n."""
+    xu, xv = x[:, u], x[:, v]
+    lhs = xu @ roll(xv, u) @ roll(roll(xv, u), v)
+    rhs = xv @ roll(xv, v) @ roll(xu, v, 2)
+    return np.trace(lhs @ rhs.conj().swapaxes(-1, -2), axis1=-2, axis2=-1)
+
+
+def gauge_transform(x: torch.Tensor, gt: torch.Tensor) -> torch.Tensor:
+    """U[u](n) -> G(n) U[u](n) G(n + u)†"""
+    return torch.stack([
+        gt @ x[:, u] @ gt.roll(-1, dims=1 + u).adjoint()
+        for u in range(x.shape[1])
+    ], dim=1)
+
+
+def constant_flux(L: int, n1: int, n2: int) -> torch.Tensor:
+    """Abelian links exp(i φ diag(1, -1, 0)), with n1 (n2) units of flux
+    through every (0, 1) ((2, 3)) plane of an L^4 lattice."""
+    phi = torch.zeros(1, 4, L, L, L, L, dtype=torch.float64)
+    idx = torch.arange(L, dtype=torch.float64)
+    for (a, b), n in [((0, 1), n1), ((2, 3), n2)]:
+        sa, sb = [1] * 4, [1] * 4
+        sa[a], sb[b] = L, L
+        phi[:, b] += 2 * math.pi * n * idx.reshape(sa) / L ** 2
+        # NOTE: The twist on the boundary in `a` keeps the field periodic
+        last = [slice(None)] * 4
+        last[a] = L - 1
+        twist = (2 * math.pi * n * idx.reshape(sb) / L).expand(L, L, L, L)
+        phi[(slice(None), a, *last)] -= twist[tuple(last)]
+    t = torch.tensor([1., -1., 0.], dtype=torch.float64)
+    return torch.diag_embed(torch.exp(1j * phi[..., None] * t))
+
+
+@pytest.mark.parametrize('dtype', [torch.float32, torch.float64])
+def test_random_is_su3(dtype):
+    default = torch.get_default_dtype()
+    torch.set_default_dtype(dtype)
+    try:
+        x = LatticeSU3(2, SHAPE).random()
+    finally:
+        torch.set_default_dtype(default)
+    assert x.dtype == (
+        torch.complex64 if dtype == torch.float32 else torch.complex128
+    )
+    atol = 1e-6 if dtype == torch.float32 else 1e-14
+    eye = torch.eye(3, dtype=x.dtype).expand_as(x)
+    torch.testing.assert_close(x @ x.adjoint(), eye, rtol=0., atol=atol)
+    det = torch.linalg.det(x)
+    torch.testing.assert_close(det, torch.ones_like(det), rtol=0., atol=atol)
+
+
+def test_wilson_loops_match_numpy(float64):
+    pytest.importorskip('tensorflow')  # NOTE: Used by `BaseLatticeSU3`
+    nb = 2
+    lattice = LatticeSU3(nb, SHAPE)
+    x = random_links(lattice)
+    plaqs, rects = lattice._wilson_loops(x, needs_rect=True)
+    xn = x.numpy()
+    ref = BaseLatticeSU3(nb, SHAPE)
+    expected = np.stack([
+        np.asarray(ref._plaquette(xn, u, v)) for u, v in PLAQ_DIRS
+    ])
+    np.testing.assert_allclose(plaqs.numpy(), expected, rtol=0., atol=1e-12)
+    # NOTE: Ordered as (2x1 in u, 1x2 in v) for each (u, v) in PLAQ_DIRS
+    expected = np.stack([
+        r for u, v in PLAQ_DIRS
+        for r in (rectangle(xn, v, u), rectangle(xn, u, v))
+    ])
+    np.testing.assert_allclose(rects.numpy(), expected, rtol=0., atol=1e-12)
+
+
+@pytest.mark.parametrize('c1', [0., -0.331])
+def test_grad_action_matches_finite_differences(float64, c1):
+    nb = 3
+    lattice = LatticeSU3(nb, SHAPE, c1=c1)
+    x = random_links(lattice)
+    beta = torch.tensor([1., 2.5, 6.], dtype=torch.float64)
+    dsdx = lattice.grad_action(x.clone(), beta, create_graph=False)
+    # NOTE: d/dt S(exp(tX) x) at t = 0, is Re tr(D† X) for X in su(3)
+    dirs = g.randTAH3(list(x.shape[:-2]))
+    expected = g.trace(dsdx.adjoint() @ dirs).real.flatten(1).sum(-1)
+    eps = 1e-5
+    splus = lattice.action(g.expTAH3(eps * dirs) @ x, beta)
+    sminus = lattice.action(g.expTAH3(-eps * dirs) @ x, beta)
+    fd = (splus - sminus) / (2 * eps)
+    torch.testing.assert_close(fd, expected, rtol=1e-7, atol=1e-7)
+
+
+@pytest.mark.parametrize('n1,n2', [(1, 1), (1, -2), (0, 3)])
+def test_int_charges_constant_flux(float64, n1, n2):
+    L = 8
+    lattice = LatticeSU3(1, (L, L, L, L))
+    x = constant_flux(L, n1, n2)
+    q = lattice.int_charges(x)
+    # NOTE: -> 2 n1 n2 in the continuum limit
+    th = 2 * math.pi / L ** 2
+    expected = L ** 4 * 2 * math.sin(n1 * th) * math.sin(n2 * th)
+    expected = torch.tensor([expected / (4 * math.pi ** 2)])
+    torch.testing.assert_close(q, expected, rtol=0., atol=1e-12)
+    # NOTE: The clover field (and so Q) is gauge invariant
+    torch.manual_seed(0)
+    gt = g.SU3().random([1, L, L, L, L, 3, 3])
+    qg = lattice.int_charges(gauge_transform(x, gt))
+    torch.testing.assert_close(qg, expected, rtol=0., atol=1e-10)
+
+
+def test_clover_is_gauge_covariant(float64):
+    lattice = LatticeSU3(2, SHAPE)
+    x = random_links(lattice)
+    gt = g.SU3().random([2, *SHAPE, 3, 3])
+    y = gauge_transform(x, gt)
+    for u, v in [(0, 1), (0, 3), (2, 3)]:
+        f = lattice._clover(x, u, v)
+        fg = lattice._clover(y, u, v)
+        expected = gt @ f @ gt.adjoint()
+        torch.testing.assert_close(fg, expected, rtol=0., atol=1e-12)
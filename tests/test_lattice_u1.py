@@ -0,0 +1,54 @@
+"""
+tests/test_lattice_u1.py
+
+Tests for the (pytorch) `LatticeU1`.
+"""
+from __future__ import absolute_import, division, print_function, annotations
+
+import pytest
+import torch
+
+from l2hmc.lattice.u1.pytorch.lattice import LatticeU1
+
+
+def random_links(lattice: LatticeU1) -> torch.Tensor:
+    torch.manual_seed(0)
+    return lattice.draw_uniform_batch(requires_grad=False).double()
+
+
+@pytest.mark.parametrize('shape', [(8, 8), (4, 12), (12, 6), (2, 3)])
+def test_force_matches_autograd(shape):
+    nb = 5
+    lattice = LatticeU1(nb, shape)
+    x = random_links(lattice)
+    beta = torch.tensor(2.5, dtype=torch.float64)
+    force = lattice.force(x, beta)
+    dsdx = lattice.grad_action(x.clone(), beta, create_graph=False)
+    assert force.shape == x.shape
+    torch.testing.assert_close(force, dsdx, rtol=0., atol=1e-12)
+
+
+@pytest.mark.parametrize('shape', [(8, 8), (4, 12)])
+def test_force_per_chain_beta(shape):
+    nb = 4
+    lattice = LatticeU1(nb, shape)
+    x = random_links(lattice)
+    beta = torch.tensor([0.5, 1., 2., 4.], dtype=torch.float64)
+    force = lattice.force(x, beta)
+    dsdx = lattice.grad_action(x.clone(), beta, create_graph=False)
+    torch.testing.assert_close(force, dsdx, rtol=0., atol=1e-12)
+    # NOTE: Each chain sees only its own beta
+    for idx, b in enumerate(beta):
+        fb = lattice.force(x, b)[idx]
+        torch.testing.assert_close(force[idx], fb, rtol=0., atol=1e-12)
+
+
+def test_force_is_periodic():
+    lattice = LatticeU1(3, (6, 10))
+    x = random_links(lattice)
+    beta = torch.tensor(1.)
+    shifted = x + 2 * torch.pi * torch.randint_like(x, -2, 3)
+    torch.testing.assert_close(
+        lattice.force(shifted, beta), lattice.force(x, beta),
+        rtol=0., atol=1e-10,
+    )
@@ -0,0 +1,90 @@
+"""
+tests/test_sharding.py
+
+Tests for gathering per-chain metrics across ranks (and chunks of chains).
+"""
+from __future__ import absolute_import, division, print_function, annotations
+
+import numpy as np
+import pytest
+import torch
+
+from l2hmc.utils.pytorch.sharding import concat_chains, gather_chains
+
+
+def fake_gather(size: int):
+    """`Accelerator.gather` across `size` ranks, where rank r holds t + r."""
+    return lambda t: torch.cat([t + r for r in range(size)])
+
+
+def metrics(nchains: int, nlf: int) -> dict:
+    torch.manual_seed(0)
+    return {
+        'energy': torch.rand(nlf + 1, nchains),
+        'logdet': [torch.rand(nchains) for _ in range(nlf + 1)],
+        'acc': torch.rand(nchains),
+        'plaqs': torch.rand(nchains).numpy(),
+        # NOTE: One step size per leapfrog step (shared by all chains)
+        'xeps': torch.rand(2 * nlf),
+        'loss': torch.tensor(0.5),
+        'beta': 1.0,
+    }
+
+
+@pytest.mark.parametrize('nchains', [3, 6, 7])
+def test_gather_chains(nchains):
+    # NOTE: With nlf = 3, nchains = 6 = 2 * nlf and 7 = 2 * nlf + 1
+    nlf = 3
+    m = metrics(nchains, nlf)
+    out = gather_chains(m, nchains=nchains, gather_fn=fake_gather(2))
+    expected = torch.cat([m['energy'], m['energy'] + 1], dim=-1)
+    torch.testing.assert_close(out['energy'], expected)
+    assert out['energy'].dtype == m['energy'].dtype
+    for val, out_val in zip(m['logdet'], out['logdet']):
+        torch.testing.assert_close(out_val, torch.cat([val, val + 1]))
+    assert isinstance(out['plaqs'], np.ndarray)
+    np.testing.assert_allclose(
+        out['plaqs'], np.concatenate([m['plaqs'], m['plaqs'] + 1]), rtol=1e-6
+    )
+    # NOTE: Shared metrics are kept as is, scalars are averaged over ranks
+    assert out['xeps'] is m['xeps']
+    torch.testing.assert_close(out['loss'], torch.tensor(1.0))
+    assert out['beta'] == 1.0
+
+
+def test_gather_chains_dim():
+    x = torch.rand(4, 5)
+    out = gather_chains({'x': x, 'beta': torch.tensor(2.)}, nchains=4,
+                        gather_fn=fake_gather(3), dim=0)
+    torch.testing.assert_close(out['x'], torch.cat([x, x + 1, x + 2]))
+    torch.testing.assert_close(out['beta'], torch.tensor(3.))
+
+
+def test_gather_chains_wrong_axis():
+    with pytest.raises(ValueError, match='energy'):
+        gather_chains({'energy': torch.rand(4, 3)}, nchains=4,
+                      gather_fn=fake_gather(2))
+
+
+@pytest.mark.parametrize('sizes', [[4, 4, 4], [7, 7], [4, 3], [6, 6, 2]])
+def test_concat_chains(sizes):
+    # NOTE: With nlf = 3, chunks of 4 = nlf + 1 and 7 = 2 * nlf + 1 chains
+    nlf = 3
+    chunks = [metrics(n, nlf) for n in sizes]
+    out = concat_chains(chunks, sizes=sizes)
+    assert out['energy'].shape == (nlf + 1, sum(sizes))
+    torch.testing.assert_close(
+        out['energy'], torch.cat([c['energy'] for c in chunks], dim=-1)
+    )
+    assert len(out['logdet']) == nlf + 1
+    assert out['logdet'][0].shape == (sum(sizes),)
+    assert isinstance(out['plaqs'], np.ndarray)
+    assert out['plaqs'].shape == (sum(sizes),)
+    assert out['xeps'] is chunks[0]['xeps']
+    # NOTE: Scalars are averaged, weighted by the number of chains
+    losses = [0.1 * (i + 1) for i in range(len(sizes))]
+    for chunk, loss in zip(chunks, losses):
+        chunk['loss'] = torch.tensor(loss)
+    out = concat_chains(chunks, sizes=sizes)
+    expected = sum(n * loss for n, loss in zip(sizes, losses)) / sum(sizes)
+    torch.testing.assert_close(out['loss'], torch.tensor(expected))
@@ -0,0 +1,65 @@
+"""
+tests/test_tempering.py
+
+Tests for the replica layout of `BetaLadder` (pytorch).
+"""
+from __future__ import absolute_import, division, print_function, annotations
+
+import numpy as np
+import pytest
+import torch
+
+from l2hmc.utils.pytorch.tempering import BetaLadder
+
+
+def ladder(nreplicas: int, nchains: int) -> BetaLadder:
+    ladder = BetaLadder([float(k + 1) for k in range(nreplicas)])
+    ladder.init(torch.rand(nreplicas * nchains, 8))
+    return ladder
+
+
+def test_beta():
+    beta = ladder(3, 2).beta()
+    torch.testing.assert_close(beta, torch.tensor([1., 1., 2., 2., 3., 3.]))
+
+
+@pytest.mark.parametrize('nreplicas,nchains', [(2, 3), (4, 2), (3, 5)])
+def test_select(nreplicas, nchains):
+    # NOTE: With nlf = 3, 2 x 3 = 2 * nlf and 4 x 2 = 2 * nlf + 2 chains
+    nlf = 3
+    scan = ladder(nreplicas, nchains)
+    ntotal = nreplicas * nchains
+    metrics = {
+        'energy': torch.rand(2 * nlf + 1, ntotal),
+        'logdet': [torch.rand(ntotal) for _ in range(nlf + 1)],
+        'plaqs': np.random.rand(ntotal),
+        'xeps': torch.rand(2 * nlf),
+        'veps': torch.rand(ntotal),
+        'loss': np.float32(0.5),
+        'beta': 1.0,
+    }
+    out = scan.select(metrics)
+    idx = slice(ntotal - nchains, ntotal)
+    torch.testing.assert_close(out['energy'], metrics['energy'][:, idx])
+    for val, out_val in zip(metrics['logdet'], out['logdet']):
+        torch.testing.assert_close(out_val, val[idx])
+    assert isinstance(out['plaqs'], np.ndarray)
+    np.testing.assert_array_equal(out['plaqs'], metrics['plaqs'][idx])
+    # NOTE: Shared metrics are never sliced, even if they look per-chain
+    assert out['xeps'] is metrics['xeps']
+    assert out['veps'] is metrics['veps']
+    assert out['loss'] == metrics['loss']
+    assert out['beta'] == metrics['beta']
+
+
+def test_select_dim():
+    scan = ladder(2, 3)
+    x = torch.rand(6, 4)
+    out = scan.select({'x': x}, dim=0)
+    torch.testing.assert_close(out['x'], x[3:])
+
+
+def test_select_wrong_axis():
+    scan = ladder(2, 3)
+    with pytest.raises(ValueError, match='energy'):
+        scan.select({'energy': torch.rand(6, 4)})